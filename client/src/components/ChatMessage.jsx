@@ -3,6 +3,7 @@ import ReactMarkdown from 'react-markdown';
 import { Prism as SyntaxHighlighter } from 'react-syntax-highlighter';
 import { vscDarkPlus } from 'react-syntax-highlighter/dist/esm/styles/prism';
 import Plot from 'react-plotly.js';
+import { API_BASE_URL } from '../services/ApiService.js';
 
 export default function ChatMessage({ type, text, file, loading, error, isSummary }) {
   
@@ -272,7 +273,9 @@ export default function ChatMessage({ type, text, file, loading, error, isSummar
                       <div key={fidx} className="mt-4">
                         {figure.type === 'matplotlib' && (
                           <img 
-                            src={`data:image/png;base64,${figure.data}`}
+                            src={figure.url
+                              ? `${API_BASE_URL}${figure.url}`
+                              : `data:${figure.mime_type || 'image/png'};base64,${figure.data}`}
                             alt="Visualization"
                             className="max-w-full rounded-lg"
                           />
@@ -290,6 +293,11 @@ export default function ChatMessage({ type, text, file, loading, error, isSummar
                             className="w-full"
                           />
                         )}
+                        {figure.reduction?.length > 0 && (
+                          <p className="text-xs mt-1" style={{ color: 'var(--text-secondary)' }}>
+                            {figure.reduction.map(r => `${r.method === 'lttb' ? 'Downsampled' : 'Aggregated'} ${r.points_in.toLocaleString()} points`).join(', ')} for display
+                          </p>
+                        )}
                       </div>
                     ))}
                   </div>
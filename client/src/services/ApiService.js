@@ -1,10 +1,12 @@
 // API service for backend communication
 import axios from 'axios';
 
+export const API_BASE_URL = 'http://localhost:5000';
+
 class ApiService {
   constructor() {
     this.client = axios.create({
-      baseURL: 'http://localhost:5000',
+      baseURL: API_BASE_URL,
       timeout: 100000,
       headers: {
         'Content-Type': 'application/json'
@@ -29,10 +31,14 @@ class ApiService {
       history: formattedHistory
     });
     return response.data;
-  }  async sendFileMessage(file, message, history) {
+  }  async sendFileMessage(file, message, history, sessionId) {
     const formData = new FormData();
     formData.append('file', file);
     formData.append('message', message);
+    // Each chat gets its own execution kernel on the server
+    if (sessionId) {
+      formData.append('session_id', sessionId);
+    }
     
     // Format the history correctly for the API
     const formattedHistory = history?.map(msg => ({
@@ -58,13 +64,13 @@ class ApiService {
     }));
 
     const eventSource = new EventSource(
-      `http://localhost:5000/chat/stream`,
+      `${API_BASE_URL}/chat/stream`,
       { withCredentials: false }
     );
 
     // Send the message data via POST to initiate streaming
     try {
-      const response = await fetch('http://localhost:5000/chat/stream', {
+      const response = await fetch(`${API_BASE_URL}/chat/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
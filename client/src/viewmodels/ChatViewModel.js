@@ -136,7 +136,7 @@ export function useChatViewModel() {  const [chatHistory, setChatHistory] = useS
       
       if (file.hasFile()) {
         // File uploads still use non-streaming for now
-        response = await ApiService.sendFileMessage(file.file, message, activeChat.messages);
+        response = await ApiService.sendFileMessage(file.file, message, activeChat.messages, activeChat.id);
         
         // Update bot message with response
         activeChat.updateLastMessage({
@@ -1,14 +1,16 @@
 # Flask application
-from flask import Flask, jsonify
+from flask import Flask
 from flask_cors import CORS
 import os
 import logging
 import matplotlib
 matplotlib.use('Agg')
-import google.generativeai as genai
 import sys
 sys.path.append('.')
-from controllers import ChatController
+from controllers import ChatController, FigureController
+from utils.json_encoder import json_response
+from utils.gemini_factory import gemini_client_pool
+from utils.code_executor import enable_copy_on_write
 from config import config
 
 # Configure logging
@@ -19,7 +21,10 @@ logger = logging.getLogger(__name__)
 config.validate_config()
 
 # Configure Gemini
-genai.configure(api_key=config.GEMINI_API_KEY)
+gemini_client_pool.configure()
+
+# Shallow dataset copies for executed code
+enable_copy_on_write()
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -27,6 +32,7 @@ CORS(app)
 
 # Initialize controllers
 chat_controller = ChatController()
+figure_controller = FigureController()
 
 # Routes
 @app.route('/health', methods=['GET'])
@@ -34,19 +40,19 @@ def health_check():
     """Health check endpoint"""
     try:
         response, status_code = chat_controller.handle_health_check()
-        return jsonify(response), status_code
+        return json_response(response, status_code)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
 
 @app.route('/chat', methods=['POST'])
 def chat():
     """Main chat endpoint"""
     try:
         response, status_code = chat_controller.handle_chat_request()
-        return jsonify(response), status_code
+        return json_response(response, status_code)
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
 
 @app.route('/chat/stream', methods=['POST'])
 def chat_stream():
@@ -55,7 +61,27 @@ def chat_stream():
         return chat_controller.handle_chat_stream()
     except Exception as e:
         logger.error(f"Error in streaming chat endpoint: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
+
+@app.route('/chat/sequential/stream', methods=['POST'])
+def chat_sequential_stream():
+    """Sequential analysis endpoint that streams each step as it completes"""
+    try:
+        return chat_controller.handle_sequential_stream()
+    except Exception as e:
+        logger.error(f"Error in streamed sequential analysis endpoint: {e}")
+        return json_response({'error': str(e)}, 500)
+
+@app.route('/figures/<digest>', methods=['GET'])
+def get_figure(digest):
+    """Serve a generated figure by content digest"""
+    try:
+        return figure_controller.handle_figure_request(digest)
+    except Exception as e:
+        logger.error(f"Error serving figure {digest}: {e}")
+        return json_response({'error': str(e)}, 500)
 
 if __name__ == '__main__':
+    if config.GEMINI_PREWARM:
+        gemini_client_pool.warm_in_background()
     app.run(port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,182 @@
+# ASGI application (async serving mode)
+import logging
+import asyncio
+import contextlib
+import matplotlib
+matplotlib.use('Agg')
+import sys
+sys.path.append('.')
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import FileStorage
+from controllers import ChatController, FigureController
+from controllers.chat_controller import SSE_HEADERS, format_sse
+from utils.json_encoder import dumps
+from utils.async_executor import run_blocking, blocking_executor
+from utils.gemini_factory import gemini_client_pool
+from utils.code_executor import enable_copy_on_write
+from utils.resilience import CircuitOpenError
+from config import config
+
+# Configure logging
+logging.basicConfig(level=getattr(logging, config.LOG_LEVEL))
+logger = logging.getLogger(__name__)
+
+# Validate configuration
+config.validate_config()
+
+# Configure Gemini
+gemini_client_pool.configure()
+
+# Shallow dataset copies for executed code
+enable_copy_on_write()
+
+# Initialize controllers
+chat_controller = ChatController()
+figure_controller = FigureController()
+
+def json_response(payload, status: int = 200) -> Response:
+    return Response(dumps(payload), status_code=status, media_type='application/json')
+
+def _parse_if_none_match(header: str) -> set:
+    """Get the entity tags of an If-None-Match header, unquoted"""
+    tags = set()
+    for tag in (header or '').split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag:
+            tags.add(tag.strip('"'))
+    return tags
+
+def _as_file_storage(upload):
+    """Adapt a Starlette upload to the werkzeug FileStorage interface FileService expects"""
+    if upload is None or isinstance(upload, str) or not upload.filename:
+        return None
+    return FileStorage(stream=upload.file, filename=upload.filename, content_type=upload.content_type)
+
+# Routes
+async def health_check(request: Request) -> Response:
+    """Health check endpoint"""
+    try:
+        response, status_code = await run_blocking(chat_controller.handle_health_check)
+        return json_response(response, status_code)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+async def chat(request: Request) -> Response:
+    """Main chat endpoint"""
+    try:
+        # Handle both JSON and FormData requests
+        if 'multipart/form-data' in request.headers.get('content-type', ''):
+            async with request.form() as form:
+                # Saving (and ingesting) the upload is blocking work
+                context = await run_blocking(chat_controller.parse_form_payload, form, _as_file_storage(form.get('file')))
+        else:
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            if not data:
+                return json_response({'error': 'No data provided'}, 400)
+            context = chat_controller.parse_json_payload(data)
+        
+        if not context['chat_request'].message:
+            return json_response({'error': 'Message is required'}, 400)
+        
+        return json_response(await chat_controller.process_chat_async(context))
+    except CircuitOpenError as e:
+        logger.warning(f"Rejected chat request: {e}")
+        return json_response({'error': 'Service temporarily unavailable', 'details': str(e), 'retry_after': round(e.retry_after)}, 503)
+    except Exception as e:
+        logger.error(f"Error in chat endpoint: {e}")
+        return json_response({'error': 'Internal server error', 'details': str(e)}, 500)
+
+async def chat_stream(request: Request) -> Response:
+    """Streaming chat endpoint for real-time responses"""
+    try:
+        if 'application/json' not in request.headers.get('content-type', ''):
+            return json_response({'error': 'Content-Type must be application/json for streaming'}, 400)
+        
+        chat_request, plot_images = chat_controller.parse_stream_payload(await request.json())
+        if not chat_request.message:
+            return json_response({'error': 'Message is required'}, 400)
+        
+        async def generate_stream():
+            async for event in chat_controller.stream_chat_events_async(chat_request, plot_images):
+                yield format_sse(event)
+        
+        return StreamingResponse(generate_stream(), media_type='text/event-stream', headers=SSE_HEADERS)
+    except Exception as e:
+        logger.error(f"Error in streaming chat endpoint: {e}")
+        return json_response({'error': str(e)}, 500)
+
+async def chat_sequential_stream(request: Request) -> Response:
+    """Sequential analysis endpoint that streams each step as it completes"""
+    try:
+        if 'multipart/form-data' in request.headers.get('content-type', ''):
+            async with request.form() as form:
+                context = await run_blocking(chat_controller.parse_form_payload, form, _as_file_storage(form.get('file')))
+        else:
+            try:
+                data = await request.json()
+            except ValueError:
+                data = None
+            if not data:
+                return json_response({'error': 'No data provided'}, 400)
+            context = chat_controller.parse_json_payload(data)
+        
+        if not context['chat_request'].message:
+            return json_response({'error': 'Message is required'}, 400)
+        
+        async def generate_stream():
+            async for event in chat_controller.sequential_workflow.stream_sequential_analysis_async(
+                context['chat_request'], context['uploaded_file_path'], context['session_id']
+            ):
+                yield format_sse(event)
+        
+        return StreamingResponse(generate_stream(), media_type='text/event-stream', headers=SSE_HEADERS)
+    except Exception as e:
+        logger.error(f"Error in streamed sequential analysis endpoint: {e}")
+        return json_response({'error': str(e)}, 500)
+
+async def get_figure(request: Request) -> Response:
+    """Serve a generated figure by content digest"""
+    digest = request.path_params['digest']
+    try:
+        status, data, mime_type, headers = await run_blocking(
+            figure_controller.resolve_figure, digest, _parse_if_none_match(request.headers.get('if-none-match'))
+        )
+        return Response(data, status_code=status, media_type=mime_type, headers=headers)
+    except Exception as e:
+        logger.error(f"Error serving figure {digest}: {e}")
+        return json_response({'error': str(e)}, 500)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Runs in each worker's event loop, which the async Gemini channel is bound to
+    warmup = asyncio.create_task(gemini_client_pool.warm_async()) if config.GEMINI_PREWARM else None
+    yield
+    if warmup is not None:
+        warmup.cancel()
+    blocking_executor.shutdown()
+
+app = Starlette(
+    routes=[
+        Route('/health', health_check, methods=['GET']),
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat/stream', chat_stream, methods=['POST']),
+        Route('/chat/sequential/stream', chat_sequential_stream, methods=['POST']),
+        Route('/figures/{digest}', get_figure, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=5000)
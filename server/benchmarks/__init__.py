@@ -0,0 +1 @@
+# Microbenchmarks for the CPU-bound stages: code execution, figure capture, prompts and response formatting
@@ -0,0 +1,92 @@
+# Benchmarks for code execution and figure capture
+import tempfile
+import functools
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+import plotly.express as px
+from utils.code_executor import CodeExecutor
+from utils.dataset_profiler import DatasetProfiler
+from .harness import benchmark
+
+# Representative blocks from an analysis response
+SUMMARY_CODE = """numeric = df.select_dtypes('number')
+summary = numeric.describe()
+top = df['category'].value_counts().head(5)
+print(summary.shape, top.index[0])
+"""
+
+PLOT_CODE = """plt.figure(figsize=(10, 6))
+plt.hist(df['c0'].dropna(), bins=30)
+plt.title('Distribution of c0')
+show_plot()
+"""
+
+@functools.lru_cache(maxsize=1)
+def make_frame(rows: int, cols: int) -> pd.DataFrame:
+    """Synthetic dataset: float columns c0..c{cols-2} and a low-cardinality 'category' column"""
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame(rng.standard_normal((rows, max(1, cols - 1))), columns=[f'c{i}' for i in range(max(1, cols - 1))])
+    frame['category'] = pd.Categorical.from_codes(rng.integers(0, 8, rows), [f'group_{i}' for i in range(8)])
+    return frame
+
+def make_executor() -> CodeExecutor:
+    # An empty data directory keeps auto-detection out of the measurements
+    return CodeExecutor(tempfile.mkdtemp(prefix='datagent-bench-'))
+
+@benchmark('code_executor.create_namespace', params=['rows', 'cols'])
+def bench_create_namespace(rows, cols):
+    executor = make_executor()
+    df = make_frame(rows, cols)
+    return lambda: executor._create_namespace(df, ['bench.csv'])
+
+@benchmark('code_executor.execute_summary_block', params=['rows', 'cols'])
+def bench_execute_summary_block(rows, cols):
+    executor = make_executor()
+    namespace = executor._create_namespace(make_frame(rows, cols))
+    return lambda: executor.execute_code_block(SUMMARY_CODE, namespace=namespace)
+
+@benchmark('code_executor.execute_plot_block', params=['rows'])
+def bench_execute_plot_block(rows):
+    executor = make_executor()
+    namespace = executor._create_namespace(make_frame(rows, 5))
+    return lambda: executor.execute_code_block(PLOT_CODE, namespace=namespace)
+
+@benchmark('code_executor.save_current_figure', params=['figures', 'points'])
+def bench_save_current_figure(figures, points):
+    """Capture open matplotlib line plots, including the wait for their encodes"""
+    executor = make_executor()
+    rng = np.random.default_rng(0)
+    y = rng.standard_normal(points).cumsum()
+
+    def prepare():
+        plt.close('all')
+        for _ in range(figures):
+            plt.figure(figsize=(10, 6))
+            plt.plot(y)
+        executor.figures = []
+
+    def run(state):
+        executor._save_current_figure()
+        executor._collect_figures()
+
+    return prepare, run
+
+@benchmark('code_executor.handle_plotly_figure', params=['points'])
+def bench_handle_plotly_figure(points):
+    executor = make_executor()
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({'x': rng.standard_normal(points), 'y': rng.standard_normal(points)})
+
+    def prepare():
+        executor.figures = []
+        # Reduction modifies the figure in place, so each sample gets a fresh one
+        return px.scatter(frame, x='x', y='y')
+
+    return prepare, executor._handle_plotly_figure
+
+@benchmark('dataset_profiler.profile_dataframe', params=['rows', 'cols'])
+def bench_profile_dataframe(rows, cols):
+    profiler = DatasetProfiler()
+    df = make_frame(rows, cols)
+    return lambda: profiler.profile_dataframe(df)
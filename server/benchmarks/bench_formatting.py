@@ -0,0 +1,86 @@
+# Benchmarks for prompt building, response formatting and serialization
+from models.chat_models import ChatResponse, CodeExecution
+from utils.prompts import GeminiPrompts
+from utils.response_formatter import ResponseFormatter
+from utils.dataset_profiler import DatasetProfiler
+from .bench_execution import make_frame
+from .harness import benchmark
+
+SECTION = """## 📈 Visualization {index}: Distribution of c{index}
+**Purpose**: Shows the spread and skew of column c{index}, and whether it needs a log scale.
+```python
+plt.figure(figsize=(10, 6))
+plt.hist(df['c{index}'].dropna(), bins=30)
+plt.title('Distribution of c{index}')
+show_plot()
+```
+
+"""
+
+HISTORY = [
+    {'type': 'user' if i % 2 == 0 else 'assistant', 'content': f"Message {i}: " + "what does the distribution look like? " * 10}
+    for i in range(10)
+]
+
+# Roughly the size of an encoded 1000x600 PNG
+FIGURE_BYTES = 64 * 1024
+
+def make_response_text(blocks: int) -> str:
+    return "## 📊 Dataset Overview\nThe dataset has been profiled.\n\n" + ''.join(
+        SECTION.format(index=index) for index in range(blocks)
+    ) + "## 🎯 Recommendations\nInvestigate the strongest correlations."
+
+def make_code_outputs(blocks: int, figures: int = 1):
+    return [
+        {'output': f"block {index} done\n", 'error': None, 'figures': [
+            {'type': 'matplotlib', 'data': bytes(FIGURE_BYTES), 'mime_type': 'image/png', 'width': 1000, 'height': 600}
+            for _ in range(figures)
+        ]}
+        for index in range(blocks)
+    ]
+
+@benchmark('response_formatter.extract_code_blocks', params=['blocks'])
+def bench_extract_code_blocks(blocks):
+    text = make_response_text(blocks)
+    return lambda: ResponseFormatter.extract_code_blocks(text)
+
+@benchmark('response_formatter.format_response', params=['blocks'])
+def bench_format_response(blocks):
+    text = make_response_text(blocks)
+    outputs = make_code_outputs(blocks)
+    return lambda: ResponseFormatter.format_response(text, outputs)
+
+@benchmark('chat_response.to_dict', params=['blocks', 'figures'])
+def bench_chat_response_to_dict(blocks, figures):
+    """Serialize a rich response whose blocks each carry raw figure bytes"""
+    message = ResponseFormatter.format_response(make_response_text(blocks), make_code_outputs(blocks, figures))
+    executions = [CodeExecution(code=f"print({index})", output=f"{index}\n", execution_time=0.01) for index in range(blocks)]
+    response = ChatResponse(message=message, code_executions=executions, metadata={'model': 'bench'})
+    return response.to_dict
+
+@benchmark('prompts.format_dataset_profile', params=['cols'])
+def bench_format_dataset_profile(cols):
+    profile = DatasetProfiler().profile_dataframe(make_frame(1_000, cols))
+    return lambda: GeminiPrompts.format_dataset_profile(profile)
+
+@benchmark('prompts.get_data_analysis_prompt', params=['cols'])
+def bench_get_data_analysis_prompt(cols):
+    profile = DatasetProfiler().profile_dataframe(make_frame(1_000, cols))
+    plot_images = [{'description': f"Plot {index}"} for index in range(5)]
+    return lambda: GeminiPrompts.get_data_analysis_prompt(
+        "Analyze this dataset", 'datasets/bench.csv', HISTORY, plot_images, profile
+    )
+
+@benchmark('prompts.get_chat_prompt')
+def bench_get_chat_prompt():
+    return lambda: GeminiPrompts.get_chat_prompt("What is a p-value?", HISTORY, include_system_prompt=False)
+
+@benchmark('prompts.get_sequential_analysis_prompt')
+def bench_get_sequential_analysis_prompt():
+    return lambda: GeminiPrompts.get_sequential_analysis_prompt(
+        "Analyze this dataset", 'datasets/bench.csv', "Plot 1: Distribution of c0"
+    )
+
+@benchmark('prompts.get_system_prompt')
+def bench_get_system_prompt():
+    return GeminiPrompts.get_system_prompt
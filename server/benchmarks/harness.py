@@ -0,0 +1,145 @@
+# Minimal benchmark harness: registry, parameter sweeps, timing and baseline comparison
+import os
+import sys
+import json
+import time
+import platform
+import itertools
+import statistics
+import logging
+from typing import Callable, Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# name -> (function, swept parameter names)
+BENCHMARKS = {}
+
+SWEEPS = {
+    'quick': {'rows': [1_000, 100_000], 'cols': [5, 20], 'figures': [1, 4], 'points': [1_000, 100_000], 'blocks': [2, 10]},
+    'default': {'rows': [1_000, 100_000, 1_000_000], 'cols': [5, 20, 50], 'figures': [1, 4, 8],
+                'points': [1_000, 100_000, 1_000_000], 'blocks': [2, 10, 50]},
+    'full': {'rows': [1_000, 100_000, 1_000_000, 10_000_000], 'cols': [5, 20, 50, 200], 'figures': [1, 4, 8, 16],
+             'points': [1_000, 100_000, 1_000_000, 10_000_000], 'blocks': [2, 10, 50, 200]},
+}
+
+# Combinations whose size parameters multiply to more than this are skipped (10M rows x 5 columns still runs)
+SIZE_PARAMS = ('rows', 'cols', 'figures', 'points')
+MAX_CELLS = 50_000_000
+
+def benchmark(name: str, params: List[str] = ()):
+    """Register a benchmark swept over the named parameters.
+
+    The decorated function receives one value per parameter and returns either
+    a callable to time, or a (prepare, run) pair: prepare() is called untimed
+    before each sample and its result passed to run().
+    """
+    def register(func):
+        BENCHMARKS[name] = (func, list(params))
+        return func
+    return register
+
+def get_cases(sweep: str, pattern: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Expand the registered benchmarks into one case per parameter combination of a sweep"""
+    values = SWEEPS[sweep]
+    cases = []
+    for name, (func, params) in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        for combination in itertools.product(*(values[param] for param in params)):
+            kwargs = dict(zip(params, combination))
+            cells = 1
+            for param in SIZE_PARAMS:
+                cells *= kwargs.get(param, 1)
+            if cells > MAX_CELLS:
+                continue
+            cases.append({'name': name, 'params': kwargs, 'func': func})
+    return cases
+
+def case_key(name: str, params: Dict[str, Any]) -> str:
+    return name + ''.join(f"[{key}={value}]" for key, value in sorted(params.items()))
+
+def time_case(func: Callable, params: Dict[str, Any], repeat: int = 5, min_sample_time: float = 0.05) -> Dict[str, float]:
+    """Time one case and return per-call seconds (median, min, stdev)"""
+    target = func(**params)
+    samples = []
+    if isinstance(target, tuple):
+        prepare, run = target
+        for _ in range(repeat):
+            state = prepare()
+            start = time.perf_counter()
+            run(state)
+            samples.append(time.perf_counter() - start)
+    else:
+        # Loop fast calls so each sample is long enough to measure
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                target()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_sample_time or number >= 1_000_000:
+                break
+            number *= 10
+        samples.append(elapsed / number)
+        for _ in range(repeat - 1):
+            start = time.perf_counter()
+            for _ in range(number):
+                target()
+            samples.append((time.perf_counter() - start) / number)
+    return {
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'samples': len(samples)
+    }
+
+def machine_info() -> Dict[str, Any]:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count()
+    }
+
+def load_results(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_results(path: str, results: Dict[str, Any]):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> Dict[str, List[Dict[str, Any]]]:
+    """Compare medians with a baseline; a case regresses when it is more than `threshold` slower"""
+    comparison = {'regressions': [], 'improvements': [], 'unchanged': [], 'new': []}
+    baseline_cases = baseline.get('cases', {})
+    for key, timing in results['cases'].items():
+        previous = baseline_cases.get(key)
+        if previous is None:
+            comparison['new'].append({'case': key})
+            continue
+        ratio = timing['median'] / previous['median'] if previous['median'] else float('inf')
+        entry = {'case': key, 'baseline': previous['median'], 'current': timing['median'], 'ratio': ratio}
+        if ratio > 1 + threshold:
+            comparison['regressions'].append(entry)
+        elif ratio < 1 / (1 + threshold):
+            comparison['improvements'].append(entry)
+        else:
+            comparison['unchanged'].append(entry)
+    return comparison
+
+def format_seconds(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+def print_progress(message: str):
+    sys.stderr.write(message + '\n')
+    sys.stderr.flush()
@@ -0,0 +1,79 @@
+# Run the microbenchmarks, save a baseline and flag regressions against it
+import os
+import sys
+import time
+import json
+import argparse
+import logging
+from typing import List
+from . import bench_execution, bench_formatting  # noqa: F401 (registers the benchmarks)
+from utils.code_executor import enable_copy_on_write
+from .harness import (
+    SWEEPS, get_cases, case_key, time_case, machine_info, load_results, save_results,
+    compare, format_seconds, print_progress
+)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'results', 'baseline.json')
+
+def run_cases(sweep: str, pattern: str = None, repeat: int = 5) -> dict:
+    cases = get_cases(sweep, pattern)
+    results = {'sweep': sweep, 'machine': machine_info(), 'created': time.time(), 'cases': {}}
+    for index, case in enumerate(cases):
+        key = case_key(case['name'], case['params'])
+        timing = time_case(case['func'], case['params'], repeat=repeat)
+        results['cases'][key] = timing
+        print_progress(f"[{index + 1}/{len(cases)}] {key}: {format_seconds(timing['median'])}")
+    return results
+
+def format_comparison(comparison: dict, threshold: float) -> str:
+    lines = []
+    for title, entries in (('Regressions', comparison['regressions']), ('Improvements', comparison['improvements'])):
+        if entries:
+            lines.append(f"{title} (threshold {threshold:.0%}):")
+            for entry in sorted(entries, key=lambda e: e['ratio'], reverse=True):
+                lines.append(f"  {entry['case']}: {format_seconds(entry['baseline'])} -> "
+                             f"{format_seconds(entry['current'])} ({entry['ratio']:.2f}x)")
+    lines.append(f"{len(comparison['regressions'])} regressed, {len(comparison['improvements'])} improved, "
+                 f"{len(comparison['unchanged'])} unchanged, {len(comparison['new'])} not in baseline")
+    return "\n".join(lines)
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the CPU-bound (non-LLM) stages of the pipeline')
+    parser.add_argument('--sweep', choices=list(SWEEPS), default='default',
+                        help='parameter ranges: quick (up to 100k rows), default (1M), full (10M)')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5, help='samples per case; the median is compared')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='save these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown that counts as a regression (default: 0.2 = 20%%)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    # Log output would be part of the measurements
+    logging.basicConfig(level=logging.ERROR)
+    # Measure namespaces as the server builds them
+    enable_copy_on_write()
+    results = run_cases(args.sweep, args.filter, args.repeat)
+    if args.json:
+        save_results(args.json, results)
+
+    if args.save_baseline:
+        baseline = load_results(args.baseline) or {}
+        # Cases outside this run's sweep or filter keep their previous baseline
+        results = {**results, 'cases': {**baseline.get('cases', {}), **results['cases']}}
+        save_results(args.baseline, results)
+        print(f"Saved {len(results['cases'])} baseline cases to {args.baseline}")
+        return 0
+
+    baseline = load_results(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+    if baseline.get('machine') != results['machine']:
+        print(f"Warning: the baseline was recorded on a different machine ({json.dumps(baseline.get('machine'))})")
+    comparison = compare(results, baseline, args.threshold)
+    print(format_comparison(comparison, args.threshold))
+    return 1 if comparison['regressions'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -43,12 +43,104 @@ class Config:
     
     # File Upload Configuration
     FILE_UPLOAD_CACHE_TTL = int(os.getenv('FILE_UPLOAD_CACHE_TTL', '3600'))  # 1 hour
+    FILE_UPLOAD_CACHE_CLEANUP_INTERVAL = int(os.getenv('FILE_UPLOAD_CACHE_CLEANUP_INTERVAL', '300'))  # 5 minutes
     MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', '20971520'))  # 20MB
     
+    # Dataset Cache Configuration
+    DATASET_CACHE_MAX_BYTES = int(os.getenv('DATASET_CACHE_MAX_BYTES', '536870912'))  # 512MB
+    DATASET_CACHE_POLICY = os.getenv('DATASET_CACHE_POLICY', 'lru')  # 'lru' or 'lfu'
+    ENABLE_COLUMNAR_SIDECAR = os.getenv('ENABLE_COLUMNAR_SIDECAR', 'true').lower() == 'true'
+    
+    # Streaming Ingestion Configuration (threshold 0 derives it from available memory, never below the minimum)
+    STREAMING_INGEST_THRESHOLD = int(os.getenv('STREAMING_INGEST_THRESHOLD', '0'))
+    STREAMING_MIN_THRESHOLD = int(os.getenv('STREAMING_MIN_THRESHOLD', '268435456'))  # 256MB
+    STREAMING_CHUNK_ROWS = int(os.getenv('STREAMING_CHUNK_ROWS', '100000'))
+    STREAMING_SAMPLE_ROWS = int(os.getenv('STREAMING_SAMPLE_ROWS', '100000'))
+    STREAMING_REGISTRY_MAX_ENTRIES = int(os.getenv('STREAMING_REGISTRY_MAX_ENTRIES', '8'))  # ingested files kept per process, LRU
+    
     # Performance Configuration
     ENABLE_STREAMING = os.getenv('ENABLE_STREAMING', 'true').lower() == 'true'
     MAX_RETRY_ATTEMPTS = int(os.getenv('MAX_RETRY_ATTEMPTS', '3'))
     
+    # Resilience Configuration (Gemini retries back off with jitter and share one budget per process)
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '0.5'))  # seconds, doubled per attempt
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '20'))
+    RETRY_DEADLINE = float(os.getenv('RETRY_DEADLINE', '90'))  # give up rather than wait past this
+    RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', '0.2'))  # retries per request over a 10s window
+    RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('RETRY_BUDGET_MIN_PER_SECOND', '1'))
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_BREAKER_FAILURE_THRESHOLD', '5'))  # consecutive failures
+    CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.getenv('CIRCUIT_BREAKER_RESET_TIMEOUT', '30'))  # seconds before a probe
+    
+    # Hedging Configuration (duplicate a streamed Gemini call whose first chunk is late, keep the faster one)
+    ENABLE_HEDGING = os.getenv('ENABLE_HEDGING', 'false').lower() == 'true'
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))  # of recent time-to-first-chunk
+    HEDGE_INITIAL_DELAY = float(os.getenv('HEDGE_INITIAL_DELAY', '2'))  # seconds, until HEDGE_MIN_SAMPLES are recorded
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+    HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.25'))
+    HEDGE_MAX_FRACTION = float(os.getenv('HEDGE_MAX_FRACTION', '0.1'))  # extra requests per request over a 10s window
+    HEDGE_WORKERS = int(os.getenv('HEDGE_WORKERS', '32'))  # threads for sync hedged calls
+    
+    # Response Cache Configuration (identical requests are answered from cache; responses are sampled, so opt-in)
+    ENABLE_RESPONSE_CACHE = os.getenv('ENABLE_RESPONSE_CACHE', 'false').lower() == 'true'
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '86400'))  # 24 hours
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000'))  # LRU, in memory and on disk
+    RESPONSE_CACHE_PERSIST = os.getenv('RESPONSE_CACHE_PERSIST', 'true').lower() == 'true'  # SQLite, shared by all processes
+    RESPONSE_CACHE_REPLAY_CHUNK = int(os.getenv('RESPONSE_CACHE_REPLAY_CHUNK', '256'))  # characters per replayed stream chunk
+    
+    # Context Caching Configuration (system prompt + dataset file registered once, referenced on later turns)
+    ENABLE_CONTEXT_CACHE = os.getenv('ENABLE_CONTEXT_CACHE', 'false').lower() == 'true'  # opt in: Gemini bills cached storage per hour
+    CONTEXT_CACHE_BACKEND = os.getenv('CONTEXT_CACHE_BACKEND', 'gemini')  # 'gemini' (CachedContent) or 'local' (stand-in)
+    CONTEXT_CACHE_TTL = float(os.getenv('CONTEXT_CACHE_TTL', '3600'))  # 1 hour
+    CONTEXT_CACHE_MIN_BYTES = int(os.getenv('CONTEXT_CACHE_MIN_BYTES', '65536'))  # smaller datasets fall below Gemini's minimum cached tokens
+    
+    # Gemini Connection Configuration (models and channels are pooled per process)
+    GEMINI_PREWARM = os.getenv('GEMINI_PREWARM', 'true').lower() == 'true'  # connect at worker startup
+    GEMINI_CONNECT_TIMEOUT = float(os.getenv('GEMINI_CONNECT_TIMEOUT', '5'))
+    GEMINI_KEEPALIVE_SECONDS = float(os.getenv('GEMINI_KEEPALIVE_SECONDS', '300'))  # Google front ends reject more frequent idle pings
+    
+    # Code Execution Configuration ('inprocess' runs exec() in the request process, 'pool' uses pre-forked workers)
+    EXECUTION_ENGINE = os.getenv('EXECUTION_ENGINE', 'inprocess')
+    EXECUTION_POOL_SIZE = int(os.getenv('EXECUTION_POOL_SIZE', '0'))  # 0 = one worker per CPU
+    EXECUTION_TIMEOUT = float(os.getenv('EXECUTION_TIMEOUT', '60'))  # seconds of wall-clock time per block
+    EXECUTION_CPU_LIMIT = int(os.getenv('EXECUTION_CPU_LIMIT', '120'))  # CPU seconds per block
+    EXECUTION_MEMORY_LIMIT_MB = int(os.getenv('EXECUTION_MEMORY_LIMIT_MB', '4096'))  # address space per worker, 0 = unlimited
+    EXECUTION_POOL_MAX_TASKS = int(os.getenv('EXECUTION_POOL_MAX_TASKS', '200'))  # recycle workers after this many jobs
+    ENABLE_PARALLEL_BLOCKS = os.getenv('ENABLE_PARALLEL_BLOCKS', 'true').lower() == 'true'  # pool engine only
+    
+    # Execution Kernel Configuration (per-session namespaces kept across blocks and turns)
+    ENABLE_KERNELS = os.getenv('ENABLE_KERNELS', 'true').lower() == 'true'
+    KERNEL_IDLE_TIMEOUT = float(os.getenv('KERNEL_IDLE_TIMEOUT', '1800'))  # 30 minutes
+    KERNEL_MEMORY_LIMIT_MB = int(os.getenv('KERNEL_MEMORY_LIMIT_MB', '1024'))  # reset a kernel past this, 0 = unlimited
+    KERNEL_MAX_SESSIONS = int(os.getenv('KERNEL_MAX_SESSIONS', '32'))  # per process
+    
+    # Figure Encoding Configuration
+    FIGURE_FORMAT = os.getenv('FIGURE_FORMAT', 'png')  # 'png', 'webp', 'jpeg' or 'svg'
+    FIGURE_DPI = int(os.getenv('FIGURE_DPI', '150'))
+    FIGURE_MAX_PIXELS = int(os.getenv('FIGURE_MAX_PIXELS', '1800'))  # longest image side, 0 = no cap
+    FIGURE_FAST_RENDER = os.getenv('FIGURE_FAST_RENDER', 'true').lower() == 'true'  # single draw, no savefig tight-bbox pass
+    FIGURE_QUALITY = int(os.getenv('FIGURE_QUALITY', '85'))  # webp/jpeg
+    FIGURE_PNG_OPTIMIZE = os.getenv('FIGURE_PNG_OPTIMIZE', 'false').lower() == 'true'
+    FIGURE_PNG_COMPRESS_LEVEL = int(os.getenv('FIGURE_PNG_COMPRESS_LEVEL', '6'))
+    FIGURE_ENCODE_WORKERS = int(os.getenv('FIGURE_ENCODE_WORKERS', '4'))
+    
+    # Large-Data Plotting Configuration (applied automatically in show_plot/show_plotly)
+    PLOT_REDUCTION_ENABLED = os.getenv('PLOT_REDUCTION_ENABLED', 'true').lower() == 'true'
+    PLOT_POINT_THRESHOLD = int(os.getenv('PLOT_POINT_THRESHOLD', '20000'))  # points per line/scatter before reducing
+    PLOT_LTTB_POINTS = int(os.getenv('PLOT_LTTB_POINTS', '4000'))  # points kept per downsampled line
+    PLOT_DENSITY_BINS = int(os.getenv('PLOT_DENSITY_BINS', '300'))  # grid size per axis for dense scatters
+    
+    # Figure Store Configuration (figures are served from /figures/<digest> instead of inline base64)
+    FIGURE_STORE_BACKEND = os.getenv('FIGURE_STORE_BACKEND', 'disk')  # 'disk' (shared by all processes) or 'memory'
+    FIGURE_STORE_TTL = float(os.getenv('FIGURE_STORE_TTL', '86400'))  # 24 hours
+    FIGURE_STORE_MAX_BYTES = int(os.getenv('FIGURE_STORE_MAX_BYTES', '268435456'))  # 256MB, memory backend only
+    
+    # Async Serving Configuration (asgi.py)
+    ASYNC_BLOCKING_WORKERS = int(os.getenv('ASYNC_BLOCKING_WORKERS', '16'))  # threads for exec, pandas and file IO
+    
+    # Pre-fork Server Configuration (gunicorn.conf.py)
+    PREFORK_PRELOAD_DATASETS = os.getenv('PREFORK_PRELOAD_DATASETS', 'true').lower() == 'true'  # load datasets in the master
+    PREFORK_DATASETS_PATH = os.getenv('PREFORK_DATASETS_PATH', 'datasets')
+    
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     
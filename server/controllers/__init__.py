@@ -1,3 +1,4 @@
 # Make controllers directory a Python package
 from .chat_controller import ChatController
 from .file_controller import FileController
+from .figure_controller import FigureController
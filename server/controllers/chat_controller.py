@@ -1,7 +1,7 @@
 # Chat controller for handling chat-related endpoints
 import logging
 from flask import request, jsonify, Response
-from typing import Dict, Any
+from typing import Dict, Any, List, Generator, AsyncGenerator
 import sys
 import json
 sys.path.append('..')
@@ -10,9 +10,29 @@ from services.gemini_service import GeminiService
 from services.response_service import ResponseService
 from services.file_service import FileService
 from services.sequential_workflow_service import SequentialWorkflowManager
+from utils.dataset_cache import dataset_cache
+from utils.kernel_manager import kernel_manager, DEFAULT_SESSION_ID
+from utils.figure_store import figure_store
+from utils.response_cache import response_cache
+from utils.context_cache import context_cache
+from utils.json_encoder import dumps_str
+from utils.async_executor import run_blocking
+from utils.resilience import CircuitOpenError, gemini_resilience
+from utils.hedging import gemini_hedger
 
 logger = logging.getLogger(__name__)
 
+# No Connection header: it is hop-by-hop, and the server decides whether the connection is reused
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type',
+}
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Format an event as a Server-Sent Events message"""
+    return f"data: {dumps_str(event)}\n\n"
+
 class ChatController:
     """Controller for chat-related operations"""
     
@@ -20,154 +40,246 @@ class ChatController:
         self.gemini_service = GeminiService()
         self.response_service = ResponseService()
         self.file_service = FileService()
-        self.sequential_workflow = SequentialWorkflowManager()
+        self.sequential_workflow = SequentialWorkflowManager(self.gemini_service, self.response_service)
     
     def handle_chat_request(self) -> Dict[str, Any]:
         """Handle incoming chat requests with sequential workflow support"""
         try:
             # Handle both JSON and FormData requests
             if request.content_type and 'multipart/form-data' in request.content_type:
-                # Handle file upload with FormData
-                message = request.form.get('message')
-                history_str = request.form.get('history', '[]')
-                plot_images_str = request.form.get('plot_images', '[]')
-                workflow_type = request.form.get('workflow_type', 'standard')
-                session_id = request.form.get('session_id', 'default')
-                
-                try:
-                    history = json.loads(history_str) if history_str else []
-                except:
-                    history = []
-                try:
-                    plot_images = json.loads(plot_images_str) if plot_images_str else []
-                except:
-                    plot_images = []
-                    
-                # Handle file upload
-                uploaded_file_path = None
-                if 'file' in request.files:
-                    file = request.files['file']
-                    if file and file.filename:
-                        filename = self.file_service.save_uploaded_file(file)
-                        uploaded_file_path = self.file_service.get_file_path(filename)
-                        
-                # Create chat request model
-                chat_request = ChatRequest(message=message, history=history, file_path=uploaded_file_path)
-                
+                context = self.parse_form_payload(request.form, request.files.get('file'))
             else:
                 # Handle JSON request
                 data = request.get_json()
                 if not data:
                     return {'error': 'No data provided'}, 400
-                    
-                plot_images = data.get('plot_images', [])
-                workflow_type = data.get('workflow_type', 'standard')
-                session_id = data.get('session_id', 'default')
-                
-                # Create chat request model
-                chat_request = ChatRequest.from_dict(data)
-                uploaded_file_path = None
-                if chat_request.file_path:
-                    uploaded_file_path = self.file_service.get_file_path(chat_request.file_path)
+                context = self.parse_json_payload(data)
 
-            if not chat_request.message:
+            if not context['chat_request'].message:
                 return {'error': 'Message is required'}, 400
 
-            # Determine if this is a dataset analysis request requiring sequential workflow
-            is_dataset_analysis = (
-                uploaded_file_path and 
-                any(keyword in chat_request.message.lower() for keyword in [
-                    'analyze', 'analysis', 'visualize', 'plot', 'chart', 'graph', 'dataset'
-                ])
-            ) or workflow_type == 'sequential'
-
-            if is_dataset_analysis:
-                # Use sequential workflow for comprehensive dataset analysis
-                logger.info(f"Using sequential workflow for dataset analysis (session: {session_id})")
-                processed_response = self.sequential_workflow.execute_sequential_analysis(
-                    chat_request, 
-                    uploaded_file_path, 
-                    session_id
-                )
-            else:
-                # Use standard workflow for regular chat
-                logger.info("Using standard workflow for chat")
-                # Generate response using Gemini, now with plot_images context
-                gemini_response = self.gemini_service.generate_response(
-                    chat_request, 
-                    uploaded_file_path,
-                    plot_images=plot_images
-                )
-                
-                # Process the response with step-by-step plot generation
-                processed_response = self.response_service.process_gemini_response_with_step_by_step_plots(
-                    gemini_response, 
-                    uploaded_file_path
-                )
-            
-            return processed_response.to_dict(), 200
+            # Serialized straight from the response model by utils.json_encoder
+            return self.process_chat(context), 200
             
+        except CircuitOpenError as e:
+            logger.warning(f"Rejected chat request: {e}")
+            return {'error': 'Service temporarily unavailable', 'details': str(e), 'retry_after': round(e.retry_after)}, 503
         except Exception as e:
             logger.error(f"Error in chat request: {e}")
             return {'error': 'Internal server error', 'details': str(e)}, 500
     
+    def parse_form_payload(self, form, file=None) -> Dict[str, Any]:
+        """Build the chat context from multipart form fields, saving the uploaded file if any"""
+        uploaded_file_path = None
+        if file and file.filename:
+            filename = self.file_service.save_uploaded_file(file)
+            uploaded_file_path = self.file_service.get_file_path(filename)
+        
+        return {
+            'chat_request': ChatRequest(
+                message=form.get('message'),
+                history=self._load_json_field(form.get('history', '[]')),
+                file_path=uploaded_file_path
+            ),
+            'uploaded_file_path': uploaded_file_path,
+            'plot_images': self._load_json_field(form.get('plot_images', '[]')),
+            'workflow_type': form.get('workflow_type', 'standard'),
+            'session_id': form.get('session_id') or DEFAULT_SESSION_ID
+        }
+    
+    def parse_json_payload(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the chat context from a JSON request body"""
+        chat_request = ChatRequest.from_dict(data)
+        uploaded_file_path = None
+        if chat_request.file_path:
+            uploaded_file_path = self.file_service.get_file_path(chat_request.file_path)
+        
+        return {
+            'chat_request': chat_request,
+            'uploaded_file_path': uploaded_file_path,
+            'plot_images': data.get('plot_images', []),
+            'workflow_type': data.get('workflow_type', 'standard'),
+            'session_id': data.get('session_id') or DEFAULT_SESSION_ID
+        }
+    
+    @staticmethod
+    def _load_json_field(value: str) -> List[Any]:
+        try:
+            return json.loads(value) if value else []
+        except ValueError:
+            return []
+    
+    def _is_dataset_analysis(self, context: Dict[str, Any]) -> bool:
+        """Determine if this is a dataset analysis request requiring sequential workflow"""
+        message = context['chat_request'].message.lower()
+        return bool(
+            context['uploaded_file_path'] and 
+            any(keyword in message for keyword in [
+                'analyze', 'analysis', 'visualize', 'plot', 'chart', 'graph', 'dataset'
+            ])
+        ) or context['workflow_type'] == 'sequential'
+    
+    def process_chat(self, context: Dict[str, Any]) -> ChatResponse:
+        """Run a parsed chat request through the sequential or standard workflow"""
+        chat_request = context['chat_request']
+        uploaded_file_path = context['uploaded_file_path']
+        session_id = context['session_id']
+        
+        if self._is_dataset_analysis(context):
+            # Use sequential workflow for comprehensive dataset analysis
+            logger.info(f"Using sequential workflow for dataset analysis (session: {session_id})")
+            return self.sequential_workflow.execute_sequential_analysis(
+                chat_request, 
+                uploaded_file_path, 
+                session_id
+            )
+        
+        # Use standard workflow for regular chat
+        logger.info("Using standard workflow for chat")
+        # Generate response using Gemini, now with plot_images context
+        gemini_response = self.gemini_service.generate_response(
+            chat_request, 
+            uploaded_file_path,
+            plot_images=context['plot_images']
+        )
+        
+        # Process the response with step-by-step plot generation
+        return self.response_service.process_gemini_response_with_step_by_step_plots(
+            gemini_response, 
+            uploaded_file_path,
+            session_id
+        )
+    
+    async def process_chat_async(self, context: Dict[str, Any]) -> ChatResponse:
+        """Async variant of process_chat: awaits Gemini and offloads code execution"""
+        chat_request = context['chat_request']
+        uploaded_file_path = context['uploaded_file_path']
+        session_id = context['session_id']
+        
+        if self._is_dataset_analysis(context):
+            logger.info(f"Using sequential workflow for dataset analysis (session: {session_id})")
+            return await self.sequential_workflow.execute_sequential_analysis_async(
+                chat_request, 
+                uploaded_file_path, 
+                session_id
+            )
+        
+        logger.info("Using standard workflow for chat")
+        gemini_response = await self.gemini_service.generate_response_async(
+            chat_request, 
+            uploaded_file_path,
+            plot_images=context['plot_images']
+        )
+        
+        return await run_blocking(
+            self.response_service.process_gemini_response_with_step_by_step_plots,
+            gemini_response, 
+            uploaded_file_path,
+            session_id
+        )
+    
     def handle_health_check(self) -> Dict[str, Any]:
         """Handle health check requests"""
-        return {'status': 'healthy', 'service': 'datagent-api'}, 200
+        return {
+            'status': 'healthy',
+            'service': 'datagent-api',
+            'dataset_cache': dataset_cache.stats(),
+            'kernels': kernel_manager.stats(),
+            'figure_store': figure_store.stats(),
+            'response_cache': response_cache.stats(),
+            'context_cache': context_cache.stats(),
+            'gemini': {**gemini_resilience.stats(), 'hedging': gemini_hedger.stats()}
+        }, 200
     
     def handle_chat_stream(self):
         """Handle streaming chat requests for real-time response generation"""
         try:
             # Parse request data
             if request.content_type and 'application/json' in request.content_type:
-                data = request.get_json()
-                message = data.get('message')
-                history = data.get('history', [])
-                plot_images = data.get('plot_images', [])
-                session_id = data.get('session_id', 'default')
+                chat_request, plot_images = self.parse_stream_payload(request.get_json())
             else:
                 return {'error': 'Content-Type must be application/json for streaming'}, 400
             
-            if not message:
+            if not chat_request.message:
                 return {'error': 'Message is required'}, 400
             
-            # Create chat request
-            chat_request = ChatRequest(message=message, history=history)
-            
             def generate_stream():
                 """Generator function for streaming response"""
-                try:
-                    # Generate streaming response
-                    for chunk in self.gemini_service.generate_response_stream(
-                        chat_request, 
-                        uploaded_file_path=None,  # File uploads not supported in streaming yet
-                        plot_images=plot_images
-                    ):
-                        # Format as Server-Sent Events
-                        yield f"data: {json.dumps({'chunk': chunk, 'type': 'text'})}\n\n"
-                    
-                    # Send completion signal
-                    yield f"data: {json.dumps({'type': 'complete'})}\n\n"
-                    
-                except Exception as e:
-                    # Send error in stream
-                    yield f"data: {json.dumps({'error': str(e), 'type': 'error'})}\n\n"
+                for event in self.stream_chat_events(chat_request, plot_images):
+                    yield format_sse(event)
             
-            return Response(
-                generate_stream(),
-                mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'Connection': 'keep-alive',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type',
-                }
-            )
+            return Response(generate_stream(), mimetype='text/event-stream', headers=SSE_HEADERS)
             
         except Exception as e:
             logger.error(f"Error in streaming chat request: {e}")
             return {'error': 'Internal server error', 'details': str(e)}, 500
     
+    def handle_sequential_stream(self):
+        """Handle sequential analysis requests, streaming each step as it completes"""
+        try:
+            if request.content_type and 'multipart/form-data' in request.content_type:
+                context = self.parse_form_payload(request.form, request.files.get('file'))
+            else:
+                data = request.get_json()
+                if not data:
+                    return {'error': 'No data provided'}, 400
+                context = self.parse_json_payload(data)
+            
+            if not context['chat_request'].message:
+                return {'error': 'Message is required'}, 400
+            
+            def generate_stream():
+                for event in self.sequential_workflow.stream_sequential_analysis(
+                    context['chat_request'],
+                    context['uploaded_file_path'],
+                    context['session_id']
+                ):
+                    yield format_sse(event)
+            
+            return Response(generate_stream(), mimetype='text/event-stream', headers=SSE_HEADERS)
+            
+        except Exception as e:
+            logger.error(f"Error in streamed sequential analysis request: {e}")
+            return {'error': 'Internal server error', 'details': str(e)}, 500
+    
+    def parse_stream_payload(self, data: Dict[str, Any]):
+        """Get the chat request and plot images of a streaming request body"""
+        data = data or {}
+        chat_request = ChatRequest(message=data.get('message'), history=data.get('history', []))
+        return chat_request, data.get('plot_images', [])
+    
+    def stream_chat_events(self, chat_request: ChatRequest, plot_images: List[Any]) -> Generator[Dict[str, Any], None, None]:
+        """Yield the events of a streamed chat response"""
+        try:
+            for chunk in self.gemini_service.generate_response_stream(
+                chat_request, 
+                uploaded_file_path=None,  # File uploads not supported in streaming yet
+                plot_images=plot_images
+            ):
+                yield {'chunk': chunk, 'type': 'text'}
+            
+            # Send completion signal
+            yield {'type': 'complete'}
+            
+        except Exception as e:
+            # Send error in stream
+            yield {'error': str(e), 'type': 'error'}
+    
+    async def stream_chat_events_async(self, chat_request: ChatRequest, plot_images: List[Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        """Async variant of stream_chat_events"""
+        try:
+            async for chunk in self.gemini_service.generate_response_stream_async(
+                chat_request, 
+                uploaded_file_path=None,
+                plot_images=plot_images
+            ):
+                yield {'chunk': chunk, 'type': 'text'}
+            
+            yield {'type': 'complete'}
+            
+        except Exception as e:
+            yield {'error': str(e), 'type': 'error'}
+    
     def handle_chat_request_stream(self) -> Response:
         """Handle streaming chat requests"""
         try:
@@ -181,7 +293,7 @@ class ChatController:
                 return Response("Message is required", status=400)
             
             history = data.get('history', [])
-            session_id = data.get('session_id', 'default')
+            session_id = data.get('session_id') or DEFAULT_SESSION_ID
             
             # Create request object
             chat_request = ChatRequest(
@@ -205,21 +317,20 @@ class ChatController:
                         plot_images
                     ):
                         if chunk:
-                            yield f"data: {json.dumps({'content': chunk})}\n\n"
+                            yield f"data: {dumps_str({'content': chunk})}\n\n"
                     
                     # Signal end of stream
-                    yield f"data: {json.dumps({'done': True})}\n\n"
+                    yield f"data: {dumps_str({'done': True})}\n\n"
                     
                 except Exception as e:
                     logger.error(f"Error in streaming response: {e}")
-                    yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                    yield f"data: {dumps_str({'error': str(e)})}\n\n"
             
             return Response(
                 generate_response(),
                 mimetype='text/event-stream',
                 headers={
                     'Cache-Control': 'no-cache',
-                    'Connection': 'keep-alive',
                     'Access-Control-Allow-Origin': '*',
                     'Access-Control-Allow-Headers': 'Content-Type'
                 }
@@ -0,0 +1,38 @@
+# Figure controller for serving stored figure images
+import logging
+from flask import request, Response
+from typing import Dict, Optional, Tuple
+import sys
+sys.path.append('..')
+from utils.figure_store import figure_store
+
+logger = logging.getLogger(__name__)
+
+# A digest always names the same bytes, so browsers and proxies may cache it forever
+FIGURE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+class FigureController:
+    """Controller for figure-related operations"""
+    
+    def handle_figure_request(self, digest: str) -> Response:
+        """Serve a stored figure by its content digest"""
+        status, data, mime_type, headers = self.resolve_figure(digest, request.if_none_match)
+        return Response(data, status=status, mimetype=mime_type, headers=headers)
+    
+    def resolve_figure(self, digest: str, if_none_match) -> Tuple[int, Optional[bytes], Optional[str], Dict[str, str]]:
+        """Get (status, body, mime_type, headers) for a figure request, independent of the web framework"""
+        # An expired or evicted figure is gone even if the client still has it cached
+        entry = figure_store.get(digest)
+        if entry is None:
+            return 404, b"Figure not found", 'text/plain', {}
+        
+        etag = f'"{digest}"'
+        if digest in if_none_match:
+            return 304, None, None, {'ETag': etag, 'Cache-Control': FIGURE_CACHE_CONTROL}
+        
+        data, mime_type = entry
+        return 200, data, mime_type, {
+            'ETag': etag,
+            'Cache-Control': FIGURE_CACHE_CONTROL,
+            'Content-Length': str(len(data))
+        }
@@ -0,0 +1,38 @@
+# Gunicorn configuration: pre-fork production server
+import os
+import gc
+import multiprocessing
+
+# Keep the master's GC off while the app is imported so it leaves no freed "holes" in pages the workers share
+gc.disable()
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')  # 'uvicorn.workers.UvicornWorker' serves asgi:app
+threads = int(os.getenv('GUNICORN_THREADS', '8'))  # gthread only; most of a request is spent waiting on Gemini
+wsgi_app = os.getenv('GUNICORN_APP', 'asgi:app' if 'uvicorn' in worker_class else 'wsgi:app')
+
+# Import the app, its libraries and hot datasets once in the master; workers share them copy-on-write
+preload_app = True
+
+# Recycle workers to bound memory growth from executed code, with jitter so they don't all restart at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '500'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '50'))
+
+# LLM responses and sequential analyses can take minutes
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '120'))
+keepalive = 5
+
+def when_ready(server):
+    """Runs in the master once the app is loaded, before the first worker is forked"""
+    from utils.prefork import preload
+    preload()
+
+def pre_fork(server, worker):
+    from utils.prefork import before_fork
+    before_fork()
+
+def post_fork(server, worker):
+    from utils.prefork import after_fork
+    after_fork()
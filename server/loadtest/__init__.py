@@ -0,0 +1 @@
+# Offline load testing: a local Gemini stand-in and a load generator for the chat endpoints
@@ -0,0 +1,239 @@
+# Local stand-in for the Gemini API, for load tests without network access or quota
+import time
+import random
+import asyncio
+import itertools
+import threading
+import logging
+from dataclasses import dataclass
+from typing import Optional, List, Any
+import google.generativeai as genai
+from google.generativeai import protos
+from google.generativeai.types import content_types, file_types
+from google.api_core import exceptions as api_exceptions
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_RESPONSE = """## 📊 Dataset Overview
+The dataset has been profiled; see the precomputed summary for its shape, types and missing values.
+
+## 🔍 Data Quality Assessment
+Numeric columns are complete and no duplicate rows stand out.
+
+## 💡 Key Insights & Patterns
+- Insight 1: The first numeric column is roughly unimodal.
+- Insight 2: Several numeric columns are strongly correlated.
+- Insight 3: Category frequencies are uneven.
+
+## 📈 Visualization 1: Distribution of the First Numeric Column
+**Purpose**: Shows the spread and skew of the main measurement.
+```python
+numeric = df.select_dtypes('number')
+plt.figure(figsize=(10, 6))
+plt.hist(numeric.iloc[:, 0].dropna(), bins=30)
+plt.title(f'Distribution of {numeric.columns[0]}')
+plt.xlabel(numeric.columns[0])
+plt.ylabel('Frequency')
+show_plot()
+```
+
+## 📈 Visualization 2: Correlation Matrix
+**Purpose**: Shows which numeric columns move together.
+```python
+corr = df.select_dtypes('number').corr()
+plt.figure(figsize=(8, 6))
+plt.imshow(corr, cmap='coolwarm', vmin=-1, vmax=1)
+plt.colorbar()
+plt.xticks(range(len(corr)), corr.columns, rotation=45)
+plt.yticks(range(len(corr)), corr.columns)
+plt.title('Correlation Matrix')
+show_plot()
+```
+
+## 🎯 Recommendations
+Investigate the strongest correlations before modelling."""
+
+CHAT_RESPONSE = """A p-value is the probability of observing data at least as extreme as yours if the null hypothesis were true.
+
+For example, with two groups you could start by comparing their means:
+```python
+group_a = [1.2, 2.3, 3.1]
+group_b = [2.8, 3.9, 4.4]
+print(sum(group_a) / len(group_a), sum(group_b) / len(group_b))
+```
+
+A small p-value (commonly below 0.05) suggests the difference is unlikely to be due to chance alone."""
+
+@dataclass
+class FakeGeminiConfig:
+    """Latency and failure profile of the stand-in"""
+    first_token_latency: float = 0.8  # seconds before the first chunk (or the whole non-streamed response)
+    latency_jitter: float = 0.3  # fraction of first_token_latency, uniformly distributed
+    tail_probability: float = 0.02  # chance of a slow outlier
+    tail_multiplier: float = 5.0
+    tokens_per_second: float = 150.0  # 0 = instant
+    chunk_tokens: int = 20
+    failure_rate: float = 0.0  # chance a call fails before its first chunk
+    mid_stream_failure_rate: float = 0.0  # chance a stream fails after its first chunk
+    upload_latency: float = 0.3
+    analysis_response: str = ANALYSIS_RESPONSE
+    chat_response: str = CHAT_RESPONSE
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+def make_fake_file(path: str, mime_type: str) -> file_types.File:
+    """A genai File like upload_file returns, so requests carry it exactly as they would a real upload"""
+    name = f"files/fake-{abs(hash(path)) % 10 ** 8}"
+    return file_types.File(protos.File(
+        name=name, uri=f"https://generativelanguage.googleapis.com/v1beta/{name}", mime_type=mime_type
+    ))
+
+class FakeStats:
+    """Calls made to the stand-in, for checking that caches and retries behave as expected"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.uploads = 0
+        self.cancelled = 0
+    
+    def add(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+    
+    def to_dict(self):
+        return {'calls': self.calls, 'failures': self.failures, 'uploads': self.uploads, 'cancelled': self.cancelled}
+
+class FakeStreamCall:
+    """Stand-in for a sent streaming gRPC call: chunks arrive as it is iterated, and it can be cancelled meanwhile"""
+    
+    def __init__(self, model: 'FakeGenerativeModel', text: str):
+        self._model = model
+        self._cancelled = threading.Event()
+        self._chunks = self._generate(text)
+    
+    def _wait(self, delay: float):
+        if self._cancelled.wait(delay):
+            self._model.stats.add('cancelled')
+            raise api_exceptions.Cancelled('Fake Gemini: call cancelled')
+    
+    def _generate(self, text: str):
+        model = self._model
+        self._wait(model._first_token_delay())
+        model._maybe_fail(model.config.failure_rate)
+        for index, chunk in enumerate(model._split(text)):
+            if index:
+                self._wait(model._chunk_delay(chunk))
+                if index == 1:
+                    model._maybe_fail(model.config.mid_stream_failure_rate)
+            yield FakeChunk(chunk)
+    
+    def cancel(self):
+        self._cancelled.set()
+    
+    def __iter__(self):
+        return self._chunks
+
+class FakeGenerativeModel:
+    """Drop-in for genai.GenerativeModel that answers with canned responses"""
+    
+    config = FakeGeminiConfig()
+    stats = FakeStats()
+    
+    def __init__(self, model_name: str = 'fake-gemini', generation_config=None, safety_settings=None,
+                 system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached_content = None
+    
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        model = cls()
+        model.cached_content = getattr(cached_content, 'name', cached_content)
+        return model
+    
+    def _pick_response(self, content) -> str:
+        # Convert the content as genai does, so parts it cannot send fail here too
+        contents = content_types.to_contents(content)
+        prompt = ' '.join(part.text for item in contents for part in item.parts if part.text)
+        if 'CRITICAL INSTRUCTION' in prompt or 'SEQUENTIAL' in prompt:
+            return self.config.analysis_response
+        return self.config.chat_response
+    
+    def _first_token_delay(self) -> float:
+        delay = self.config.first_token_latency * (1 + random.uniform(-1, 1) * self.config.latency_jitter)
+        if random.random() < self.config.tail_probability:
+            delay *= self.config.tail_multiplier
+        return max(0.0, delay)
+    
+    def _split(self, text: str) -> List[str]:
+        # Whitespace-separated words stand in for tokens
+        words = text.split(' ')
+        size = max(1, self.config.chunk_tokens)
+        return [' '.join(words[i:i + size]) + (' ' if i + size < len(words) else '') for i in range(0, len(words), size)]
+    
+    def _chunk_delay(self, chunk: str) -> float:
+        if not self.config.tokens_per_second:
+            return 0.0
+        return len(chunk.split()) / self.config.tokens_per_second
+    
+    def _maybe_fail(self, rate: float):
+        if random.random() < rate:
+            self.stats.add('failures')
+            raise api_exceptions.ServiceUnavailable('Fake Gemini: injected failure')
+    
+    async def _stream_async(self, text: str):
+        await asyncio.sleep(self._first_token_delay())
+        self._maybe_fail(self.config.failure_rate)
+        for index, chunk in enumerate(self._split(text)):
+            if index:
+                await asyncio.sleep(self._chunk_delay(chunk))
+                if index == 1:
+                    self._maybe_fail(self.config.mid_stream_failure_rate)
+            yield FakeChunk(chunk)
+    
+    def generate_content(self, content, stream: bool = False, **kwargs):
+        self.stats.add('calls')
+        text = self._pick_response(content)
+        if stream:
+            # Like genai, wait for the first chunk before returning
+            chunks = iter(FakeStreamCall(self, text))
+            return itertools.chain([next(chunks)], chunks)
+        time.sleep(self._first_token_delay() + sum(self._chunk_delay(chunk) for chunk in self._split(text)))
+        self._maybe_fail(self.config.failure_rate)
+        return FakeChunk(text)
+    
+    def start_content_stream(self, content) -> FakeStreamCall:
+        """Stand-in for GeminiModelFactory.start_content_stream: returns once the request is sent"""
+        self.stats.add('calls')
+        return FakeStreamCall(self, self._pick_response(content))
+    
+    async def generate_content_async(self, content, stream: bool = False, **kwargs):
+        self.stats.add('calls')
+        text = self._pick_response(content)
+        if stream:
+            return self._stream_async(text)
+        await asyncio.sleep(self._first_token_delay() + sum(self._chunk_delay(chunk) for chunk in self._split(text)))
+        self._maybe_fail(self.config.failure_rate)
+        return FakeChunk(text)
+
+def fake_upload_file(path: str, mime_type: Optional[str] = None, **kwargs) -> file_types.File:
+    """Drop-in for genai.upload_file"""
+    FakeGenerativeModel.stats.add('uploads')
+    time.sleep(FakeGenerativeModel.config.upload_latency)
+    return make_fake_file(path, mime_type or 'text/plain')
+
+def install(fake_config: Optional[FakeGeminiConfig] = None) -> FakeStats:
+    """Route genai model and upload calls to the stand-in, in this process.
+    
+    Call it before the app is imported, with CONTEXT_CACHE_BACKEND=local (the
+    stand-in has no CachedContent API) and GEMINI_PREWARM=false.
+    """
+    if fake_config is not None:
+        FakeGenerativeModel.config = fake_config
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.upload_file = fake_upload_file
+    logger.info("Gemini calls are served by the local stand-in")
+    return FakeGenerativeModel.stats
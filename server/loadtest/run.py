@@ -0,0 +1,361 @@
+# Load generator for the chat endpoints, against an in-process server with the Gemini stand-in or a running one
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import http.client
+import logging
+from urllib.parse import urlsplit
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# name: (endpoint, workflow type)
+SCENARIOS = {
+    'chat': ('/chat', 'standard'),
+    'analysis': ('/chat', 'sequential'),
+    'upload': ('/chat', 'sequential+upload'),
+    'stream': ('/chat/stream', 'standard'),
+    'analysis_stream': ('/chat/sequential/stream', 'sequential'),
+}
+
+CHAT_MESSAGES = [
+    "What is a p-value?",
+    "Explain the difference between mean and median",
+    "When should I use a log scale?",
+]
+
+DATASET_FILENAME = 'loadtest_dataset.csv'
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(percent / 100 * len(values)))]
+
+def make_dataset(rows: int) -> str:
+    """Write a synthetic mixed-type dataset and return its path"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'age': rng.integers(18, 90, rows),
+        'income': rng.lognormal(10, 0.5, rows).round(2),
+        'score': rng.normal(50, 10, rows).round(3),
+        'segment': rng.choice(['a', 'b', 'c', 'd'], rows),
+        'active': rng.random(rows) > 0.3,
+    })
+    df['spend'] = (df['income'] * 0.1 + rng.normal(0, 500, rows)).round(2)
+    path = os.path.join(tempfile.mkdtemp(prefix='datagent-loadtest-'), DATASET_FILENAME)
+    df.to_csv(path, index=False)
+    return path
+
+def encode_multipart(fields: Dict[str, str], file_field: str, file_path: str) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+               f'filename="{os.path.basename(file_path)}"\r\nContent-Type: text/csv\r\n\r\n'.encode())
+    with open(file_path, 'rb') as f:
+        body.write(f.read())
+    body.write(f'\r\n--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+class LoadGenerator:
+    """Sends a weighted mix of chat requests from worker threads and records latency per scenario.
+    
+    Each worker keeps one keep-alive connection. Latency is measured to the
+    end of the response; time to first byte is measured to the response
+    headers for /chat and to the first SSE event with content (not a
+    progress event) for the streaming endpoints.
+    """
+    
+    def __init__(self, base_url: str, mix: Dict[str, float], dataset_path: str, concurrency: int = 10,
+                 requests: int = 0, duration: float = 0, timeout: float = 300):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.mix = mix
+        self.dataset_path = dataset_path
+        self.concurrency = concurrency
+        self.requests = requests
+        self.duration = duration
+        self.timeout = timeout
+        self.results = []
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._deadline = None
+    
+    def _connect(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+    
+    def _build_request(self, scenario: str, worker: int) -> Tuple[str, bytes, str]:
+        endpoint, _ = SCENARIOS[scenario]
+        session_id = f"loadtest-{worker}"
+        if scenario == 'upload':
+            body, content_type = encode_multipart(
+                {'message': 'analyze this dataset', 'workflow_type': 'sequential', 'session_id': session_id},
+                'file', self.dataset_path
+            )
+            return endpoint, body, content_type
+        if scenario in ('analysis', 'analysis_stream'):
+            payload = {'message': 'analyze this dataset', 'file_path': os.path.basename(self.dataset_path),
+                       'workflow_type': 'sequential', 'session_id': session_id}
+        else:
+            payload = {'message': random.choice(CHAT_MESSAGES), 'history': [], 'session_id': session_id}
+        return endpoint, json.dumps(payload).encode(), 'application/json'
+    
+    def _check_body(self, scenario: str, status: int, body: bytes) -> Optional[str]:
+        """Get the error of a response, or None if it succeeded"""
+        if status >= 400:
+            return f"HTTP {status}"
+        if SCENARIOS[scenario][0].endswith('/stream'):
+            events = [json.loads(line[6:]) for line in body.decode().splitlines() if line.startswith('data: ')]
+            for event in events:
+                if event.get('type') == 'error':
+                    return event.get('error', 'stream error')
+                # The service reports Gemini failures as a text chunk
+                if event.get('type') == 'text' and event.get('chunk', '').startswith('Error:'):
+                    return event['chunk']
+                if event.get('type') == 'complete' and (event.get('response', {}).get('metadata') or {}).get('error'):
+                    return str(event['response']['metadata']['error'])
+            return None if events and events[-1].get('type') == 'complete' else 'incomplete stream'
+        payload = json.loads(body)
+        error = payload.get('error') or (payload.get('metadata') or {}).get('error')
+        return str(error) if error else None
+    
+    def _send(self, conn: http.client.HTTPConnection, scenario: str, worker: int) -> Dict[str, Any]:
+        endpoint, body, content_type = self._build_request(scenario, worker)
+        start_time = time.perf_counter()
+        conn.request('POST', endpoint, body=body, headers={'Content-Type': content_type})
+        response = conn.getresponse()
+        if endpoint.endswith('/stream'):
+            data = b''
+            while True:
+                line = response.readline()
+                data += line
+                if not line or (line.startswith(b'data: ') and json.loads(line[6:]).get('type') != 'progress'):
+                    break
+            ttfb = time.perf_counter() - start_time
+            data += response.read()
+        else:
+            ttfb = time.perf_counter() - start_time
+            data = response.read()
+        latency = time.perf_counter() - start_time
+        return {'scenario': scenario, 'latency': latency, 'ttfb': ttfb, 'error': self._check_body(scenario, response.status, data)}
+    
+    def _next_scenario(self) -> Optional[str]:
+        with self._lock:
+            if self.requests and self._sent >= self.requests:
+                return None
+            if self._deadline and time.monotonic() >= self._deadline:
+                return None
+            self._sent += 1
+        names = list(self.mix)
+        return random.choices(names, weights=[self.mix[name] for name in names])[0]
+    
+    def _worker(self, worker: int):
+        conn = self._connect()
+        while True:
+            scenario = self._next_scenario()
+            if scenario is None:
+                break
+            try:
+                result = self._send(conn, scenario, worker)
+            except Exception as e:
+                conn.close()
+                conn = self._connect()
+                result = {'scenario': scenario, 'latency': None, 'ttfb': None, 'error': f"{type(e).__name__}: {e}"}
+            with self._lock:
+                self.results.append(result)
+        conn.close()
+    
+    def setup(self):
+        """Upload the dataset once so 'analysis' requests can reference it by name"""
+        if 'analysis' not in self.mix and 'analysis_stream' not in self.mix:
+            return
+        conn = self._connect()
+        body, content_type = encode_multipart({'message': 'Summarize this file'}, 'file', self.dataset_path)
+        conn.request('POST', '/chat', body=body, headers={'Content-Type': content_type})
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        if response.status >= 400:
+            raise RuntimeError(f"Dataset upload failed with HTTP {response.status}")
+    
+    def run(self) -> float:
+        """Send the load and return the elapsed time"""
+        self._deadline = time.monotonic() + self.duration if self.duration else None
+        start_time = time.perf_counter()
+        workers = [threading.Thread(target=self._worker, args=(i,), daemon=True) for i in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - start_time
+    
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        """Summarize results per scenario (endpoint and workflow type)"""
+        summary = {}
+        for scenario in self.mix:
+            results = [r for r in self.results if r['scenario'] == scenario]
+            if not results:
+                continue
+            ok = [r for r in results if r['error'] is None]
+            latencies = [r['latency'] for r in ok]
+            ttfbs = [r['ttfb'] for r in ok]
+            errors = {}
+            for r in results:
+                if r['error'] is not None:
+                    errors[r['error'][:120]] = errors.get(r['error'][:120], 0) + 1
+            endpoint, workflow = SCENARIOS[scenario]
+            summary[scenario] = {
+                'endpoint': endpoint,
+                'workflow': workflow,
+                'requests': len(results),
+                'errors': len(results) - len(ok),
+                'error_rate': (len(results) - len(ok)) / len(results),
+                'rps': len(ok) / elapsed if elapsed else 0.0,
+                'latency_p50': percentile(latencies, 50),
+                'latency_p95': percentile(latencies, 95),
+                'latency_p99': percentile(latencies, 99),
+                'ttfb_p50': percentile(ttfbs, 50),
+                'ttfb_p95': percentile(ttfbs, 95),
+                'ttfb_p99': percentile(ttfbs, 99),
+                'error_messages': errors,
+            }
+        return {'elapsed': elapsed, 'concurrency': self.concurrency, 'scenarios': summary}
+
+def format_report(report: Dict[str, Any]) -> str:
+    def ms(value):
+        return '-' if value is None else f"{value * 1000:.0f}"
+    
+    lines = [
+        f"{'endpoint':<25}{'workflow':<19}{'reqs':>6}{'err%':>7}{'rps':>8}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttfb p50':>10}{'ttfb p95':>10}{'ttfb p99':>10}"
+    ]
+    for stats in report['scenarios'].values():
+        lines.append(
+            f"{stats['endpoint']:<25}{stats['workflow']:<19}{stats['requests']:>6}{stats['error_rate'] * 100:>6.1f}%"
+            f"{stats['rps']:>8.2f}{ms(stats['latency_p50']):>9}{ms(stats['latency_p95']):>9}{ms(stats['latency_p99']):>9}"
+            f"{ms(stats['ttfb_p50']):>10}{ms(stats['ttfb_p95']):>10}{ms(stats['ttfb_p99']):>10}"
+        )
+        for message, count in stats['error_messages'].items():
+            lines.append(f"    {count} x {message}")
+    lines.append(f"{len(report['scenarios'])} scenario(s), {report['concurrency']} concurrent clients, {report['elapsed']:.1f}s")
+    return '\n'.join(lines)
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        if float(weight or 1) > 0:
+            mix[name] = float(weight or 1)
+    return mix
+
+def add_stand_in_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('Gemini stand-in')
+    group.add_argument('--first-token-latency', type=float, default=0.8, help='seconds to the first chunk')
+    group.add_argument('--tokens-per-second', type=float, default=150.0, help='streaming rate, 0 = instant')
+    group.add_argument('--failure-rate', type=float, default=0.0, help='fraction of calls that fail')
+    group.add_argument('--mid-stream-failure-rate', type=float, default=0.0, help='fraction of streams that fail midway')
+    group.add_argument('--tail-probability', type=float, default=0.02, help='fraction of slow outliers (5x latency)')
+
+def stand_in_config(args: argparse.Namespace):
+    from loadtest.fake_gemini import FakeGeminiConfig
+    return FakeGeminiConfig(
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        failure_rate=args.failure_rate,
+        mid_stream_failure_rate=args.mid_stream_failure_rate,
+        tail_probability=args.tail_probability
+    )
+
+def prepare_stand_in(fake_config):
+    """Configure this process for the stand-in and install it; must run before the app is imported"""
+    os.environ.setdefault('GEMINI_API_KEY', 'loadtest')
+    os.environ.setdefault('GEMINI_PREWARM', 'false')
+    # Keep per-request warnings (e.g. injected failures being retried) out of the report
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    # The stand-in has no CachedContent API
+    os.environ.setdefault('CONTEXT_CACHE_BACKEND', 'local')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from loadtest.fake_gemini import install
+    return install(fake_config)
+
+def start_local_server(kind: str, fake_config) -> Tuple[str, Any]:
+    """Start the app with the Gemini stand-in in a background thread; returns its URL and the stand-in's call stats"""
+    fake_stats = prepare_stand_in(fake_config)
+    if kind == 'asgi':
+        import uvicorn
+        from asgi import app
+        server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=0, log_level='warning'))
+        threading.Thread(target=server.run, name='loadtest-server', daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        port = server.servers[0].sockets[0].getsockname()[1]
+    else:
+        from werkzeug.serving import make_server
+        from app import app
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True).start()
+        port = server.server_port
+    return f"http://127.0.0.1:{port}", fake_stats
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Load test the Datagent chat endpoints')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--server', choices=['wsgi', 'asgi'], default='asgi',
+                        help='start the app in-process with the Gemini stand-in (default: asgi)')
+    target.add_argument('--url', help='test a running server instead, e.g. one started with python -m loadtest.serve')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('chat=4,stream=2,analysis=1'),
+                        help=f"weighted scenarios out of {', '.join(SCENARIOS)} (default: chat=4,stream=2,analysis=1)")
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=100, help='total requests (ignored with --duration)')
+    parser.add_argument('--duration', type=float, default=0, help='seconds to send load for')
+    parser.add_argument('--dataset', help='CSV to analyze (default: a synthetic one)')
+    parser.add_argument('--rows', type=int, default=5000, help='rows of the synthetic dataset')
+    add_stand_in_arguments(parser)
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--max-error-rate', type=float, default=None, help='exit with status 1 if any scenario exceeds it')
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.WARNING)
+    fake_stats = None
+    if args.url:
+        base_url = args.url
+    else:
+        base_url, fake_stats = start_local_server(args.server, stand_in_config(args))
+    
+    generator = LoadGenerator(
+        base_url, args.mix, args.dataset or make_dataset(args.rows), concurrency=args.concurrency,
+        requests=0 if args.duration else args.requests, duration=args.duration
+    )
+    generator.setup()
+    report = generator.report(generator.run())
+    if fake_stats is not None:
+        report['gemini_stand_in'] = fake_stats.to_dict()
+    print(format_report(report))
+    if fake_stats is not None:
+        print(f"Gemini stand-in: {report['gemini_stand_in']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    if args.max_error_rate is not None and any(s['error_rate'] > args.max_error_rate for s in report['scenarios'].values()):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
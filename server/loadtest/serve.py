@@ -0,0 +1,23 @@
+# Serve the app with the Gemini stand-in, to load test it from another process or host with loadtest.run --url
+import argparse
+from loadtest.run import add_stand_in_arguments, stand_in_config, prepare_stand_in
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve Datagent with the local Gemini stand-in')
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='asgi')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    add_stand_in_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    prepare_stand_in(stand_in_config(args))
+    if args.server == 'asgi':
+        import uvicorn
+        from asgi import app
+        uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+    else:
+        from app import app
+        app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,26 @@
 from dataclasses import dataclass, field
 from typing import List, Optional, Any, Dict
 from datetime import datetime
+import base64
 import uuid
 
+def _encode_figure_data(message: Any) -> Any:
+    """Base64-encode raw figure bytes in a rich response for the JSON payload"""
+    if not isinstance(message, dict) or not isinstance(message.get('content'), list):
+        return message
+    
+    content = []
+    for section in message['content']:
+        figures = section.get('data', {}).get('figures') if isinstance(section.get('data'), dict) else None
+        if figures:
+            section = {**section, 'data': {**section['data'], 'figures': [
+                {**figure, 'data': base64.b64encode(figure['data']).decode('ascii')}
+                if isinstance(figure, dict) and isinstance(figure.get('data'), (bytes, bytearray)) else figure
+                for figure in figures
+            ]}}
+        content.append(section)
+    return {**message, 'content': content}
+
 @dataclass
 class ChatMessage:
     """Represents a single chat message"""
@@ -19,6 +37,9 @@ class ChatMessage:
             'timestamp': self.timestamp.isoformat(),
             'metadata': self.metadata or {}
         }
+    
+    def __json__(self) -> Dict[str, Any]:
+        return self.to_dict()
 
 @dataclass
 class FileUpload:
@@ -58,6 +79,9 @@ class CodeExecution:
             'plots': self.plots,
             'success': self.error is None
         }
+    
+    def __json__(self) -> Dict[str, Any]:
+        return self.to_dict()
 
 @dataclass
 class ChatRequest:
@@ -85,7 +109,15 @@ class ChatResponse:
     
     def to_dict(self) -> Dict[str, Any]:
         return {
-            'message': self.message,
+            'message': _encode_figure_data(self.message),
             'code_executions': [exec.to_dict() for exec in self.code_executions],
             'metadata': self.metadata or {}
         }
+    
+    def __json__(self) -> Dict[str, Any]:
+        """Shallow view for utils.json_encoder; nested values are serialized in place, bytes as base64"""
+        return {
+            'message': self.message,
+            'code_executions': self.code_executions,
+            'metadata': self.metadata or {}
+        }
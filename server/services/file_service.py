@@ -1,11 +1,17 @@
 # File handling service for uploads and management
 import os
+import hashlib
+import threading
 import logging
 from werkzeug.utils import secure_filename
 from typing import Optional, List
 import sys
 sys.path.append('..')
 from models.chat_models import FileUpload
+from utils.dataset_cache import dataset_cache
+from utils.dataset_manager import DatasetManager
+from utils.dataset_profiler import dataset_profiler
+from utils.content_digest import content_digests, DIGEST_CHUNK_SIZE
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -16,6 +22,7 @@ class FileService:
     def __init__(self, upload_folder: str = 'datasets'):
         self.upload_folder = upload_folder
         self.allowed_extensions = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'csv'}
+        self.dataset_manager = DatasetManager(upload_folder)
         
         # Create upload folder if it doesn't exist
         if not os.path.exists(upload_folder):
@@ -39,7 +46,11 @@ class FileService:
             file_path = os.path.join(self.upload_folder, filename)
             
             # Save the file
-            file.save(file_path)
+            self._save_with_digest(file, file_path)
+            
+            # An overwrite can land within the same mtime tick, so drop any cached frame explicitly
+            dataset_cache.invalidate(file_path)
+            self._ingest_dataset(filename)
             
             logger.info(f"File saved successfully: {file_path}")
             return filename  # Return just the filename for use as file_path
@@ -48,6 +59,25 @@ class FileService:
             logger.error(f"Error saving file {file.filename if file else 'unknown'}: {e}")
             raise
 
+    def _save_with_digest(self, file, file_path: str) -> str:
+        """Stream an upload to disk while hashing it, so the content digest costs no extra read"""
+        hasher = hashlib.sha256()
+        temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(temp_path, 'wb') as out:
+                for chunk in iter(lambda: file.stream.read(DIGEST_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+                    out.write(chunk)
+            # Atomic rename so concurrent readers never see a half-written file
+            os.replace(temp_path, file_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        
+        digest = hasher.hexdigest()
+        content_digests.record(file_path, digest)
+        return digest
+    
     def save_uploaded_file_detailed(self, file, original_filename: str) -> FileUpload:
         """Save uploaded file and return FileUpload model"""
         try:
@@ -59,7 +89,9 @@ class FileService:
             file_path = os.path.join(self.upload_folder, filename)
             
             # Save the file
-            file.save(file_path)
+            self._save_with_digest(file, file_path)
+            dataset_cache.invalidate(file_path)
+            self._ingest_dataset(filename)
             
             # Get file info
             file_size = os.path.getsize(file_path)
@@ -77,6 +109,17 @@ class FileService:
             logger.error(f"Error saving file {original_filename}: {e}")
             raise
     
+    def _ingest_dataset(self, filename: str):
+        """Convert a dataset upload to its columnar sidecar and profile it so later requests skip both"""
+        if not filename.endswith(('.csv', '.xlsx', '.json')):
+            return
+        try:
+            df = self.dataset_manager.ingest_dataset(filename)
+            if df is not None:
+                dataset_profiler.get_profile(os.path.join(self.upload_folder, filename), df)
+        except Exception as e:
+            logger.warning(f"Failed to ingest dataset {filename}: {e}")
+    
     def get_file_path(self, filename: str) -> Optional[str]:
         """Get the full path of an uploaded file"""
         file_path = os.path.join(self.upload_folder, filename)
@@ -1,14 +1,21 @@
 # Gemini AI service for chat completions
 import os
+import io
 import logging
 import google.generativeai as genai
-from typing import Optional, Dict, Any, List, Generator
+from PIL import Image
+from typing import Optional, Dict, Any, List, Generator, AsyncGenerator
 import sys
 sys.path.append('..')
 from models.chat_models import ChatMessage, ChatRequest, ChatResponse
 from utils.prompts import GeminiPrompts
 from utils.gemini_factory import GeminiModelFactory
-from utils.file_upload_cache import file_upload_cache
+from utils.file_upload_cache import file_upload_cache, as_file_data
+from utils.dataset_profiler import dataset_profiler
+from utils.figure_store import figure_store
+from utils.async_executor import run_blocking
+from utils.response_cache import response_cache
+from utils.context_cache import context_cache
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -22,34 +29,28 @@ class GeminiService:
     def generate_response(self, request: ChatRequest, uploaded_file_path: Optional[str] = None, plot_images: Optional[List] = None) -> str:
         """Generate a response using Gemini AI with plot context"""
         try:
-            # Create the model
-            model = self.model_factory.create_model()
-            
-            # Prepare the content (prompt + file + plot images if any)
-            content = self._prepare_content_with_plot_history(
-                request.message, 
-                uploaded_file_path, 
-                request.history, 
-                plot_images
-            )
+            # Prepare the content (prompt + file + plot images if any) and the model,
+            # which may already hold the system prompt and dataset in a cached context
+            cached_model, content = self._prepare_request(request, uploaded_file_path, plot_images)
+            model = cached_model or self.model_factory.create_model()
+            
+            cache_key, cached_response = self._lookup_cached_response(content, uploaded_file_path)
+            if cached_response is not None:
+                return cached_response
             
             # Generate response (non-streaming for compatibility)
             if config.ENABLE_STREAMING:
                 # For now, we'll collect streaming response and return as string
                 # Frontend streaming implementation can be added later
-                response_chunks = []
-                stream = self.model_factory.generate_content_stream_with_retry(model, content)
-                for chunk in stream:
-                    if chunk.text:
-                        response_chunks.append(chunk.text)
-                response_text = ''.join(response_chunks)
+                response_text = self.model_factory.generate_text_with_retry(model, content, hedge=config.ENABLE_HEDGING)
             else:
                 response = self.model_factory.generate_content_with_retry(model, content)
                 response_text = response.text
             
             if not response_text:
                 raise ValueError("Empty response from Gemini")
-                
+            
+            response_cache.put(cache_key, response_text)
             return response_text
             
         except Exception as e:
@@ -59,34 +60,133 @@ class GeminiService:
     def generate_response_stream(self, request: ChatRequest, uploaded_file_path: Optional[str] = None, plot_images: Optional[List] = None) -> Generator[str, None, None]:
         """Generate a streaming response using Gemini AI"""
         try:
-            # Create the model
-            model = self.model_factory.create_model()
-            
-            # Prepare the content
-            content = self._prepare_content_with_plot_history(
-                request.message, 
-                uploaded_file_path, 
-                request.history, 
-                plot_images
-            )
+            # Prepare the content and the model
+            cached_model, content = self._prepare_request(request, uploaded_file_path, plot_images)
+            model = cached_model or self.model_factory.create_model()
+            
+            cache_key, cached_response = self._lookup_cached_response(content, uploaded_file_path)
+            if cached_response is not None:
+                yield from response_cache.replay(cached_response)
+                return
             
             # Generate streaming response
             stream = self.model_factory.generate_content_stream_with_retry(model, content)
             
+            response_chunks = []
             for chunk in stream:
                 if chunk.text:
+                    response_chunks.append(chunk.text)
                     yield chunk.text
+            response_cache.put(cache_key, ''.join(response_chunks))
                     
         except Exception as e:
             logger.error(f"Error generating streaming Gemini response: {e}")
             yield f"Error: {str(e)}"
 
+    async def generate_response_async(self, request: ChatRequest, uploaded_file_path: Optional[str] = None, plot_images: Optional[List] = None) -> str:
+        """Generate a response on the event loop; only content preparation (file uploads, profiling, context caching) uses a thread"""
+        try:
+            # Registering a cached context is blocking work too
+            cached_model, content = await run_blocking(self._prepare_request, request, uploaded_file_path, plot_images)
+            model = cached_model or self.model_factory.create_model()
+            
+            cache_key, cached_response = await run_blocking(self._lookup_cached_response, content, uploaded_file_path)
+            if cached_response is not None:
+                return cached_response
+            
+            if config.ENABLE_STREAMING:
+                response_text = await self.model_factory.generate_text_async_with_retry(model, content, hedge=config.ENABLE_HEDGING)
+            else:
+                response = await self.model_factory.generate_content_async_with_retry(model, content)
+                response_text = response.text
+            
+            if not response_text:
+                raise ValueError("Empty response from Gemini")
+            
+            await run_blocking(response_cache.put, cache_key, response_text)
+            return response_text
+            
+        except Exception as e:
+            logger.error(f"Error generating Gemini response: {e}")
+            raise
+    
+    async def generate_response_stream_async(self, request: ChatRequest, uploaded_file_path: Optional[str] = None, plot_images: Optional[List] = None) -> AsyncGenerator[str, None]:
+        """Generate a streaming response on the event loop"""
+        try:
+            # Registering a cached context is blocking work too
+            cached_model, content = await run_blocking(self._prepare_request, request, uploaded_file_path, plot_images)
+            model = cached_model or self.model_factory.create_model()
+            
+            cache_key, cached_response = await run_blocking(self._lookup_cached_response, content, uploaded_file_path)
+            if cached_response is not None:
+                for chunk in response_cache.replay(cached_response):
+                    yield chunk
+                return
+            
+            stream = await self.model_factory.generate_content_stream_async_with_retry(model, content)
+            
+            response_chunks = []
+            async for chunk in stream:
+                if chunk.text:
+                    response_chunks.append(chunk.text)
+                    yield chunk.text
+            await run_blocking(response_cache.put, cache_key, ''.join(response_chunks))
+                    
+        except Exception as e:
+            logger.error(f"Error generating streaming Gemini response: {e}")
+            yield f"Error: {str(e)}"
+
+    def _prepare_request(self, request: ChatRequest, uploaded_file_path: Optional[str] = None, plot_images: Optional[List] = None):
+        """Get the model for a request's cached context (None if there is none) and the content to send with it"""
+        cached_model = None
+        if config.ENABLE_CONTEXT_CACHE and uploaded_file_path and os.path.exists(uploaded_file_path):
+            cached_model = context_cache.get_model(
+                uploaded_file_path,
+                lambda: as_file_data(self._get_gemini_file(uploaded_file_path)),
+                system_instruction=self.prompts.get_system_prompt()
+            )
+        
+        content = self._prepare_content_with_plot_history(
+            request.message,
+            uploaded_file_path,
+            request.history,
+            plot_images,
+            include_dataset_file=cached_model is None
+        )
+        return cached_model, content
+    
+    def _lookup_cached_response(self, content, uploaded_file_path: Optional[str] = None):
+        """Get the response cache key for prepared content and the cached response, if any"""
+        if not config.ENABLE_RESPONSE_CACHE:
+            return None, None
+        cache_key = response_cache.make_key(
+            content,
+            dataset_path=uploaded_file_path,
+            system_instruction=self.prompts.get_system_prompt()
+        )
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            logger.info(f"Serving cached Gemini response {cache_key[:12]}")
+        return cache_key, cached_response
+    
     def _prepare_prompt(self, user_message: str, uploaded_file_path: Optional[str] = None, history: Optional[List] = None, plot_images: Optional[List] = None) -> str:
         """Prepare the prompt for Gemini with plot context"""
         if uploaded_file_path:
-            return self.prompts.get_data_analysis_prompt(user_message, uploaded_file_path, history, plot_images)
+            return self.prompts.get_data_analysis_prompt(
+                user_message, uploaded_file_path, history, plot_images,
+                dataset_profile=self._get_dataset_profile(uploaded_file_path)
+            )
         else:
-            return self.prompts.get_chat_prompt(user_message, history)
+            # The system prompt is the model's system instruction
+            return self.prompts.get_chat_prompt(user_message, history, include_system_prompt=False)
+    
+    def _get_dataset_profile(self, uploaded_file_path: str) -> Optional[Dict[str, Any]]:
+        """Get the precomputed profile for a dataset so the model does not need to derive it"""
+        try:
+            return dataset_profiler.get_profile(uploaded_file_path)
+        except Exception as e:
+            logger.warning(f"Could not load dataset profile for {uploaded_file_path}: {e}")
+            return None
     
     def _prepare_content(self, user_message: str, uploaded_file_path: Optional[str] = None, history: Optional[List] = None, plot_images: Optional[List] = None):
         """Prepare content for Gemini, including file uploads and plot images if needed"""
@@ -94,25 +194,8 @@ class GeminiService:
         
         if uploaded_file_path and os.path.exists(uploaded_file_path):
             try:
-                # Determine the correct MIME type based on file extension
-                mime_type = self._get_mime_type(uploaded_file_path)
-                
-                # Check cache first
-                cached_file = file_upload_cache.get_cached_file(uploaded_file_path)
-                if cached_file:
-                    logger.info(f"Using cached file upload: {cached_file.name}")
-                    return [prompt, cached_file]
-                else:
-                    # Upload file to Gemini with correct MIME type
-                    uploaded_file = genai.upload_file(path=uploaded_file_path, mime_type=mime_type)
-                    logger.info(f"Uploaded file to Gemini: {uploaded_file.name} with MIME type: {mime_type}")
-                    
-                    # Cache the uploaded file
-                    file_upload_cache.cache_file(uploaded_file_path, uploaded_file, mime_type)
-                    
-                    # Return content with both text and file
-                    return [prompt, uploaded_file]
-                
+                # Return content with both text and file
+                return [prompt, self._get_gemini_file(uploaded_file_path)]
             except Exception as e:
                 logger.error(f"Error uploading file to Gemini: {e}")
                 # Fall back to text only
@@ -120,63 +203,52 @@ class GeminiService:
         else:
             return prompt
     
+    def _get_gemini_file(self, uploaded_file_path: str):
+        """Get the Gemini file for a dataset, uploading it only if its content has not been uploaded before"""
+        mime_type = self._get_mime_type(uploaded_file_path)
+        
+        def upload():
+            uploaded_file = genai.upload_file(path=uploaded_file_path, mime_type=mime_type)
+            logger.info(f"Uploaded file to Gemini: {uploaded_file.name} with MIME type: {mime_type}")
+            return uploaded_file
+        
+        return file_upload_cache.get_or_upload(uploaded_file_path, mime_type, upload)
+    
     def _prepare_content_with_plot_history(self, user_message: str, uploaded_file_path: Optional[str] = None,
-                                         history: Optional[List] = None, plot_images: Optional[List] = None):
+                                         history: Optional[List] = None, plot_images: Optional[List] = None,
+                                         include_dataset_file: bool = True):
         """Prepare content for Gemini, including plot images from conversation history"""
         prompt = self._prepare_prompt(user_message, uploaded_file_path, history, plot_images)
         content_parts = [prompt]
         
-        # Add plot images from conversation history using PIL Images
+        # Add plot images from conversation history
         if plot_images:
             logger.info(f"Adding {len(plot_images)} plot images to Gemini context")
             
-            # If plot_images contains PIL Image objects (from PlotContextService)
-            if isinstance(plot_images, list) and plot_images:
-                for idx, img in enumerate(plot_images):
-                    try:
-                        # PIL Images can be directly used with Gemini
-                        content_parts.append(img)
+            for idx, plot in enumerate(plot_images):
+                try:
+                    if isinstance(plot, Image.Image):
+                        # PIL Images (from PlotContextService) can be used directly with Gemini
+                        content_parts.append(plot)
                         logger.info(f"Added PIL plot image {idx + 1} to Gemini context")
-                    except Exception as e:
-                        logger.error(f"Error adding PIL plot image to context: {e}")
-            
-            # If plot_images contains base64 data (legacy support)
-            elif isinstance(plot_images, list):
-                for idx, plot_data in enumerate(plot_images):
-                    if isinstance(plot_data, dict) and plot_data.get('type') == 'matplotlib':
-                        try:
-                            # Convert base64 matplotlib image to PIL Image
-                            import base64
-                            from PIL import Image
-                            import io
-                            
-                            image_bytes = base64.b64decode(plot_data['data'])
-                            pil_image = Image.open(io.BytesIO(image_bytes))
-                            content_parts.append(pil_image)
-                            
-                            logger.info(f"Added base64 plot image {idx + 1} to Gemini context")
-                        except Exception as e:
-                            logger.error(f"Error adding base64 plot image to context: {e}")
+                        continue
+                    
+                    # Figure store references from clients (a digest, or a dict with 'ref'); inline base64 is legacy
+                    if isinstance(plot, dict) and plot.get('type', 'matplotlib') != 'matplotlib':
+                        continue
+                    image_bytes = figure_store.resolve_bytes(plot)
+                    if image_bytes is None:
+                        logger.warning(f"Plot image {idx + 1} could not be resolved, skipping it")
+                        continue
+                    content_parts.append(Image.open(io.BytesIO(image_bytes)))
+                    logger.info(f"Added referenced plot image {idx + 1} to Gemini context")
+                except Exception as e:
+                    logger.error(f"Error adding plot image to context: {e}")
         
-        # Add uploaded dataset file if present
-        if uploaded_file_path and os.path.exists(uploaded_file_path):
+        # Add uploaded dataset file if present (and not already in a cached context)
+        if include_dataset_file and uploaded_file_path and os.path.exists(uploaded_file_path):
             try:
-                mime_type = self._get_mime_type(uploaded_file_path)
-                
-                # Check cache first
-                cached_file = file_upload_cache.get_cached_file(uploaded_file_path)
-                if cached_file:
-                    content_parts.append(cached_file)
-                    logger.info(f"Using cached file upload: {cached_file.name}")
-                else:
-                    # Upload new file and cache it
-                    uploaded_file = genai.upload_file(path=uploaded_file_path, mime_type=mime_type)
-                    content_parts.append(uploaded_file)
-                    
-                    # Cache the uploaded file
-                    file_upload_cache.cache_file(uploaded_file_path, uploaded_file, mime_type)
-                    logger.info(f"Uploaded and cached file: {uploaded_file.name}")
-                    
+                content_parts.append(self._get_gemini_file(uploaded_file_path))
             except Exception as e:
                 logger.error(f"Error uploading dataset file to Gemini: {e}")
 
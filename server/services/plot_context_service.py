@@ -1,12 +1,14 @@
 # Plot Context Manager Service
 import logging
-import base64
 import os
 import time
 from typing import List, Dict, Any, Optional
 import google.generativeai as genai
 from PIL import Image
 import io
+import sys
+sys.path.append('..')
+from utils.figure_store import figure_store
 
 logger = logging.getLogger(__name__)
 
@@ -29,14 +31,18 @@ class PlotContextService:
                 logger.error(f"plot_data must be a dictionary, got {type(plot_data)}")
                 return
                 
-            # Store plot metadata with safe access
+            # Store plot metadata with safe access; images are kept as figure store references
             plot_context = {
                 'type': plot_data.get('type', 'unknown'),
-                'data': plot_data.get('data', ''),
+                'data': plot_data.get('data') or '',
+                'mime_type': plot_data.get('mime_type') or 'image/png',
                 'description': plot_data.get('description', ''),
                 'timestamp': plot_data.get('timestamp', time.time()),
                 'order': len(self.session_plots[session_id]) + 1
             }
+            if plot_data.get('ref'):
+                plot_context.pop('data')
+                plot_context.update({'ref': plot_data['ref'], 'url': plot_data.get('url')})
             
             self.session_plots[session_id].append(plot_context)
             logger.info(f"Added plot {plot_context['order']} to session {session_id}")
@@ -60,8 +66,13 @@ class PlotContextService:
             
             for plot in recent_plots:
                 if plot['type'] == 'matplotlib':
-                    # Convert base64 to PIL Image for Gemini
-                    img_data = base64.b64decode(plot['data'])
+                    if plot.get('mime_type') == 'image/svg+xml':
+                        logger.info(f"Skipping vector plot {plot['order']} for Gemini")
+                        continue
+                    img_data = figure_store.resolve_bytes(plot)
+                    if img_data is None:
+                        logger.warning(f"Plot {plot['order']} is no longer in the figure store")
+                        continue
                     img = Image.open(io.BytesIO(img_data))
                     gemini_images.append(img)
                     logger.info(f"Prepared matplotlib plot {plot['order']} for Gemini")
@@ -1,11 +1,13 @@
 # Response processing service for handling Gemini responses
 import logging
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Any, Optional
 import sys
 sys.path.append('..')
 from models.chat_models import ChatResponse, CodeExecution
-from utils.code_executor import CodeExecutor
+from utils.execution_pool import create_code_executor
 from utils.response_formatter import ResponseFormatter
+from utils.figure_store import figure_store
+from utils.dataset_profiler import dataset_profiler
 
 logger = logging.getLogger(__name__)
 
@@ -13,10 +15,10 @@ class ResponseService:
     """Service for processing and formatting responses"""
     
     def __init__(self):
-        self.code_executor = CodeExecutor()
+        self.code_executor = create_code_executor()
         self.response_formatter = ResponseFormatter()
 
-    def process_gemini_response(self, response_text: str, uploaded_filename: str = None) -> ChatResponse:
+    def process_gemini_response(self, response_text: str, uploaded_filename: str = None, session_id: str = None) -> ChatResponse:
         """Process Gemini response, execute code blocks, and format the response"""
         try:
             # Extract code blocks and clean text
@@ -26,10 +28,8 @@ class ResponseService:
             code_executions = []
             code_outputs = []
             if code_blocks:
-                executions = []
-                for code_block in code_blocks:
-                    exec_result = self.code_executor.execute(code_block, uploaded_filename)
-                    executions.append(exec_result)
+                executions = self._store_figures(self.code_executor.execute_blocks(code_blocks, uploaded_filename, session_id))
+                for exec_result in executions:
                     code_outputs.append({
                         'output': exec_result.get('output', ''),
                         'error': exec_result.get('error', ''),
@@ -39,11 +39,14 @@ class ResponseService:
             
             # Format as rich response
             formatted_response = ResponseFormatter.format_response(response_text, code_outputs)
+            metadata = {'original_response_length': len(response_text)}
+            if code_blocks:
+                self.add_sampling_notice(formatted_response, metadata, uploaded_filename)
             
             return ChatResponse(
                 message=formatted_response,
                 code_executions=code_executions,
-                metadata={'original_response_length': len(response_text)}
+                metadata=metadata
             )
             
         except Exception as e:
@@ -54,6 +57,41 @@ class ResponseService:
                 metadata={'error': str(e)}
             )
     
+    def _store_figures(self, exec_results: List[dict]) -> List[dict]:
+        """Move figure images into the figure store so responses only carry references"""
+        for exec_result in exec_results:
+            if exec_result.get('figures'):
+                exec_result['figures'] = figure_store.store_figures(exec_result['figures'])
+        return exec_results
+    
+    def get_dataset_sample(self, uploaded_filename: str = None) -> Optional[Dict[str, int]]:
+        """Get the sample and total row counts if code for this dataset runs on a sample, else None"""
+        if not uploaded_filename:
+            return None
+        try:
+            profile = dataset_profiler.get_profile(uploaded_filename)
+        except Exception as e:
+            logger.warning(f"Could not load dataset profile for {uploaded_filename}: {e}")
+            return None
+        if not profile or not profile.get('sampled'):
+            return None
+        return {'sample_rows': profile.get('sample_rows'), 'total_rows': profile.get('rows')}
+    
+    def add_sampling_notice(self, formatted_response: Dict[str, Any], metadata: Dict[str, Any], uploaded_filename: str = None):
+        """Tell the user when executed code only saw a sample of their dataset"""
+        dataset_sample = self.get_dataset_sample(uploaded_filename)
+        if dataset_sample is None:
+            return
+        metadata['dataset_sample'] = dataset_sample
+        # Appended, so the positions of the other sections are those of the Gemini response
+        formatted_response['content'].append({
+            'type': 'text',
+            'notice': 'sampled_data',
+            'data': f"⚠️ **Sampled data:** the code in this response ran on a random sample of "
+                    f"{dataset_sample['sample_rows']:,} of {dataset_sample['total_rows']:,} rows. "
+                    "Row and null counts are exact; other statistics and plots reflect the sample."
+        })
+    
     def _convert_to_code_execution(self, exec_result: dict) -> CodeExecution:
         """Convert execution result dict to CodeExecution model"""
         return CodeExecution(
@@ -63,7 +101,8 @@ class ResponseService:
             plots=exec_result.get('plots', [])
         )
     
-    def process_gemini_response_with_step_by_step_plots(self, response_text: str, uploaded_filename: str = None) -> ChatResponse:
+    def process_gemini_response_with_step_by_step_plots(self, response_text: str, uploaded_filename: str = None,
+                                                        session_id: str = None) -> ChatResponse:
         """Process Gemini response with step-by-step plot generation and detailed logging"""
         try:
             logger.info("Starting step-by-step plot processing")
@@ -78,13 +117,13 @@ class ResponseService:
             executions = []
             
             if code_blocks:
-                for i, code_block in enumerate(code_blocks):
+                # With a session the blocks share its kernel; otherwise independent blocks may run concurrently
+                exec_results = self._store_figures(self.code_executor.execute_blocks(code_blocks, uploaded_filename, session_id))
+                
+                for i, (code_block, exec_result) in enumerate(zip(code_blocks, exec_results)):
                     logger.info(f"Processing code block {i+1}/{len(code_blocks)}")
                     logger.info(f"Code preview: {code_block[:100]}...")
                     
-                    # Execute the code block
-                    exec_result = self.code_executor.execute(code_block, uploaded_filename)
-                    
                     # Log execution results
                     if exec_result.get('error'):
                         logger.warning(f"Code block {i+1} had error: {exec_result['error']}")
@@ -109,15 +148,18 @@ class ResponseService:
             # Format as rich response
             formatted_response = ResponseFormatter.format_response(response_text, code_outputs)
             logger.info("Successfully formatted response with plots")
+            metadata = {
+                'original_response_length': len(response_text),
+                'code_blocks_count': len(code_blocks),
+                'total_figures_generated': sum(len(output.get('figures', [])) for output in code_outputs)
+            }
+            if code_blocks:
+                self.add_sampling_notice(formatted_response, metadata, uploaded_filename)
             
             return ChatResponse(
                 message=formatted_response,
                 code_executions=code_executions,
-                metadata={
-                    'original_response_length': len(response_text),
-                    'code_blocks_count': len(code_blocks),
-                    'total_figures_generated': sum(len(output.get('figures', [])) for output in code_outputs)
-                }
+                metadata=metadata
             )
             
         except Exception as e:
@@ -1,6 +1,6 @@
 # Sequential Analysis Workflow Manager
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Generator, AsyncGenerator
 import time
 import sys
 import traceback
@@ -10,15 +10,17 @@ from services.gemini_service import GeminiService
 from services.response_service import ResponseService
 from services.plot_context_service import PlotContextService
 from utils.response_formatter import ResponseFormatter
+from utils.async_executor import run_blocking
 
 logger = logging.getLogger(__name__)
 
 class SequentialWorkflowManager:
     """Manages the sequential analysis workflow with plot feedback"""
     
-    def __init__(self):
-        self.gemini_service = GeminiService()
-        self.response_service = ResponseService()
+    def __init__(self, gemini_service: GeminiService = None, response_service: ResponseService = None):
+        # Share the caller's services (and their code executor) instead of building a second set
+        self.gemini_service = gemini_service or GeminiService()
+        self.response_service = response_service or ResponseService()
         self.plot_context_service = PlotContextService()
         
     def execute_sequential_analysis(self, 
@@ -35,37 +37,211 @@ class SequentialWorkflowManager:
         5. Repeat until complete analysis
         """
         try:
-            logger.info(f"Starting sequential analysis workflow for session {session_id}")
-            
-            # Step 1: Initial Analysis Request
-            logger.info("Step 1: Generating initial analysis")
-            initial_response = self._generate_initial_analysis(request, uploaded_file_path, session_id)
-            logger.info("Initial analysis generated successfully")
-            
-            # Step 2: Process initial response and extract plots
-            logger.info("Step 2: Processing response and extracting plots")
-            processed_response = self._process_response_and_extract_plots(
-                initial_response, uploaded_file_path, session_id
-            )
-            logger.info("Response processed successfully")
-              # Step 3: Sequential plot generation with feedback
-            if self._should_continue_sequential_generation(processed_response):
-                logger.info("Step 3: Continuing sequential generation")
-                enhanced_response = self._continue_sequential_generation(
-                    request, uploaded_file_path, session_id, max_iterations
+            for event in self._analysis_events(request, uploaded_file_path, session_id, max_iterations):
+                if event['type'] == 'complete':
+                    return event['response']
+        except Exception as e:
+            return self._error_response(e, session_id)
+    
+    async def execute_sequential_analysis_async(self, 
+                                               request: ChatRequest, 
+                                               uploaded_file_path: Optional[str] = None,
+                                               session_id: str = "default",
+                                               max_iterations: int = 5) -> ChatResponse:
+        """Async variant of execute_sequential_analysis: Gemini calls are awaited, code execution runs on the blocking pool"""
+        try:
+            async for event in self._analysis_events_async(request, uploaded_file_path, session_id, max_iterations):
+                if event['type'] == 'complete':
+                    return event['response']
+        except Exception as e:
+            return self._error_response(e, session_id)
+    
+    def stream_sequential_analysis(self, 
+                                  request: ChatRequest, 
+                                  uploaded_file_path: Optional[str] = None,
+                                  session_id: str = "default",
+                                  max_iterations: int = 5) -> Generator[Dict[str, Any], None, None]:
+        """Streaming variant of execute_sequential_analysis that yields each step as soon as it completes.
+        
+        Events:
+        - 'progress' before each Gemini round trip ('generating') and code run ('executing')
+        - 'section' for each rich-response section: text as soon as Gemini answers,
+          code with its output and figures once executed; 'index' is its position in that iteration's response
+        - 'figure' for each plot added to the session, as listed in the final response
+        - 'complete' with the ChatResponse execute_sequential_analysis would return, or 'error'
+        """
+        try:
+            yield from self._analysis_events(request, uploaded_file_path, session_id, max_iterations)
+        except Exception as e:
+            logger.error(f"Error in streamed sequential analysis workflow: {e}")
+            logger.error(f"Full traceback: {traceback.format_exc()}")
+            yield {'type': 'error', 'error': str(e)}
+    
+    async def stream_sequential_analysis_async(self, 
+                                              request: ChatRequest, 
+                                              uploaded_file_path: Optional[str] = None,
+                                              session_id: str = "default",
+                                              max_iterations: int = 5) -> AsyncGenerator[Dict[str, Any], None]:
+        """Async variant of stream_sequential_analysis"""
+        try:
+            async for event in self._analysis_events_async(request, uploaded_file_path, session_id, max_iterations):
+                yield event
+        except Exception as e:
+            logger.error(f"Error in streamed sequential analysis workflow: {e}")
+            logger.error(f"Full traceback: {traceback.format_exc()}")
+            yield {'type': 'error', 'error': str(e)}
+    
+    def _analysis_events(self, 
+                         request: ChatRequest, 
+                         uploaded_file_path: Optional[str],
+                         session_id: str,
+                         max_iterations: int) -> Generator[Dict[str, Any], None, None]:
+        """The workflow itself, as the events stream_sequential_analysis documents; errors are raised"""
+        logger.info(f"Starting sequential analysis workflow for session {session_id}")
+        
+        # Step 1: Initial analysis request
+        yield self._progress_event('generating', 0, max_iterations, session_id)
+        initial_response = self._generate_initial_analysis(request, uploaded_file_path, session_id)
+        yield from self._text_section_events(initial_response, 0)
+        
+        # Step 2: Process initial response and extract plots
+        yield self._progress_event('executing', 0, max_iterations, session_id)
+        plot_count = len(self.plot_context_service.get_session_plots(session_id))
+        processed_response = self._process_response_and_extract_plots(
+            initial_response, uploaded_file_path, session_id
+        )
+        yield from self._code_section_events(processed_response, 0)
+        yield from self._figure_events(session_id, plot_count, 0)
+        
+        # Step 3: Sequential plot generation with feedback
+        if self._should_continue_sequential_generation(processed_response):
+            current_plots = self.plot_context_service.get_session_plots(session_id)
+            iterations = 0
+            while iterations < max_iterations and len(current_plots) < 4:
+                iterations += 1
+                logger.info(f"Sequential iteration {iterations}")
+                
+                yield self._progress_event('generating', iterations, max_iterations, session_id)
+                next_request, gemini_plot_images = self._build_next_request(request, session_id)
+                next_response = self.gemini_service.generate_response(
+                    next_request,
+                    uploaded_file_path,
+                    plot_images=gemini_plot_images
+                )
+                yield from self._text_section_events(next_response, iterations)
+                
+                yield self._progress_event('executing', iterations, max_iterations, session_id)
+                plot_count = len(current_plots)
+                yield from self._code_section_events(
+                    self._process_response_and_extract_plots(next_response, uploaded_file_path, session_id),
+                    iterations
                 )
-                return enhanced_response
+                yield from self._figure_events(session_id, plot_count, iterations)
+                
+                current_plots = self.plot_context_service.get_session_plots(session_id)
             
-            return processed_response
+            processed_response = self._compile_final_response(session_id, uploaded_file_path)
+        
+        yield {'type': 'complete', 'response': processed_response}
+    
+    async def _analysis_events_async(self, 
+                                     request: ChatRequest, 
+                                     uploaded_file_path: Optional[str],
+                                     session_id: str,
+                                     max_iterations: int) -> AsyncGenerator[Dict[str, Any], None]:
+        """Async variant of _analysis_events"""
+        logger.info(f"Starting sequential analysis workflow for session {session_id}")
+        
+        yield self._progress_event('generating', 0, max_iterations, session_id)
+        initial_response = await self.gemini_service.generate_response_async(
+            self._build_initial_request(request), 
+            uploaded_file_path
+        )
+        for event in self._text_section_events(initial_response, 0):
+            yield event
+        
+        yield self._progress_event('executing', 0, max_iterations, session_id)
+        plot_count = len(self.plot_context_service.get_session_plots(session_id))
+        processed_response = await run_blocking(
+            self._process_response_and_extract_plots, initial_response, uploaded_file_path, session_id
+        )
+        for event in self._code_section_events(processed_response, 0) + self._figure_events(session_id, plot_count, 0):
+            yield event
+        
+        if self._should_continue_sequential_generation(processed_response):
+            current_plots = self.plot_context_service.get_session_plots(session_id)
+            iterations = 0
+            while iterations < max_iterations and len(current_plots) < 4:
+                iterations += 1
+                logger.info(f"Sequential iteration {iterations}")
+                
+                yield self._progress_event('generating', iterations, max_iterations, session_id)
+                # Plot images are read back from the figure store
+                next_request, gemini_plot_images = await run_blocking(self._build_next_request, request, session_id)
+                next_response = await self.gemini_service.generate_response_async(
+                    next_request,
+                    uploaded_file_path,
+                    plot_images=gemini_plot_images
+                )
+                for event in self._text_section_events(next_response, iterations):
+                    yield event
+                
+                yield self._progress_event('executing', iterations, max_iterations, session_id)
+                plot_count = len(current_plots)
+                next_processed = await run_blocking(
+                    self._process_response_and_extract_plots, next_response, uploaded_file_path, session_id
+                )
+                for event in self._code_section_events(next_processed, iterations) + self._figure_events(session_id, plot_count, iterations):
+                    yield event
+                
+                current_plots = self.plot_context_service.get_session_plots(session_id)
             
-        except Exception as e:
-            error_details = traceback.format_exc()
-            logger.error(f"Error in sequential analysis workflow: {e}")
-            logger.error(f"Full traceback: {error_details}")
-            return ChatResponse(
-                message=f"I encountered an error during the sequential analysis. Error: {str(e)}. Please check the logs for more details.",
-                metadata={'error': str(e), 'traceback': error_details, 'session_id': session_id}
-            )
+            processed_response = self._compile_final_response(session_id, uploaded_file_path)
+        
+        yield {'type': 'complete', 'response': processed_response}
+    
+    def _error_response(self, error: Exception, session_id: str) -> ChatResponse:
+        error_details = traceback.format_exc()
+        logger.error(f"Error in sequential analysis workflow: {error}")
+        logger.error(f"Full traceback: {error_details}")
+        return ChatResponse(
+            message=f"I encountered an error during the sequential analysis. Error: {str(error)}. Please check the logs for more details.",
+            metadata={'error': str(error), 'traceback': error_details, 'session_id': session_id}
+        )
+    
+    def _progress_event(self, stage: str, iteration: int, max_iterations: int, session_id: str) -> Dict[str, Any]:
+        return {
+            'type': 'progress',
+            'stage': stage,
+            'iteration': iteration,
+            'max_iterations': max_iterations,
+            'total_plots': len(self.plot_context_service.get_session_plots(session_id))
+        }
+    
+    def _text_section_events(self, response_text: str, iteration: int) -> List[Dict[str, Any]]:
+        """Text sections of a Gemini response, available before its code has run"""
+        sections = ResponseFormatter.format_response(response_text)['content']
+        return [
+            {'type': 'section', 'iteration': iteration, 'index': index, 'section': section}
+            for index, section in enumerate(sections) if section['type'] == 'text'
+        ]
+    
+    def _code_section_events(self, response: ChatResponse, iteration: int) -> List[Dict[str, Any]]:
+        """Executed code sections of a processed response, and notices about how they ran"""
+        if not isinstance(response.message, dict):
+            return []
+        return [
+            {'type': 'section', 'iteration': iteration, 'index': index, 'section': section}
+            for index, section in enumerate(response.message.get('content', []))
+            if section.get('type') == 'code' or section.get('notice')
+        ]
+    
+    def _figure_events(self, session_id: str, plot_count: int, iteration: int) -> List[Dict[str, Any]]:
+        """Plots added to the session since it had plot_count of them"""
+        return [
+            {'type': 'figure', 'iteration': iteration, 'figure': plot}
+            for plot in self.plot_context_service.get_session_plots(session_id)[plot_count:]
+        ]
     
     def _generate_initial_analysis(self, 
                                  request: ChatRequest, 
@@ -74,6 +250,13 @@ class SequentialWorkflowManager:
         """Generate initial dataset analysis"""
         logger.info("Generating initial dataset analysis")
         
+        return self.gemini_service.generate_response(
+            self._build_initial_request(request), 
+            uploaded_file_path
+        )
+    
+    def _build_initial_request(self, request: ChatRequest) -> ChatRequest:
+        """Wrap the user's request with the sequential workflow instructions"""
         # Add context about sequential workflow
         enhanced_message = f"""
         {request.message}
@@ -88,16 +271,11 @@ class SequentialWorkflowManager:
         Start with the most fundamental visualization that reveals the dataset's core patterns.
         """
         
-        enhanced_request = ChatRequest(
+        return ChatRequest(
             message=enhanced_message,
             history=request.history,
             file_path=request.file_path
         )
-        
-        return self.gemini_service.generate_response(
-            enhanced_request, 
-            uploaded_file_path
-        )
     
     def _process_response_and_extract_plots(self, 
                                           response_text: str, 
@@ -109,7 +287,7 @@ class SequentialWorkflowManager:
         try:
             # Process with step-by-step execution
             processed_response = self.response_service.process_gemini_response_with_step_by_step_plots(
-                response_text, uploaded_file_path
+                response_text, uploaded_file_path, session_id
             )
             
             logger.info(f"Processed response type: {type(processed_response)}")
@@ -136,11 +314,14 @@ class SequentialWorkflowManager:
                                     continue
                                 
                                 # Check if figure is a dictionary (expected format)
-                                if isinstance(figure, dict) and 'type' in figure and 'data' in figure:
+                                if isinstance(figure, dict) and 'type' in figure and ('data' in figure or 'ref' in figure):
                                     self.plot_context_service.add_plot_to_context(
                                         {
                                             'type': figure['type'],
-                                            'data': figure['data'],
+                                            'data': figure.get('data'),
+                                            'ref': figure.get('ref'),
+                                            'url': figure.get('url'),
+                                            'mime_type': figure.get('mime_type'),
                                             'description': section.get('title', 'Generated visualization'),
                                             'timestamp': time.time()
                                         },
@@ -149,7 +330,7 @@ class SequentialWorkflowManager:
                                     logger.info(f"Successfully added figure {idx+1} to plot context")
                                 else:
                                     # Handle PIL Image objects or other formats
-                                    logger.warning(f"Unexpected figure format: {type(figure).__name__}. Expected dict with 'type' and 'data' keys. Skipping figure.")
+                                    logger.warning(f"Unexpected figure format: {type(figure).__name__}. Expected dict with 'type' and 'data' or 'ref' keys. Skipping figure.")
                                     continue
             
             return processed_response
@@ -173,63 +354,34 @@ class SequentialWorkflowManager:
                 return has_plots
         return False
     
-    def _continue_sequential_generation(self, 
-                                      original_request: ChatRequest,
-                                      uploaded_file_path: Optional[str],
-                                      session_id: str,
-                                      max_iterations: int) -> ChatResponse:
-        """Continue generating visualizations with plot context"""
-        logger.info(f"Continuing sequential generation for session {session_id}")
+    def _build_next_request(self, original_request: ChatRequest, session_id: str):
+        """Build the next iteration's request and the plot images it is sent with"""
+        # Prepare plot context for Gemini
+        plot_context = self.plot_context_service.get_context_prompt(session_id)
+        gemini_plot_images = self.plot_context_service.prepare_plots_for_gemini(session_id)
         
-        current_plots = self.plot_context_service.get_session_plots(session_id)
-        iterations = 0
+        # Generate next analysis step with plot context
+        next_request_message = f"""
+        Continue the dataset analysis with the next most important visualization.
         
-        # Continue generating until we have comprehensive analysis
-        while iterations < max_iterations and len(current_plots) < 4:
-            iterations += 1
-            logger.info(f"Sequential iteration {iterations}")
-            
-            # Prepare plot context for Gemini
-            plot_context = self.plot_context_service.get_context_prompt(session_id)
-            gemini_plot_images = self.plot_context_service.prepare_plots_for_gemini(session_id)
-            
-            # Generate next analysis step with plot context
-            next_request_message = f"""
-            Continue the dataset analysis with the next most important visualization.
-            
-            {plot_context}
-            
-            Generate ONE new visualization that:
-            1. Builds upon the previous analysis
-            2. Reveals different patterns or relationships
-            3. Provides additional insights
-            
-            Focus on: correlation analysis, distribution patterns, categorical relationships, or trend analysis.
-            Provide the code for exactly ONE new plot.
-            """
-            
-            next_request = ChatRequest(
-                message=next_request_message,
-                history=[],
-                file_path=original_request.file_path
-            )
-            
-            # Generate response with plot context
-            next_response = self.gemini_service.generate_response(
-                next_request,
-                uploaded_file_path,
-                plot_images=gemini_plot_images
-            )
-            
-            # Process and add new plots to context
-            self._process_response_and_extract_plots(
-                next_response, uploaded_file_path, session_id
-            )
-            
-            current_plots = self.plot_context_service.get_session_plots(session_id)
+        {plot_context}
+        
+        Generate ONE new visualization that:
+        1. Builds upon the previous analysis
+        2. Reveals different patterns or relationships
+        3. Provides additional insights
+        
+        Focus on: correlation analysis, distribution patterns, categorical relationships, or trend analysis.
+        Provide the code for exactly ONE new plot.
+        """
         
-        # Return comprehensive response
-        return self._compile_final_response(session_id, uploaded_file_path)
+        next_request = ChatRequest(
+            message=next_request_message,
+            history=[],
+            file_path=original_request.file_path
+        )
+        
+        return next_request, gemini_plot_images
     
     def _compile_final_response(self, session_id: str, uploaded_file_path: Optional[str]) -> ChatResponse:
         """Compile final comprehensive response with all generated plots"""
@@ -257,11 +409,15 @@ class SequentialWorkflowManager:
                 }
             })
         
+        metadata = {
+            'session_id': session_id,
+            'total_plots': len(plots),
+            'workflow_type': 'sequential_analysis'
+        }
+        if plots:
+            self.response_service.add_sampling_notice(final_message, metadata, uploaded_file_path)
+        
         return ChatResponse(
             message=final_message,
-            metadata={
-                'session_id': session_id,
-                'total_plots': len(plots),
-                'workflow_type': 'sequential_analysis'
-            }
+            metadata=metadata
         )
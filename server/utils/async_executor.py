@@ -0,0 +1,46 @@
+# Offloads blocking work (exec, pandas, file IO, figure encoding) from the event loop
+import os
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class BlockingExecutor:
+    """Runs blocking calls on a bounded thread pool so async routes never stall the loop.
+    
+    LLM calls are awaited natively and do not hold a thread; only the blocking
+    parts of a request (code execution, dataset loading, uploads) use one.
+    """
+    
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or config.ASYNC_BLOCKING_WORKERS
+        self._executor = None
+        self._executor_pid = None
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # A pool inherited from a pre-fork master has no threads behind it
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='blocking')
+            self._executor_pid = os.getpid()
+        return self._executor
+    
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Await a blocking call run on the pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+    
+    def shutdown(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+# Global blocking executor instance
+blocking_executor = BlockingExecutor()
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking callable off the event loop"""
+    return await blocking_executor.run(func, *args, **kwargs)
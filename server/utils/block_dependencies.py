@@ -0,0 +1,170 @@
+# Static read/write analysis of generated code blocks
+import ast
+import logging
+from typing import List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Names the execution namespace provides; sharing them does not make blocks dependent
+NAMESPACE_PROVIDED_NAMES = {
+    'pd', 'np', 'plt', 'sns', 'px', 'go', 'show_plot', 'show_plotly', 'print',
+    'downsample_lttb', 'density_plot'
+}
+
+# Methods that mutate their receiver even without inplace=True
+MUTATING_METHODS = {
+    'append', 'extend', 'insert', 'remove', 'pop', 'clear', 'update', 'setdefault',
+    'add', 'discard', 'sort', 'reverse', 'popitem'
+}
+
+class _ReadWriteVisitor(ast.NodeVisitor):
+    def __init__(self):
+        self.reads = set()
+        self.writes = set()
+        self.imports = set()
+    
+    def _base_name(self, node):
+        while isinstance(node, (ast.Attribute, ast.Subscript)):
+            node = node.value
+        return node.id if isinstance(node, ast.Name) else None
+    
+    def _mark_target(self, target):
+        if isinstance(target, ast.Name):
+            self.writes.add(target.id)
+        elif isinstance(target, (ast.Attribute, ast.Subscript)):
+            # df['col'] = ... or df.attr = ... mutates df
+            base = self._base_name(target)
+            if base:
+                self.reads.add(base)
+                self.writes.add(base)
+            self.visit(target)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for element in target.elts:
+                self._mark_target(element)
+        elif isinstance(target, ast.Starred):
+            self._mark_target(target.value)
+    
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.reads.add(node.id)
+        else:
+            self.writes.add(node.id)
+    
+    def visit_Assign(self, node):
+        self.visit(node.value)
+        for target in node.targets:
+            self._mark_target(target)
+    
+    def visit_AugAssign(self, node):
+        self.visit(node.value)
+        base = self._base_name(node.target)
+        if base:
+            self.reads.add(base)
+        self._mark_target(node.target)
+    
+    def visit_AnnAssign(self, node):
+        if node.value is not None:
+            self.visit(node.value)
+        self._mark_target(node.target)
+    
+    def visit_Delete(self, node):
+        for target in node.targets:
+            self._mark_target(target)
+    
+    def visit_For(self, node):
+        self._mark_target(node.target)
+        self.visit(node.iter)
+        for child in node.body + node.orelse:
+            self.visit(child)
+    
+    def visit_With(self, node):
+        for item in node.items:
+            self.visit(item.context_expr)
+            if item.optional_vars is not None:
+                self._mark_target(item.optional_vars)
+        for child in node.body:
+            self.visit(child)
+    
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Attribute):
+            base = self._base_name(node.func)
+            inplace = any(
+                keyword.arg == 'inplace' and isinstance(keyword.value, ast.Constant) and keyword.value.value is True
+                for keyword in node.keywords
+            )
+            if base and (inplace or node.func.attr in MUTATING_METHODS):
+                self.writes.add(base)
+        self.generic_visit(node)
+    
+    def _visit_definition(self, node):
+        self.writes.add(node.name)
+        # Conservatively treat every name used inside the body as read when the block runs
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Load):
+                self.reads.add(child.id)
+    
+    visit_FunctionDef = _visit_definition
+    visit_AsyncFunctionDef = _visit_definition
+    visit_ClassDef = _visit_definition
+    
+    def visit_Import(self, node):
+        for alias in node.names:
+            name = (alias.asname or alias.name).split('.')[0]
+            self.imports.add(name)
+            self.writes.add(name)
+    
+    visit_ImportFrom = visit_Import
+    
+    def visit_Global(self, node):
+        self.writes.update(node.names)
+
+def analyze_block(code: str) -> Tuple[Set[str], Set[str]]:
+    """Get the top-level names a code block reads and writes.
+    
+    Blocks that fail to parse are reported as touching everything, so they are
+    never reordered relative to other blocks.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return {'*'}, {'*'}
+    
+    visitor = _ReadWriteVisitor()
+    visitor.visit(tree)
+    # A block that imports a module itself does not depend on earlier blocks importing it
+    reads = visitor.reads - visitor.imports - NAMESPACE_PROVIDED_NAMES
+    return reads, visitor.writes - NAMESPACE_PROVIDED_NAMES
+
+def group_dependent_blocks(code_blocks: List[str]) -> List[List[int]]:
+    """Partition blocks into groups that can run concurrently.
+    
+    A later block depends on an earlier one when it reads a name the earlier
+    block writes; in-place mutation such as df['x'] = ... counts as a write.
+    Connected blocks share a group and run in their original order in one
+    namespace, while distinct groups are independent.
+    """
+    analyses = [analyze_block(code) for code in code_blocks]
+    parent = list(range(len(code_blocks)))
+    
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+    
+    for later in range(len(code_blocks)):
+        later_reads = analyses[later][0]
+        for earlier in range(later):
+            earlier_writes = analyses[earlier][1]
+            if not earlier_writes:
+                continue
+            if '*' in earlier_writes or '*' in later_reads or earlier_writes & later_reads:
+                parent[find(later)] = find(earlier)
+    
+    groups = {}
+    for idx in range(len(code_blocks)):
+        groups.setdefault(find(idx), []).append(idx)
+    
+    result = sorted(groups.values(), key=lambda group: group[0])
+    logger.info(f"Grouped {len(code_blocks)} code blocks into {len(result)} independent groups")
+    return result
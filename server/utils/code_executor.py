@@ -1,21 +1,78 @@
 import io
 import sys
-import base64
 import matplotlib
 matplotlib.use('Agg')
 from matplotlib import pyplot as plt
 import seaborn as sns
 import pandas as pd
 import numpy as np
-import plotly
 import plotly.express as px
 import plotly.graph_objects as go
-import json
-from .dataset_manager import DatasetManager
+import os
+import time
+import threading
+from concurrent.futures import Future
+from typing import List
+from .dataset_manager import DatasetManager, example_dataset_manager
+from .block_dependencies import group_dependent_blocks
+from .kernel_manager import kernel_manager, uses_kernel
+from .figure_encoder import figure_encoder
+from .plotly_encoder import encode_plotly_figure
+from .plot_reduction import reduce_matplotlib_figure, reduce_plotly_figure, downsample_lttb, density_plot
+from config import config
 import logging
 
 logger = logging.getLogger(__name__)
 
+# pyplot state and sys.stdout are process-global, so in-process executions must not overlap
+# (threaded and async servers run requests concurrently; the pool engine runs them in separate processes)
+_execution_lock = threading.RLock()
+
+def enable_copy_on_write():
+    """Turn on pandas copy-on-write for this process; call once at startup.
+    
+    Executed code then gets shallow copies of cached datasets (see
+    writable_frame) instead of a full copy per namespace.
+    """
+    pd.options.mode.copy_on_write = True
+
+def writable_frame(df):
+    """Copy a cached dataset for executed code, which may assign into it.
+    
+    Cached frames are shared between executions, and frames memory-mapped from
+    a columnar sidecar are read-only. Under pandas copy-on-write a shallow copy
+    is enough: columns are only copied when the code first writes to them.
+    """
+    if not isinstance(df, pd.DataFrame):
+        return df
+    return df.copy(deep=pd.options.mode.copy_on_write is not True)
+
+class LazyDatasetNamespace(dict):
+    """Execution namespace that loads datasets the first time code references them"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loaders = {}
+        self.loaded_names = set()
+    
+    def add_lazy(self, name: str, loader):
+        """Register a loader that is only called when `name` is first looked up"""
+        if name not in self:
+            self._loaders[name] = loader
+    
+    def __missing__(self, name):
+        # exec() falls back to builtins on KeyError, so unknown names stay cheap
+        loader = self._loaders.pop(name, None)
+        if loader is None:
+            raise KeyError(name)
+        value = loader()
+        if value is None:
+            raise KeyError(name)
+        logger.info(f"Lazily loaded dataset '{name}' into execution namespace")
+        self.loaded_names.add(name)
+        self[name] = value
+        return value
+
 class CodeExecutor:
     def __init__(self, data_path: str = "datasets"):
         self.output = ""
@@ -39,33 +96,51 @@ class CodeExecutor:
             for fig_num in fig_nums:
                 fig = plt.figure(fig_num)
                 if fig is not None:
-                    img_buffer = io.BytesIO()
-                    fig.savefig(img_buffer, format='png', bbox_inches='tight', dpi=150, 
-                               facecolor='white', edgecolor='none')
-                    img_buffer.seek(0)
-                    img_str = base64.b64encode(img_buffer.getvalue()).decode()
-                      # Check if image has meaningful content (remove arbitrary 1000 char limit)
-                    if len(img_str) > 100:  # Very minimal check for actual image data
-                        self.figures.append({
-                            'type': 'matplotlib',
-                            'data': img_str
-                        })
-                        logger.info(f"Matplotlib figure captured (size: {len(img_str)} chars)")
-                    else:
-                        logger.warning(f"Figure too small to be meaningful (size: {len(img_str)} chars)")
-                    img_buffer.close()
+                    # Long lines and dense scatters are reduced before rendering
+                    reductions = reduce_matplotlib_figure(fig)
+                    # Rendered now so the figure can be closed; compression finishes in the encoder pool
+                    self.figures.append(figure_encoder.submit(fig, {'reduction': reductions} if reductions else None))
                     plt.close(fig)
+    
+    def _collect_figures(self):
+        """Wait for pending figure encodes, keeping the figures in capture order"""
+        figures = []
+        for figure in self.figures:
+            if isinstance(figure, Future):
+                try:
+                    figure = figure.result()
+                except Exception as e:
+                    logger.error(f"Failed to encode figure: {e}")
+                    continue
+                # Very minimal check for actual image data
+                if len(figure['data']) <= 75:
+                    logger.warning(f"Figure too small to be meaningful (size: {len(figure['data'])} bytes)")
+                    continue
+                logger.info(f"Matplotlib figure captured (size: {len(figure['data'])} bytes, {figure['mime_type']})")
+            figures.append(figure)
+        self.figures = figures
                     
     def _handle_plotly_figure(self, fig):
-        plotly_json = json.loads(json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder))
-        self.figures.append({
+        reductions = reduce_plotly_figure(fig)
+        plotly_json = encode_plotly_figure(fig)
+        figure = {
             'type': 'plotly',
             'data': plotly_json
-        })
+        }
+        if reductions:
+            figure['reduction'] = reductions
+        self.figures.append(figure)
         logger.info("Plotly figure captured and added to results")
         
-    def execute_code_block(self, code: str, uploaded_filename: str = None, block_index: int = 0) -> dict:
-        """Execute a single code block and return results immediately"""
+    def execute_code_block(self, code: str, uploaded_filename: str = None, block_index: int = 0, namespace: dict = None) -> dict:
+        """Execute a single code block and return results immediately.
+        
+        Pass a namespace to run the block in the state left by earlier blocks.
+        """
+        with _execution_lock:
+            return self._execute_code_block(code, uploaded_filename, block_index, namespace)
+    
+    def _execute_code_block(self, code: str, uploaded_filename: str = None, block_index: int = 0, namespace: dict = None) -> dict:
         logger.info(f"Executing code block {block_index + 1}")
         
         self.output = ""
@@ -75,8 +150,13 @@ class CodeExecutor:
         matplotlib.use('Agg')
         
         # Setup data context
-        df = self._setup_data_context(uploaded_filename)
-        namespace = self._create_namespace(df)
+        if namespace is None:
+            namespace = self.create_block_namespace(uploaded_filename)
+        else:
+            # A shared namespace may have been created by another executor; capture figures here
+            namespace['show_plot'] = self._save_current_figure
+            namespace['show_plotly'] = self._handle_plotly_figure
+        start_time = time.time()
         
         try:
             self._capture_output()
@@ -92,11 +172,12 @@ class CodeExecutor:
             if remaining_figs and not self.figures:
                 logger.info("Auto-capturing remaining figures not captured by show_plot()")
                 self._save_current_figure()
+            self._collect_figures()
               # Log results with debugging info
             if self.figures:
                 logger.info(f"Generated {len(self.figures)} figure(s) in block {block_index + 1}")
                 for i, fig in enumerate(self.figures):
-                    logger.info(f"  Figure {i+1}: type={fig['type']}, data_size={len(fig['data'])} chars")
+                    logger.info(f"  Figure {i+1}: type={fig['type']}, data_size={len(fig['data'])}")
             else:
                 logger.warning(f"No figures captured in block {block_index + 1}! Check:")
                 logger.warning("  - Does code call show_plot()?")
@@ -109,6 +190,7 @@ class CodeExecutor:
         except Exception as e:
             self.error = str(e)
             logger.error(f"Error in code block {block_index + 1}: {self.error}")
+            self._collect_figures()
         finally:
             self._restore_output()
             plt.ion()
@@ -118,74 +200,139 @@ class CodeExecutor:
             'output': self.output,
             'error': self.error,
             'figures': self.figures,
-            'has_plots': len(self.figures) > 0
+            'has_plots': len(self.figures) > 0,
+            'execution_time': time.time() - start_time
         }
     
+    def create_block_namespace(self, uploaded_filename: str = None) -> dict:
+        """Create a fresh namespace for the dataset of this upload"""
+        df, dataset_files = self._setup_data_context(uploaded_filename)
+        return self._create_namespace(df, dataset_files)
+    
+    def get_dataset_signature(self, uploaded_filename: str = None):
+        """Identify the dataset version an upload refers to, so kernels notice re-uploads"""
+        if not uploaded_filename:
+            return None
+        filename = os.path.basename(uploaded_filename)
+        filepath = os.path.join(self.dataset_manager.datasets_path, filename)
+        if not os.path.exists(filepath):
+            return (filename,)
+        stat = os.stat(filepath)
+        return (filename, stat.st_size, stat.st_mtime_ns)
+    
+    def execute_session_blocks(self, code_blocks: List[str], uploaded_filename: str = None, session_id: str = "default") -> List[dict]:
+        """Execute code blocks in order inside the session's persistent kernel"""
+        with _execution_lock:
+            return self._execute_session_blocks(code_blocks, uploaded_filename, session_id)
+    
+    def _execute_session_blocks(self, code_blocks: List[str], uploaded_filename: str = None, session_id: str = "default") -> List[dict]:
+        kernel = kernel_manager.get_kernel(
+            session_id,
+            lambda: self.create_block_namespace(uploaded_filename),
+            self.get_dataset_signature(uploaded_filename)
+        )
+        with kernel.lock:
+            try:
+                return [
+                    self.execute_code_block(code, uploaded_filename, block_index, namespace=kernel.namespace)
+                    for block_index, code in enumerate(code_blocks)
+                ]
+            finally:
+                kernel_manager.release(kernel)
+    
+    def execute_blocks(self, code_blocks: List[str], uploaded_filename: str = None, session_id: str = None) -> List[dict]:
+        """Execute code blocks, sharing a namespace only between blocks that depend on each other.
+        
+        With a client-supplied session_id (and kernels enabled) the blocks instead
+        run in that session's persistent kernel, so their variables survive into
+        later turns.
+        pyplot state is global to the process, so groups run one after another
+        here; the pooled executor runs independent groups concurrently.
+        """
+        if uses_kernel(session_id):
+            return self.execute_session_blocks(code_blocks, uploaded_filename, session_id)
+        
+        with _execution_lock:
+            results = [None] * len(code_blocks)
+            for group in group_dependent_blocks(code_blocks):
+                namespace = self.create_block_namespace(uploaded_filename)
+                for block_index in group:
+                    results[block_index] = self.execute_code_block(
+                        code_blocks[block_index], uploaded_filename, block_index, namespace=namespace
+                    )
+            return results
+    
     def _setup_data_context(self, uploaded_filename: str = None):
-        """Setup the data context for code execution"""
+        """Setup the data context for code execution.
+        
+        Returns the primary DataFrame and the dataset files that belong to this
+        upload, which scopes what the execution namespace exposes by name.
+        """
         df = None
+        dataset_files = []
         if uploaded_filename:
             df = self.dataset_manager.load_dataset(uploaded_filename)
             if df is None:
-                try:
-                    example_manager = DatasetManager("example_data")
-                    df = example_manager.load_dataset(uploaded_filename)
-                except:
-                    pass
+                df = example_dataset_manager.load_dataset(uploaded_filename)
+            else:
+                dataset_files.append(os.path.basename(uploaded_filename))
         
         if df is None:
             df = self.dataset_manager.auto_detect_dataset()
+            if df is not None:
+                dataset_files.append(os.path.basename(self.dataset_manager.current_dataset_path))
             
         if df is None:
-            try:
-                example_manager = DatasetManager("example_data")
-                df = example_manager.auto_detect_dataset()
-            except:
-                pass
+            df = example_dataset_manager.auto_detect_dataset()
                 
-        return df
+        return df, dataset_files
     
-    def _create_namespace(self, df):
-        """Create the execution namespace with all necessary imports and data"""
-        namespace = {
+    def _create_namespace(self, df, dataset_files=None):
+        """Create the execution namespace with all necessary imports and data.
+        
+        Datasets other than the primary `df` are registered lazily and only
+        parsed if the executed code actually references them by name. Code
+        gets writable copies; the cached frames are only read.
+        """
+        df = writable_frame(df)
+        namespace = LazyDatasetNamespace({
             'pd': pd, 'np': np, 'plt': plt, 'sns': sns, 'px': px, 'go': go,
             'show_plot': self._save_current_figure,
             'show_plotly': self._handle_plotly_figure,
+            'downsample_lttb': downsample_lttb, 'density_plot': density_plot,
             'df': df, 'data': df, 'dataset': df,
-        }
+        })
         
-        # Add all available datasets to namespace
-        available_datasets = self.dataset_manager.get_available_datasets()
-        for dataset_file in available_datasets:
+        # Expose the datasets belonging to the current upload by name
+        for dataset_file in dataset_files or []:
             dataset_name = dataset_file.split('.')[0]
-            dataset_df = self.dataset_manager.load_dataset(dataset_file)
-            if dataset_df is not None:
-                namespace[dataset_name] = dataset_df
+            namespace.add_lazy(dataset_name, lambda f=dataset_file: writable_frame(self.dataset_manager.load_dataset(f)))
         
-        # Add example datasets
-        try:
-            example_manager = DatasetManager("example_data")
-            example_datasets = example_manager.get_available_datasets()
-            for dataset_file in example_datasets:
-                dataset_name = f"example_{dataset_file.split('.')[0]}"
-                dataset_df = example_manager.load_dataset(dataset_file)
-                if dataset_df is not None:
-                    namespace[dataset_name] = dataset_df
-        except:
-            pass
+        # Large datasets are loaded as a sample; df_stream gives chunked passes over all rows
+        if dataset_files:
+            namespace.add_lazy('df_stream', lambda f=dataset_files[0]: self.dataset_manager.get_stream(f))
+        
+        # Add example datasets, backed by the shared long-lived example cache
+        for dataset_file in example_dataset_manager.get_available_datasets():
+            dataset_name = f"example_{dataset_file.split('.')[0]}"
+            namespace.add_lazy(dataset_name, lambda f=dataset_file: writable_frame(example_dataset_manager.load_dataset(f)))
             
         return namespace
         
     def execute(self, code: str, uploaded_filename: str = None) -> dict:
         """Legacy execute method for backward compatibility"""
+        with _execution_lock:
+            return self._execute(code, uploaded_filename)
+    
+    def _execute(self, code: str, uploaded_filename: str = None) -> dict:
         self.output = ""
         self.error = None
         self.figures = []
         
         matplotlib.use('Agg')
         
-        df = self._setup_data_context(uploaded_filename)
-        namespace = self._create_namespace(df)
+        df, dataset_files = self._setup_data_context(uploaded_filename)
+        namespace = self._create_namespace(df, dataset_files)
         
         try:
             self._capture_output()
@@ -197,6 +344,7 @@ class CodeExecutor:
         finally:
             self._restore_output()
             plt.ion()
+            self._collect_figures()
         
         return {
             'output': self.output,
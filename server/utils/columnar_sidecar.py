@@ -0,0 +1,105 @@
+# Columnar (Arrow IPC) sidecar files for uploaded datasets
+import os
+import json
+import logging
+from typing import Optional
+import pandas as pd
+from config import config
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_METADATA_KEY = b'datagent.source'
+
+class ColumnarSidecarStore:
+    """Stores parsed datasets as uncompressed Arrow IPC files next to their source.
+    
+    The sidecar keeps the schema inferred by the first parse, and because it is
+    uncompressed it can be memory-mapped so later loads skip CSV parsing.
+    """
+    
+    def __init__(self, enabled: bool = None):
+        if enabled is None:
+            enabled = config.ENABLE_COLUMNAR_SIDECAR
+        self.enabled = enabled and pa is not None
+    
+    def get_sidecar_path(self, source_path: str) -> str:
+        """Get the sidecar path for a dataset file"""
+        directory, filename = os.path.split(source_path)
+        return os.path.join(directory, f".{filename}.arrow")
+    
+    def _get_source_signature(self, source_path: str) -> Optional[dict]:
+        try:
+            stat = os.stat(source_path)
+            return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        except OSError:
+            return None
+    
+    def read(self, source_path: str) -> Optional[pd.DataFrame]:
+        """Memory-map the sidecar for a dataset if it is up to date with its source"""
+        if not self.enabled:
+            return None
+        
+        sidecar_path = self.get_sidecar_path(source_path)
+        if not os.path.exists(sidecar_path):
+            return None
+        
+        try:
+            source = pa.memory_map(sidecar_path, 'r')
+            reader = pa.ipc.open_file(source)
+            metadata = reader.schema.metadata or {}
+            
+            if json.loads(metadata.get(SIDECAR_METADATA_KEY, b'null')) != self._get_source_signature(source_path):
+                logger.info(f"Sidecar is stale for {source_path}, ignoring it")
+                return None
+            
+            # split_blocks avoids consolidating columns, so null-free numeric columns stay zero-copy, read-only views
+            # (CodeExecutor hands generated code a writable copy)
+            table = reader.read_all()
+            return table.to_pandas(split_blocks=True)
+        except Exception as e:
+            logger.warning(f"Failed to read sidecar for {source_path}: {e}")
+            return None
+    
+    def write(self, source_path: str, df: pd.DataFrame) -> bool:
+        """Write the sidecar for a freshly parsed dataset"""
+        if not self.enabled:
+            return False
+        
+        signature = self._get_source_signature(source_path)
+        if signature is None:
+            return False
+        
+        sidecar_path = self.get_sidecar_path(source_path)
+        temp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+        try:
+            table = pa.Table.from_pandas(df)
+            metadata = dict(table.schema.metadata or {})
+            metadata[SIDECAR_METADATA_KEY] = json.dumps(signature).encode()
+            table = table.replace_schema_metadata(metadata)
+            
+            # Uncompressed so the file can be memory-mapped without a decode pass
+            feather.write_feather(table, temp_path, compression='uncompressed')
+            os.replace(temp_path, sidecar_path)
+            logger.info(f"Wrote columnar sidecar: {sidecar_path}")
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to write sidecar for {source_path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+    
+    def remove(self, source_path: str):
+        """Remove the sidecar for a dataset file"""
+        sidecar_path = self.get_sidecar_path(source_path)
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+
+# Global sidecar store instance
+columnar_sidecar_store = ColumnarSidecarStore()
@@ -0,0 +1,91 @@
+# Content digests for uploaded files
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DIGEST_CHUNK_SIZE = 1024 * 1024
+# Memoized digests kept per process; older entries are re-read from their sidecar when needed
+MAX_MEMOIZED_DIGESTS = 4096
+
+class ContentDigestRegistry:
+    """Computes and memoizes SHA-256 digests of file contents.
+    
+    Digests recorded at upload time are also written to a small sidecar next to
+    the file so other worker processes can reuse them without re-reading it.
+    """
+    
+    def __init__(self, max_entries: int = MAX_MEMOIZED_DIGESTS):
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+    
+    def _get_signature(self, file_path: str):
+        stat = os.stat(file_path)
+        return (stat.st_size, stat.st_mtime_ns)
+    
+    def _get_sidecar_path(self, file_path: str) -> str:
+        directory, filename = os.path.split(file_path)
+        return os.path.join(directory, f".{filename}.sha256")
+    
+    def _read_sidecar(self, file_path: str, signature) -> Optional[str]:
+        try:
+            with open(self._get_sidecar_path(file_path), 'r') as f:
+                entry = json.load(f)
+            if (entry['size'], entry['mtime_ns']) == signature:
+                return entry['digest']
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+    
+    def record(self, file_path: str, digest: str):
+        """Record a digest computed while the file was being written"""
+        try:
+            signature = self._get_signature(file_path)
+            self._remember(os.path.abspath(file_path), signature, digest)
+            with open(self._get_sidecar_path(file_path), 'w') as f:
+                json.dump({'size': signature[0], 'mtime_ns': signature[1], 'digest': digest}, f)
+        except OSError as e:
+            logger.warning(f"Failed to record content digest for {file_path}: {e}")
+    
+    def _remember(self, key: str, signature, digest: str):
+        with self._lock:
+            self._digests[key] = (signature, digest)
+            self._digests.move_to_end(key)
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+    
+    def compute_digest(self, file_path: str) -> str:
+        """Hash a file's contents in fixed-size chunks"""
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    
+    def get_digest(self, file_path: str) -> Optional[str]:
+        """Get the content digest of a file, reusing it while the file is unchanged"""
+        try:
+            key = os.path.abspath(file_path)
+            signature = self._get_signature(file_path)
+            with self._lock:
+                entry = self._digests.get(key)
+                if entry is not None:
+                    self._digests.move_to_end(key)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+            
+            digest = self._read_sidecar(file_path, signature) or self.compute_digest(file_path)
+            self._remember(key, signature, digest)
+            return digest
+        except OSError as e:
+            logger.error(f"Failed to compute content digest for {file_path}: {e}")
+            return None
+
+# Global digest registry instance
+content_digests = ContentDigestRegistry()
@@ -0,0 +1,234 @@
+# Context caching: register the system prompt and a dataset once, then reference them on later turns
+import os
+import time
+import hashlib
+import sqlite3
+import datetime
+import threading
+import logging
+from typing import Optional, Dict, Any, Callable, List
+import google.generativeai as genai
+from google.generativeai import caching
+from google.api_core import exceptions as api_exceptions
+from config import config
+from utils.content_digest import content_digests
+from utils.keyed_locks import KeyedLocks
+from utils.gemini_factory import gemini_client_pool, GeminiModelFactory
+
+logger = logging.getLogger(__name__)
+
+# Contexts this close to expiry are replaced rather than referenced
+REFRESH_MARGIN = 300
+# After a failed registration (e.g. content below Gemini's minimum size), wait this long before retrying it
+FAILURE_RETRY_INTERVAL = 600
+
+class CachedContext:
+    """A registered prefix and the model that references it"""
+    def __init__(self, name: str, model, expires_at: float):
+        self.name = name
+        self.model = model
+        self.expires_at = expires_at
+
+class GeminiContextBackend:
+    """Gemini CachedContent: the prefix is stored server-side and billed at the cached-token rate.
+    
+    The resource name of each registered context is kept in a SQLite table
+    shared by the worker processes, so a context another process registered
+    is fetched by name instead of by listing every CachedContent.
+    """
+    
+    def __init__(self):
+        self._local = threading.local()
+        self.cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+        self.db_path = os.path.join(self.cache_dir, 'context_cache.db')
+        self._db_ready = False
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if not self._db_ready:
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS cached_contexts (
+                        display_name TEXT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        expires_at REAL NOT NULL
+                    )"""
+                )
+                self._db_ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def _get_model(self, cached_content):
+        return genai.GenerativeModel.from_cached_content(
+            cached_content,
+            generation_config=config.GENERATION_CONFIG,
+            safety_settings=config.SAFETY_SETTINGS
+        )
+    
+    def find(self, display_name: str) -> Optional[CachedContext]:
+        """Find a context another process already registered"""
+        conn = self._get_connection()
+        row = conn.execute(
+            'SELECT name, expires_at FROM cached_contexts WHERE display_name = ?', (display_name,)
+        ).fetchone()
+        if row is None:
+            return None
+        name, expires_at = row
+        if expires_at - time.time() <= REFRESH_MARGIN:
+            conn.execute('DELETE FROM cached_contexts WHERE display_name = ?', (display_name,))
+            return None
+        try:
+            cached_content = caching.CachedContent.get(name)
+        except api_exceptions.NotFound:
+            # Deleted outside this app
+            conn.execute('DELETE FROM cached_contexts WHERE display_name = ?', (display_name,))
+            return None
+        return CachedContext(cached_content.name, self._get_model(cached_content), cached_content.expire_time.timestamp())
+    
+    def create(self, display_name: str, model_name: str, system_instruction: str, contents: List[Any], ttl: float) -> CachedContext:
+        cached_content = caching.CachedContent.create(
+            model=model_name,
+            display_name=display_name,
+            system_instruction=system_instruction,
+            contents=contents,
+            ttl=datetime.timedelta(seconds=ttl)
+        )
+        logger.info(f"Registered Gemini cached context {cached_content.name} ({cached_content.usage_metadata.total_token_count} tokens)")
+        expires_at = time.time() + ttl
+        self._get_connection().execute(
+            'INSERT OR REPLACE INTO cached_contexts (display_name, name, expires_at) VALUES (?, ?, ?)',
+            (display_name, cached_content.name, expires_at)
+        )
+        return CachedContext(cached_content.name, self._get_model(cached_content), expires_at)
+    
+    def delete(self, context: CachedContext):
+        self._get_connection().execute('DELETE FROM cached_contexts WHERE name = ?', (context.name,))
+        caching.CachedContent.get(context.name).delete()
+
+class LocalCachedModel:
+    """Model stand-in that sends the registered prefix with every request"""
+    def __init__(self, model, contents: List[Any]):
+        self.model = model
+        self.contents = contents
+    
+    def _with_prefix(self, content) -> List[Any]:
+        return [*self.contents, *(content if isinstance(content, list) else [content])]
+    
+    def generate_content(self, content, **kwargs):
+        return self.model.generate_content(self._with_prefix(content), **kwargs)
+    
+    def start_content_stream(self, content):
+        return GeminiModelFactory.start_content_stream(self.model, self._with_prefix(content))
+    
+    async def generate_content_async(self, content, **kwargs):
+        return await self.model.generate_content_async(self._with_prefix(content), **kwargs)
+
+class LocalContextBackend:
+    """In-process stand-in for development and tests; saves no tokens, but requests are built exactly as with Gemini"""
+    
+    def __init__(self):
+        self._contexts = {}
+    
+    def find(self, display_name: str) -> Optional[CachedContext]:
+        context = self._contexts.get(display_name)
+        if context is not None and context.expires_at - time.time() > REFRESH_MARGIN:
+            return context
+        return None
+    
+    def create(self, display_name: str, model_name: str, system_instruction: str, contents: List[Any], ttl: float) -> CachedContext:
+        model = gemini_client_pool.get_model(model_name, system_instruction=system_instruction)
+        context = CachedContext(display_name, LocalCachedModel(model, contents), time.time() + ttl)
+        self._contexts[display_name] = context
+        return context
+    
+    def delete(self, context: CachedContext):
+        self._contexts.pop(context.name, None)
+
+class ContextCache:
+    """Registers (system prompt + dataset file) once and hands out models that reference it.
+    
+    Contexts are keyed by the dataset's content digest, the system prompt and
+    the model, so every session and turn on the same data shares one. The
+    Gemini backend finds contexts registered by other worker processes through
+    its table of context names. A failed registration falls back to sending
+    the full content, and is not retried for a while.
+    """
+    
+    def __init__(self, backend: str = None, ttl: float = None):
+        self.ttl = ttl or config.CONTEXT_CACHE_TTL
+        backend = (backend or config.CONTEXT_CACHE_BACKEND).lower()
+        self.backend = LocalContextBackend() if backend == 'local' else GeminiContextBackend()
+        self._contexts = {}
+        self._failures = {}
+        self._key_locks = KeyedLocks()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.registered = 0
+        self.failed = 0
+    
+    def _get_key(self, dataset_digest: str, system_instruction: str, model_name: str) -> str:
+        hasher = hashlib.sha256(f"{model_name}:{dataset_digest}:".encode())
+        hasher.update((system_instruction or '').encode())
+        return f"datagent-{hasher.hexdigest()[:48]}"
+    
+    def get_model(self, dataset_path: str, get_file: Callable[[], Any], system_instruction: str = None, model_name: str = None):
+        """Get a model whose context already holds the system prompt and dataset, or None to send them with the request"""
+        try:
+            if os.path.getsize(dataset_path) < config.CONTEXT_CACHE_MIN_BYTES:
+                return None
+        except OSError:
+            return None
+        dataset_digest = content_digests.get_digest(dataset_path)
+        if dataset_digest is None:
+            return None
+        model_name = model_name or config.GEMINI_MODEL_NAME
+        key = self._get_key(dataset_digest, system_instruction, model_name)
+        
+        context = self._get_valid(key)
+        if context is not None:
+            return context.model
+        
+        with self._key_locks.hold(key):
+            context = self._get_valid(key)
+            if context is not None:
+                return context.model
+            if time.time() - self._failures.get(key, 0) < FAILURE_RETRY_INTERVAL:
+                return None
+            try:
+                context = self.backend.find(key) or self.backend.create(key, model_name, system_instruction, [get_file()], self.ttl)
+            except Exception as e:
+                logger.warning(f"Could not register cached context for {os.path.basename(dataset_path)}, sending it with each request: {e}")
+                with self._lock:
+                    self._failures[key] = time.time()
+                    self.failed += 1
+                return None
+            with self._lock:
+                self._contexts[key] = context
+                self._failures.pop(key, None)
+                self.registered += 1
+            return context.model
+    
+    def _get_valid(self, key: str) -> Optional[CachedContext]:
+        with self._lock:
+            context = self._contexts.get(key)
+            if context is None:
+                return None
+            if context.expires_at - time.time() <= REFRESH_MARGIN:
+                del self._contexts[key]
+                return None
+            self.hits += 1
+            return context
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'contexts': len(self._contexts), 'hits': self.hits, 'registered': self.registered, 'failed': self.failed}
+
+# Global context cache instance
+context_cache = ContextCache()
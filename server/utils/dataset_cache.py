@@ -0,0 +1,130 @@
+# Memory-budgeted cache for parsed datasets shared by all DatasetManagers
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+import pandas as pd
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class DatasetCache:
+    """Byte-bounded LRU/LFU cache of DataFrames validated against file stat"""
+    
+    def __init__(self, max_bytes: int = None, policy: str = None):
+        self.max_bytes = max_bytes if max_bytes is not None else config.DATASET_CACHE_MAX_BYTES
+        self.policy = (policy or config.DATASET_CACHE_POLICY).lower()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def _get_signature(self, filepath: str) -> Optional[Tuple[int, int]]:
+        """Get the (size, mtime_ns) signature used to detect changed files"""
+        try:
+            stat = os.stat(filepath)
+            return (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            return None
+    
+    def _measure(self, df: pd.DataFrame) -> int:
+        """Measure the resident size of a DataFrame in bytes"""
+        try:
+            return int(df.memory_usage(deep=True).sum())
+        except Exception:
+            return 0
+    
+    def _remove(self, filepath: str):
+        entry = self._entries.pop(filepath, None)
+        if entry is not None:
+            self.resident_bytes -= entry['nbytes']
+        return entry
+    
+    def _select_victim(self) -> str:
+        if self.policy == 'lfu':
+            # Least frequently used, ties broken by recency (oldest first)
+            return min(self._entries, key=lambda key: self._entries[key]['uses'])
+        return next(iter(self._entries))
+    
+    def get(self, filepath: str) -> Optional[pd.DataFrame]:
+        """Get a cached DataFrame if the file on disk has not changed"""
+        filepath = os.path.abspath(filepath)
+        signature = self._get_signature(filepath)
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            if entry['signature'] != signature:
+                self._remove(filepath)
+                self.invalidations += 1
+                self.misses += 1
+                logger.info(f"Dataset cache entry invalidated for changed file: {filepath}")
+                return None
+            
+            entry['uses'] += 1
+            self._entries.move_to_end(filepath)
+            self.hits += 1
+            return entry['df']
+    
+    def put(self, filepath: str, df: pd.DataFrame):
+        """Cache a DataFrame, evicting other entries to stay within the byte budget"""
+        filepath = os.path.abspath(filepath)
+        signature = self._get_signature(filepath)
+        nbytes = self._measure(df)
+        
+        with self._lock:
+            self._remove(filepath)
+            
+            if nbytes > self.max_bytes:
+                logger.warning(f"Dataset {filepath} ({nbytes} bytes) exceeds cache budget, not caching")
+                return
+            
+            while self._entries and self.resident_bytes + nbytes > self.max_bytes:
+                victim = self._select_victim()
+                self._remove(victim)
+                self.evictions += 1
+                logger.info(f"Evicted dataset from cache: {victim}")
+            
+            self._entries[filepath] = {
+                'df': df,
+                'signature': signature,
+                'nbytes': nbytes,
+                'uses': 1
+            }
+            self.resident_bytes += nbytes
+    
+    def invalidate(self, filepath: str):
+        """Drop a cached entry, e.g. after the file was overwritten by an upload"""
+        filepath = os.path.abspath(filepath)
+        with self._lock:
+            if self._remove(filepath) is not None:
+                self.invalidations += 1
+    
+    def clear(self):
+        """Clear all cache entries"""
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'resident_bytes': self.resident_bytes,
+                'max_bytes': self.max_bytes,
+                'policy': self.policy,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+# Global cache instance
+dataset_cache = DatasetCache()
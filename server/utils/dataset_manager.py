@@ -2,39 +2,75 @@ import os
 import pandas as pd
 import json
 from typing import Dict, Optional, List
+from .dataset_cache import dataset_cache
+from .columnar_sidecar import columnar_sidecar_store
+from .streaming_dataset import StreamingDataset, streaming_registry, get_streaming_threshold
 
 class DatasetManager:
     def __init__(self, datasets_path: str = "datasets"):
         self.datasets_path = datasets_path
         self.current_dataset_path = None
-        self.datasets_cache = {}
+        self.datasets_cache = dataset_cache
+        self.sidecar_store = columnar_sidecar_store
         
     def load_dataset(self, filename: str) -> Optional[pd.DataFrame]:
         """Load a dataset from the datasets folder."""
-        filepath = os.path.join(self.datasets_path, filename)
+        filepath = os.path.join(self.datasets_path, os.path.basename(filename))
         
         if not os.path.exists(filepath):
             return None
             
         try:
-            if filepath not in self.datasets_cache:
-                if filename.endswith('.csv'):
-                    df = pd.read_csv(filepath)
-                elif filename.endswith('.xlsx'):
-                    df = pd.read_excel(filepath)
-                elif filename.endswith('.json'):
-                    df = pd.read_json(filepath)
-                else:
-                    return None
+            df = self.datasets_cache.get(filepath)
+            if df is None and self.should_stream(filepath):
+                # Too large to hold in memory: expose a bounded sample, full passes go through get_stream()
+                df = streaming_registry.get(filepath).sample
+                self.datasets_cache.put(filepath, df)
+            elif df is None:
+                df = self.sidecar_store.read(filepath)
+                if df is None:
+                    df = self._parse_dataset(filepath)
+                    if df is None:
+                        return None
+                    self.sidecar_store.write(filepath, df)
                     
-                self.datasets_cache[filepath] = df
+                self.datasets_cache.put(filepath, df)
                 
             self.current_dataset_path = filepath
-            return self.datasets_cache[filepath]
+            return df
             
         except Exception:
             return None
     
+    def should_stream(self, filepath: str) -> bool:
+        """Check whether a dataset is large enough to require chunked ingestion."""
+        return filepath.endswith('.csv') and os.path.getsize(filepath) > get_streaming_threshold()
+    
+    def get_stream(self, filename: str) -> Optional[StreamingDataset]:
+        """Get the full-data streaming handle for a dataset loaded in streaming mode."""
+        filepath = os.path.join(self.datasets_path, os.path.basename(filename))
+        if not os.path.exists(filepath) or not self.should_stream(filepath):
+            return None
+        return streaming_registry.get(filepath)
+    
+    def _parse_dataset(self, filepath: str) -> Optional[pd.DataFrame]:
+        """Parse a dataset from its source format."""
+        if filepath.endswith('.csv'):
+            return pd.read_csv(filepath)
+        elif filepath.endswith('.xlsx'):
+            return pd.read_excel(filepath)
+        elif filepath.endswith('.json'):
+            return pd.read_json(filepath)
+        return None
+    
+    def ingest_dataset(self, filename: str) -> Optional[pd.DataFrame]:
+        """Parse a newly uploaded dataset once and persist its columnar sidecar."""
+        filepath = os.path.join(self.datasets_path, os.path.basename(filename))
+        self.datasets_cache.invalidate(filepath)
+        self.sidecar_store.remove(filepath)
+        streaming_registry.invalidate(filepath)
+        return self.load_dataset(filename)
+    
     def get_available_datasets(self) -> List[str]:
         """Get list of available datasets in the datasets folder."""
         if not os.path.exists(self.datasets_path):
@@ -49,8 +85,8 @@ class DatasetManager:
     
     def get_current_dataset(self) -> Optional[pd.DataFrame]:
         """Get the currently loaded dataset."""
-        if self.current_dataset_path and self.current_dataset_path in self.datasets_cache:
-            return self.datasets_cache[self.current_dataset_path]
+        if self.current_dataset_path:
+            return self.datasets_cache.get(self.current_dataset_path)
         return None
     
     def auto_detect_dataset(self) -> Optional[pd.DataFrame]:
@@ -88,3 +124,7 @@ class DatasetManager:
             'head': df.head().to_dict('records'),
             'description': df.describe().to_dict() if len(df.select_dtypes(include='number').columns) > 0 else {}
         }
+
+# Shared manager for the bundled example datasets so their parsed frames
+# survive across code executions instead of being re-read every block
+example_dataset_manager = DatasetManager("example_data")
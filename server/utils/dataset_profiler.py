@@ -0,0 +1,173 @@
+# Dataset profiling computed once per file content and persisted on disk
+import os
+import json
+import math
+import threading
+import logging
+from datetime import datetime, date
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+import numpy as np
+import pandas as pd
+from .dataset_manager import DatasetManager
+from .content_digest import content_digests
+
+logger = logging.getLogger(__name__)
+
+PROFILE_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+PROFILE_VERSION = 2
+# Profiles kept in memory; older ones are read back from the on-disk store
+MAX_MEMOIZED_PROFILES = 64
+
+def _to_builtin(value):
+    """Convert numpy/pandas scalars into JSON-safe builtins"""
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return None if math.isnan(value) or math.isinf(value) else float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (str, int, bool)):
+        return value
+    return str(value)
+
+class DatasetProfiler:
+    """Builds schema and per-column statistics for a dataset, keyed by content digest"""
+    
+    def __init__(self, top_k: int = 5, max_memoized: int = MAX_MEMOIZED_PROFILES):
+        self.top_k = top_k
+        self.max_memoized = max_memoized
+        self.profile_dir = os.path.join(os.path.dirname(__file__), 'cache', 'profiles')
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+    
+    def profile_dataframe(self, df: pd.DataFrame) -> Dict[str, Any]:
+        """Compute the profile of a DataFrame with column-vectorized pandas operations"""
+        numeric = df.select_dtypes(include='number')
+        null_counts = df.isna().sum()
+        cardinality = df.nunique(dropna=True)
+        quantiles = numeric.quantile(PROFILE_QUANTILES) if not numeric.empty else pd.DataFrame()
+        means = numeric.mean()
+        stds = numeric.std()
+        mins = numeric.min()
+        maxs = numeric.max()
+        
+        columns = {}
+        for column in df.columns:
+            series = df[column]
+            column_profile = {
+                'dtype': str(series.dtype),
+                'null_count': _to_builtin(null_counts[column]),
+                'null_pct': round(float(null_counts[column]) / len(df) * 100, 2) if len(df) else 0.0,
+                'cardinality': _to_builtin(cardinality[column]),
+                'top_values': [
+                    {'value': _to_builtin(value), 'count': _to_builtin(count)}
+                    for value, count in series.value_counts(dropna=True).head(self.top_k).items()
+                ]
+            }
+            
+            if column in numeric.columns:
+                column_profile.update({
+                    'min': _to_builtin(mins[column]),
+                    'max': _to_builtin(maxs[column]),
+                    'mean': _to_builtin(means[column]),
+                    'std': _to_builtin(stds[column]),
+                    'quantiles': {str(q): _to_builtin(quantiles.at[q, column]) for q in PROFILE_QUANTILES}
+                })
+            elif pd.api.types.is_datetime64_any_dtype(series):
+                column_profile.update({
+                    'min': _to_builtin(series.min()),
+                    'max': _to_builtin(series.max())
+                })
+            
+            columns[str(column)] = column_profile
+        
+        return {
+            'version': PROFILE_VERSION,
+            'rows': int(len(df)),
+            'column_count': int(df.shape[1]),
+            'memory_bytes': int(df.memory_usage(deep=True).sum()),
+            'duplicate_rows': int(df.duplicated().sum()),
+            'sampled': bool(df.attrs.get('datagent_sampled', False)),
+            'columns': columns
+        }
+    
+    def _get_profile_path(self, digest: str) -> str:
+        return os.path.join(self.profile_dir, f"{digest}.json")
+    
+    def _load_profile(self, digest: str) -> Optional[Dict[str, Any]]:
+        profile_path = self._get_profile_path(digest)
+        try:
+            if os.path.exists(profile_path):
+                with open(profile_path, 'r') as f:
+                    profile = json.load(f)
+                if profile.get('version') == PROFILE_VERSION:
+                    return profile
+        except Exception as e:
+            logger.warning(f"Failed to load dataset profile {digest}: {e}")
+        return None
+    
+    def _save_profile(self, digest: str, profile: Dict[str, Any]):
+        profile_path = self._get_profile_path(digest)
+        temp_path = f"{profile_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(profile, f)
+            os.replace(temp_path, profile_path)
+        except Exception as e:
+            logger.error(f"Failed to save dataset profile {digest}: {e}")
+    
+    def get_profile(self, file_path: str, df: Optional[pd.DataFrame] = None) -> Optional[Dict[str, Any]]:
+        """Get the profile for a dataset file, computing and persisting it on first use"""
+        if not file_path or not file_path.endswith(('.csv', '.xlsx', '.json')) or not os.path.exists(file_path):
+            return None
+        
+        digest = content_digests.get_digest(file_path)
+        if digest is None:
+            return None
+        
+        with self._lock:
+            profile = self._profiles.get(digest)
+            if profile is not None:
+                self._profiles.move_to_end(digest)
+        if profile is not None:
+            return profile
+        
+        profile = self._load_profile(digest)
+        if profile is None:
+            manager = DatasetManager(os.path.dirname(file_path) or '.')
+            if df is None:
+                df = manager.load_dataset(os.path.basename(file_path))
+                if df is None:
+                    return None
+            
+            profile = self.profile_dataframe(df)
+            profile['content_digest'] = digest
+            stream = manager.get_stream(file_path) if profile['sampled'] else None
+            if stream is not None:
+                # Row and null counts stay exact even when the statistics come from a sample
+                profile['sample_rows'] = profile['rows']
+                profile['rows'] = stream.row_count
+                for column, null_count in stream.null_counts().items():
+                    column_profile = profile['columns'].get(str(column))
+                    if column_profile is not None:
+                        column_profile['null_count'] = int(null_count)
+                        column_profile['null_pct'] = round(int(null_count) / stream.row_count * 100, 2) if stream.row_count else 0.0
+            self._save_profile(digest, profile)
+            logger.info(f"Profiled dataset {os.path.basename(file_path)} ({profile['rows']} rows)")
+        
+        with self._lock:
+            self._profiles[digest] = profile
+            self._profiles.move_to_end(digest)
+            while len(self._profiles) > self.max_memoized:
+                self._profiles.popitem(last=False)
+        return profile
+
+# Global profiler instance
+dataset_profiler = DatasetProfiler()
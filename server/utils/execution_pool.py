@@ -0,0 +1,379 @@
+# Pre-forked worker pool for running generated code outside the request process
+import os
+import time
+import atexit
+import threading
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+from config import config
+from utils.block_dependencies import group_dependent_blocks
+from utils.kernel_manager import uses_kernel
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Imported once by the fork server, so every worker starts with these already loaded
+WORKER_PRELOAD_MODULES = ['utils.code_executor']
+
+def _set_memory_limit(memory_limit_mb: int):
+    if resource is None or not memory_limit_mb:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def _set_cpu_limit(cpu_limit_seconds: int):
+    """Allow this job cpu_limit_seconds more CPU time; the kernel sends SIGXCPU past it"""
+    if resource is None or not cpu_limit_seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + cpu_limit_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _worker_main(conn, data_path: str, memory_limit_mb: int, warm_datasets: List[str]):
+    """Worker loop: receive a job, execute it and send the result back"""
+    from utils.code_executor import CodeExecutor, enable_copy_on_write
+    
+    enable_copy_on_write()
+    _set_memory_limit(memory_limit_mb)
+    executor = CodeExecutor(data_path)
+    for filename in warm_datasets:
+        executor.dataset_manager.load_dataset(filename)
+    
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+        
+        _set_cpu_limit(job.get('cpu_limit'))
+        start_time = time.time()
+        try:
+            if job['op'] == 'warm':
+                executor.dataset_manager.load_dataset(job['uploaded_filename'])
+                result = {'warmed': job['uploaded_filename']}
+            elif job['op'] == 'execute_session':
+                # The session's kernel lives in this worker and persists between jobs
+                result = {'results': executor.execute_session_blocks(
+                    job['blocks'], job.get('uploaded_filename'), job['session_id']
+                )}
+            elif job['op'] == 'execute_group':
+                # Dependent blocks share one namespace and run in their original order
+                namespace = executor.create_block_namespace(job.get('uploaded_filename'))
+                result = {'results': [
+                    executor.execute_code_block(code, job.get('uploaded_filename'), block_index, namespace=namespace)
+                    for block_index, code in job['blocks']
+                ]}
+            else:
+                result = executor.execute_code_block(job['code'], job.get('uploaded_filename'), job.get('block_index', 0))
+        except Exception as e:
+            result = {'output': '', 'error': str(e), 'figures': []}
+        result['execution_time'] = time.time() - start_time
+        conn.send(result)
+
+class _PoolWorker:
+    """A worker process and the parent's end of its pipe"""
+    
+    def __init__(self, ctx, data_path: str, memory_limit_mb: int, warm_datasets: List[str]):
+        parent_conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, data_path, memory_limit_mb, warm_datasets),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.tasks_completed = 0
+        self.last_dataset = warm_datasets[0] if warm_datasets else None
+    
+    def stop(self, kill: bool = False):
+        try:
+            if kill:
+                self.process.kill()
+            else:
+                self.conn.send(None)
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+        except Exception:
+            pass
+        finally:
+            self.conn.close()
+
+class ExecutionPool:
+    """Pool of pre-forked code execution workers.
+    
+    Workers come from a fork server that has already imported pandas, numpy,
+    matplotlib, seaborn and plotly, and they keep their dataset cache between
+    jobs. Each job runs under a wall-clock timeout and CPU/memory rlimits; a
+    worker that times out, crashes or reaches its task quota is replaced.
+    Session jobs are always routed to the worker holding that session's kernel.
+    """
+    
+    def __init__(self, size: int = None, data_path: str = "datasets", timeout: float = None,
+                 memory_limit_mb: int = None, cpu_limit_seconds: int = None, max_tasks_per_worker: int = None):
+        self.size = size or config.EXECUTION_POOL_SIZE or os.cpu_count() or 2
+        self.data_path = data_path
+        self.timeout = timeout or config.EXECUTION_TIMEOUT
+        self.memory_limit_mb = config.EXECUTION_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+        self.cpu_limit_seconds = config.EXECUTION_CPU_LIMIT if cpu_limit_seconds is None else cpu_limit_seconds
+        self.max_tasks_per_worker = max_tasks_per_worker or config.EXECUTION_POOL_MAX_TASKS
+        
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self._ctx = multiprocessing.get_context('forkserver')
+            self._ctx.set_forkserver_preload(WORKER_PRELOAD_MODULES)
+        else:
+            self._ctx = multiprocessing.get_context('spawn')
+        
+        self._condition = threading.Condition()
+        self._idle = []
+        self._session_owners = OrderedDict()
+        self._closed = False
+        warm_datasets = self._get_warm_datasets()
+        for _ in range(self.size):
+            self._idle.append(self._spawn(warm_datasets))
+        logger.info(f"Started execution pool with {self.size} workers")
+    
+    def _get_warm_datasets(self) -> List[str]:
+        """Pick the most recent upload so fresh workers start with it loaded"""
+        if not os.path.exists(self.data_path):
+            return []
+        datasets = [f for f in os.listdir(self.data_path) if f.endswith(('.csv', '.xlsx', '.json'))]
+        datasets.sort(key=lambda f: os.path.getmtime(os.path.join(self.data_path, f)), reverse=True)
+        return datasets[:1]
+    
+    def _spawn(self, warm_datasets: Optional[List[str]] = None) -> _PoolWorker:
+        return _PoolWorker(self._ctx, self.data_path, self.memory_limit_mb, warm_datasets or [])
+    
+    def _get_session_owner(self, session_id: Optional[str]) -> Optional[_PoolWorker]:
+        """Get the worker holding a session's kernel (caller holds the condition)"""
+        entry = self._session_owners.get(session_id) if session_id else None
+        if entry is None:
+            return None
+        worker, last_used = entry
+        if time.time() - last_used > config.KERNEL_IDLE_TIMEOUT:
+            # The worker has evicted the idle kernel by now, so any worker will do
+            del self._session_owners[session_id]
+            return None
+        return worker
+    
+    def _remember_session_owner(self, session_id: str, worker: _PoolWorker):
+        """Record a session's worker, dropping idle and least recently used entries (caller holds the condition)"""
+        now = time.time()
+        self._session_owners[session_id] = (worker, now)
+        self._session_owners.move_to_end(session_id)
+        # Entries are ordered by last use, so idle ones sit at the front
+        while self._session_owners:
+            oldest_id, (_, last_used) = next(iter(self._session_owners.items()))
+            if now - last_used <= config.KERNEL_IDLE_TIMEOUT:
+                break
+            del self._session_owners[oldest_id]
+        # Workers evict kernels past KERNEL_MAX_SESSIONS, so older owners are stale
+        while len(self._session_owners) > config.KERNEL_MAX_SESSIONS * self.size:
+            self._session_owners.popitem(last=False)
+    
+    def _checkout(self, dataset_key: Optional[str], session_id: Optional[str] = None) -> _PoolWorker:
+        """Take an idle worker, preferring one that already has this dataset loaded.
+        
+        A session whose kernel lives on a worker waits for that worker.
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Execution pool is shut down")
+                owner = self._get_session_owner(session_id)
+                if owner is not None:
+                    if owner in self._idle:
+                        self._idle.remove(owner)
+                        return owner
+                elif self._idle:
+                    for idx, worker in enumerate(self._idle):
+                        if dataset_key and worker.last_dataset == dataset_key:
+                            return self._idle.pop(idx)
+                    return self._idle.pop()
+                self._condition.wait()
+    
+    def _checkin(self, worker: _PoolWorker):
+        with self._condition:
+            if self._closed:
+                worker.stop()
+                return
+            self._idle.append(worker)
+            # Wake every waiter: a session may be waiting for this particular worker
+            self._condition.notify_all()
+    
+    def _replace(self, worker: _PoolWorker, kill: bool) -> _PoolWorker:
+        worker.stop(kill=kill)
+        with self._condition:
+            # Kernels die with the worker
+            for session_id in [sid for sid, (owner, _) in self._session_owners.items() if owner is worker]:
+                del self._session_owners[session_id]
+        return self._spawn([worker.last_dataset] if worker.last_dataset else [])
+    
+    def run(self, job: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Run a job on a worker and return its result dict"""
+        timeout = timeout or self.timeout
+        dataset_key = os.path.basename(job['uploaded_filename']) if job.get('uploaded_filename') else None
+        job.setdefault('cpu_limit', self.cpu_limit_seconds)
+        session_id = job.get('session_id')
+        
+        worker = self._checkout(dataset_key, session_id)
+        try:
+            try:
+                worker.conn.send(job)
+                if not worker.conn.poll(timeout):
+                    logger.error(f"Code execution exceeded {timeout}s, killing worker {worker.process.pid}")
+                    worker = self._replace(worker, kill=True)
+                    return {'output': '', 'error': f"Execution timed out after {timeout} seconds", 'figures': []}
+                result = worker.conn.recv()
+            except (EOFError, BrokenPipeError, ConnectionResetError, OSError):
+                worker.process.join(timeout=1)
+                exitcode = worker.process.exitcode
+                logger.error(f"Execution worker {worker.process.pid} died (exit code {exitcode})")
+                worker = self._replace(worker, kill=True)
+                return {
+                    'output': '',
+                    'error': f"Execution worker crashed (exit code {exitcode}); the code may have exceeded its CPU or memory limit",
+                    'figures': []
+                }
+            
+            worker.tasks_completed += 1
+            worker.last_dataset = dataset_key or worker.last_dataset
+            if session_id:
+                with self._condition:
+                    self._remember_session_owner(session_id, worker)
+            if worker.tasks_completed >= self.max_tasks_per_worker:
+                worker = self._replace(worker, kill=False)
+            return result
+        finally:
+            self._checkin(worker)
+    
+    def shutdown(self):
+        """Stop all workers"""
+        with self._condition:
+            self._closed = True
+            workers, self._idle = self._idle, []
+            self._condition.notify_all()
+        for worker in workers:
+            worker.stop()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_execution_pool() -> ExecutionPool:
+    """Get this process's execution pool, creating it on first use"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ExecutionPool()
+            _pool_pid = os.getpid()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+class PooledCodeExecutor:
+    """CodeExecutor-compatible front end that runs code blocks on the execution pool"""
+    
+    def __init__(self, data_path: str = "datasets"):
+        self.data_path = data_path
+    
+    def execute_code_block(self, code: str, uploaded_filename: str = None, block_index: int = 0) -> dict:
+        """Execute a single code block in a pool worker"""
+        result = get_execution_pool().run({
+            'op': 'execute',
+            'code': code,
+            'uploaded_filename': uploaded_filename,
+            'block_index': block_index
+        })
+        result.setdefault('block_index', block_index)
+        result.setdefault('has_plots', len(result.get('figures', [])) > 0)
+        return result
+    
+    def _execute_group(self, code_blocks: List[str], group: List[int], uploaded_filename: str = None) -> List[dict]:
+        pool = get_execution_pool()
+        result = pool.run({
+            'op': 'execute_group',
+            'blocks': [(block_index, code_blocks[block_index]) for block_index in group],
+            'uploaded_filename': uploaded_filename,
+            'cpu_limit': pool.cpu_limit_seconds * len(group)
+        }, timeout=pool.timeout * len(group))
+        
+        if 'results' not in result:
+            # The worker timed out or crashed, so every block in the group shares the error
+            return [{
+                'block_index': block_index, 'output': '', 'error': result.get('error'),
+                'figures': [], 'has_plots': False
+            } for block_index in group]
+        return result['results']
+    
+    def execute_session_blocks(self, code_blocks: List[str], uploaded_filename: str = None, session_id: str = "default") -> List[dict]:
+        """Execute code blocks in order inside the session's kernel on its worker"""
+        pool = get_execution_pool()
+        result = pool.run({
+            'op': 'execute_session',
+            'blocks': code_blocks,
+            'uploaded_filename': uploaded_filename,
+            'session_id': session_id,
+            'cpu_limit': pool.cpu_limit_seconds * len(code_blocks)
+        }, timeout=pool.timeout * len(code_blocks))
+        
+        if 'results' not in result:
+            return [{
+                'block_index': block_index, 'output': '', 'error': result.get('error'),
+                'figures': [], 'has_plots': False
+            } for block_index in range(len(code_blocks))]
+        return result['results']
+    
+    def execute_blocks(self, code_blocks: List[str], uploaded_filename: str = None, session_id: str = None) -> List[dict]:
+        """Execute code blocks, running independent groups concurrently on separate workers.
+        
+        With a client-supplied session_id (and kernels enabled) the blocks run in
+        order in the session's persistent kernel instead.
+        """
+        if uses_kernel(session_id):
+            return self.execute_session_blocks(code_blocks, uploaded_filename, session_id)
+        
+        groups = group_dependent_blocks(code_blocks)
+        results = [None] * len(code_blocks)
+        if not groups:
+            return results
+        
+        max_workers = min(len(groups), get_execution_pool().size) if config.ENABLE_PARALLEL_BLOCKS else 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._execute_group, code_blocks, group, uploaded_filename) for group in groups]
+            for future in futures:
+                for block_result in future.result():
+                    results[block_result['block_index']] = block_result
+        return results
+    
+    def execute(self, code: str, uploaded_filename: str = None) -> dict:
+        """Legacy execute method for backward compatibility"""
+        result = self.execute_code_block(code, uploaded_filename)
+        return {
+            'output': result.get('output', ''),
+            'error': result.get('error'),
+            'figures': result.get('figures', []),
+            'execution_time': result.get('execution_time')
+        }
+
+def create_code_executor(data_path: str = "datasets"):
+    """Create the code executor for the configured execution engine"""
+    if config.EXECUTION_ENGINE == 'pool':
+        return PooledCodeExecutor(data_path)
+    from utils.code_executor import CodeExecutor
+    return CodeExecutor(data_path)
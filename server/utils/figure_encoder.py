@@ -0,0 +1,157 @@
+# Figure rendering and encoding pipeline for executed code
+import io
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, Optional
+import numpy as np
+from PIL import Image
+from config import config
+
+logger = logging.getLogger(__name__)
+
+FIGURE_MIME_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'svg': 'image/svg+xml'
+}
+
+# Matplotlib's default padding around a tight bounding box
+TIGHT_BBOX_PAD_INCHES = 0.1
+
+class FigureEncoder:
+    """Renders matplotlib figures and encodes them into image bytes.
+    
+    Rendering touches the figure, so it happens on the calling thread; the
+    raster encoding (PNG/WebP/JPEG compression) runs in a shared thread pool
+    so several figures from one block are compressed concurrently. The fast
+    path draws the canvas once and crops it to the tight bounding box instead
+    of letting savefig(bbox_inches='tight') draw the figure twice.
+    """
+    
+    def __init__(self, image_format: str = None, dpi: int = None, max_pixels: int = None,
+                 fast_render: bool = None, quality: int = None, png_optimize: bool = None,
+                 png_compress_level: int = None, max_workers: int = None):
+        self.image_format = (image_format or config.FIGURE_FORMAT).lower()
+        if self.image_format == 'jpg':
+            self.image_format = 'jpeg'
+        if self.image_format not in FIGURE_MIME_TYPES:
+            logger.warning(f"Unsupported figure format '{self.image_format}', falling back to png")
+            self.image_format = 'png'
+        self.dpi = dpi or config.FIGURE_DPI
+        self.max_pixels = config.FIGURE_MAX_PIXELS if max_pixels is None else max_pixels
+        self.fast_render = config.FIGURE_FAST_RENDER if fast_render is None else fast_render
+        self.quality = quality or config.FIGURE_QUALITY
+        self.png_optimize = config.FIGURE_PNG_OPTIMIZE if png_optimize is None else png_optimize
+        self.png_compress_level = config.FIGURE_PNG_COMPRESS_LEVEL if png_compress_level is None else png_compress_level
+        self.max_workers = max_workers or config.FIGURE_ENCODE_WORKERS
+        self._executor = None
+        self._executor_pid = None
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Get this process's encoding pool; a pool inherited through fork has no threads behind it"""
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='figure-encoder')
+            self._executor_pid = os.getpid()
+        return self._executor
+    
+    @property
+    def mime_type(self) -> str:
+        return FIGURE_MIME_TYPES[self.image_format]
+    
+    def _get_dpi(self, fig) -> float:
+        """Cap the DPI so the longest side of the image stays within max_pixels"""
+        dpi = self.dpi
+        if self.max_pixels:
+            width, height = fig.get_size_inches()
+            longest_side = max(width, height, 1e-6)
+            dpi = min(dpi, self.max_pixels / longest_side)
+        return dpi
+    
+    def _render_exact(self, fig, dpi: float) -> bytes:
+        """Render through savefig with a tight bbox, which draws the figure twice"""
+        buffer = io.BytesIO()
+        pil_kwargs = None
+        if self.image_format == 'png':
+            pil_kwargs = {'optimize': self.png_optimize, 'compress_level': self.png_compress_level}
+        elif self.image_format in ('webp', 'jpeg'):
+            pil_kwargs = {'quality': self.quality}
+        extra_kwargs = {'pil_kwargs': pil_kwargs} if pil_kwargs else {}
+        fig.savefig(buffer, format=self.image_format, bbox_inches='tight', dpi=dpi,
+                    facecolor='white', edgecolor='none', **extra_kwargs)
+        return buffer.getvalue()
+    
+    def _render_raster(self, fig, dpi: float) -> np.ndarray:
+        """Draw the figure once and return its RGBA pixels cropped to the content"""
+        fig.set_dpi(dpi)
+        fig.patch.set_facecolor('white')
+        fig.canvas.draw()
+        pixels = np.asarray(fig.canvas.buffer_rgba())
+        
+        # Crop to the tight bounding box of the drawn artists, clipped to the canvas
+        bbox = fig.get_tightbbox(fig.canvas.get_renderer())
+        if bbox is not None:
+            height, width = pixels.shape[:2]
+            pad = TIGHT_BBOX_PAD_INCHES * dpi
+            x0 = max(int(np.floor(bbox.x0 * dpi - pad)), 0)
+            x1 = min(int(np.ceil(bbox.x1 * dpi + pad)), width)
+            y0 = max(int(np.floor(height - bbox.y1 * dpi - pad)), 0)
+            y1 = min(int(np.ceil(height - bbox.y0 * dpi + pad)), height)
+            if x1 > x0 and y1 > y0:
+                pixels = pixels[y0:y1, x0:x1]
+        return pixels.copy()
+    
+    def _encode_raster(self, pixels: np.ndarray) -> bytes:
+        image = Image.fromarray(pixels, 'RGBA')
+        if self.image_format in ('jpeg', 'png'):
+            # Flatten onto white; an alpha channel only adds bytes for these opaque plots
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        
+        buffer = io.BytesIO()
+        if self.image_format == 'png':
+            image.save(buffer, format='PNG', optimize=self.png_optimize, compress_level=self.png_compress_level)
+        elif self.image_format == 'webp':
+            image.save(buffer, format='WEBP', quality=self.quality, method=4)
+        else:
+            image.save(buffer, format='JPEG', quality=self.quality, optimize=True)
+        return buffer.getvalue()
+    
+    def _finish(self, encoded: bytes, width: int, height: int, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        figure = {
+            'type': 'matplotlib',
+            'data': encoded,
+            'mime_type': self.mime_type,
+            'width': width,
+            'height': height
+        }
+        figure.update(metadata or {})
+        return figure
+    
+    def submit(self, fig, metadata: Optional[Dict[str, Any]] = None) -> Future:
+        """Render a figure now and encode it in the background.
+        
+        The figure can be closed as soon as this returns. The future resolves
+        to a figure dict whose 'data' holds the raw encoded bytes, plus any
+        extra metadata given here.
+        """
+        dpi = self._get_dpi(fig)
+        if self.image_format == 'svg' or not self.fast_render:
+            future = Future()
+            encoded = self._render_exact(fig, dpi)
+            if self.image_format == 'svg':
+                width, height = (int(side) for side in fig.get_size_inches() * dpi)
+            else:
+                # Only the image header is read
+                width, height = Image.open(io.BytesIO(encoded)).size
+            future.set_result(self._finish(encoded, width, height, metadata))
+            return future
+        
+        pixels = self._render_raster(fig, dpi)
+        height, width = pixels.shape[:2]
+        return self._get_executor().submit(lambda: self._finish(self._encode_raster(pixels), width, height, metadata))
+
+# Global figure encoder instance
+figure_encoder = FigureEncoder()
@@ -0,0 +1,199 @@
+# Content-addressed store for rendered figure images
+import os
+import re
+import time
+import base64
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from config import config
+
+logger = logging.getLogger(__name__)
+
+FIGURE_EXTENSIONS = {
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/jpeg': 'jpg',
+    'image/svg+xml': 'svg'
+}
+
+FIGURE_DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+class MemoryFigureBackend:
+    """Keeps figures in process memory, bounded by a byte budget (LRU)"""
+    
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+    
+    def put(self, digest: str, data: bytes, mime_type: str):
+        with self._lock:
+            entry = self._entries.pop(digest, None)
+            if entry is not None:
+                self.resident_bytes -= len(entry[0])
+            self._entries[digest] = (data, mime_type, time.time())
+            self.resident_bytes += len(data)
+            while self.resident_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self.resident_bytes -= len(evicted)
+    
+    def get(self, digest: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if time.time() - entry[2] > self.ttl:
+                del self._entries[digest]
+                self.resident_bytes -= len(entry[0])
+                return None
+            self._entries.move_to_end(digest)
+            return entry[0], entry[1]
+    
+    def cleanup(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for digest in [d for d, entry in self._entries.items() if entry[2] < cutoff]:
+                self.resident_bytes -= len(self._entries.pop(digest)[0])
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'backend': 'memory', 'figures': len(self._entries), 'resident_bytes': self.resident_bytes}
+
+class DiskFigureBackend:
+    """Keeps figures as files named by digest, shared by every process on the host"""
+    
+    def __init__(self, ttl: float, directory: str):
+        self.ttl = ttl
+        self.directory = directory
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+    
+    def _get_path(self, digest: str, mime_type: str) -> str:
+        return os.path.join(self.directory, f"{digest}.{FIGURE_EXTENSIONS.get(mime_type, 'bin')}")
+    
+    def put(self, digest: str, data: bytes, mime_type: str):
+        path = self._get_path(digest, mime_type)
+        if os.path.exists(path):
+            # Same content already stored; just restart its TTL
+            os.utime(path)
+            return
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    
+    def get(self, digest: str) -> Optional[Tuple[bytes, str]]:
+        for mime_type in FIGURE_EXTENSIONS:
+            path = self._get_path(digest, mime_type)
+            try:
+                if time.time() - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                    return None
+                with open(path, 'rb') as f:
+                    return f.read(), mime_type
+            except OSError:
+                continue
+        return None
+    
+    def cleanup(self):
+        cutoff = time.time() - self.ttl
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+    
+    def stats(self) -> Dict[str, Any]:
+        files = [f for f in os.listdir(self.directory) if not f.endswith('.tmp')]
+        return {'backend': 'disk', 'figures': len(files)}
+
+class FigureStore:
+    """Stores figure images by the SHA-256 of their bytes.
+    
+    Responses carry a reference ({'ref', 'url'}) instead of the image itself;
+    clients fetch it from /figures/<digest>, which never changes for a given
+    digest and can therefore be cached indefinitely.
+    """
+    
+    def __init__(self, backend: str = None, ttl: float = None):
+        self.ttl = ttl or config.FIGURE_STORE_TTL
+        backend = (backend or config.FIGURE_STORE_BACKEND).lower()
+        if backend == 'memory':
+            self.backend = MemoryFigureBackend(self.ttl, config.FIGURE_STORE_MAX_BYTES)
+        else:
+            self.backend = DiskFigureBackend(self.ttl, os.path.join(os.path.dirname(__file__), 'cache', 'figures'))
+        self._cleanup_interval = max(self.ttl / 10, 60)
+        self._last_cleanup = time.time()
+    
+    def _maybe_cleanup(self):
+        if time.time() - self._last_cleanup < self._cleanup_interval:
+            return
+        self._last_cleanup = time.time()
+        try:
+            self.backend.cleanup()
+        except Exception as e:
+            logger.warning(f"Figure store cleanup failed: {e}")
+    
+    def put(self, data: bytes, mime_type: str) -> str:
+        """Store figure bytes and return their digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        self.backend.put(digest, data, mime_type)
+        self._maybe_cleanup()
+        return digest
+    
+    def get(self, digest: str) -> Optional[Tuple[bytes, str]]:
+        """Get (bytes, mime_type) for a digest, or None if unknown or expired"""
+        if not digest or not FIGURE_DIGEST_PATTERN.match(digest):
+            return None
+        return self.backend.get(digest)
+    
+    def get_url(self, digest: str) -> str:
+        return f"/figures/{digest}"
+    
+    def store_figures(self, figures: List[Any]) -> List[Any]:
+        """Replace inline image bytes in executed-code figures with store references"""
+        stored = []
+        for figure in figures or []:
+            if isinstance(figure, dict) and isinstance(figure.get('data'), (bytes, bytearray)):
+                try:
+                    digest = self.put(bytes(figure['data']), figure.get('mime_type', 'image/png'))
+                    figure = {key: value for key, value in figure.items() if key != 'data'}
+                    figure.update({'ref': digest, 'url': self.get_url(digest)})
+                except OSError as e:
+                    # The figure stays inline and is base64-encoded at serialization
+                    logger.error(f"Failed to store figure: {e}")
+            stored.append(figure)
+        return stored
+    
+    def resolve_bytes(self, figure: Any) -> Optional[bytes]:
+        """Get the image bytes behind a figure reference, inline figure or bare digest"""
+        if isinstance(figure, str):
+            entry = self.get(figure)
+            return entry[0] if entry else None
+        if not isinstance(figure, dict):
+            return None
+        if figure.get('ref'):
+            entry = self.get(figure['ref'])
+            return entry[0] if entry else None
+        data = figure.get('data')
+        if isinstance(data, (bytes, bytearray)):
+            return bytes(data)
+        if isinstance(data, str):
+            try:
+                return base64.b64decode(data)
+            except ValueError:
+                return None
+        return None
+    
+    def stats(self) -> Dict[str, Any]:
+        return self.backend.stats()
+
+# Global figure store instance
+figure_store = FigureStore()
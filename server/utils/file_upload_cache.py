@@ -1,58 +1,102 @@
 # File upload cache system for optimizing Gemini file uploads
 import os
 import time
-import hashlib
-import json
+import sqlite3
+import threading
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable
 import google.generativeai as genai
+from google.generativeai import protos
 from config import config
+from utils.content_digest import content_digests
+from utils.keyed_locks import KeyedLocks
 
 logger = logging.getLogger(__name__)
 
+def file_data_part(uri: str, mime_type: Optional[str]) -> protos.FileData:
+    """Reference an uploaded file by URI, in a form genai accepts as request content"""
+    return protos.FileData(file_uri=uri, mime_type=mime_type or '')
+
+def as_file_data(gemini_file: Any) -> protos.FileData:
+    """Reference a fresh upload (a genai File) or a cached one the same way"""
+    if isinstance(gemini_file, protos.FileData):
+        return gemini_file
+    return file_data_part(gemini_file.uri, gemini_file.mime_type)
+
 class FileUploadCache:
-    """Cache system for Gemini file uploads to avoid re-uploading the same files"""
+    """Cache system for Gemini file uploads to avoid re-uploading the same files.
+    
+    Entries are keyed by the file's content digest, so identical files uploaded
+    under different names or by different sessions share one Gemini upload.
+    They live in a SQLite database in WAL mode: each lookup or write touches a
+    single row, and concurrent worker processes can read while one writes.
+    """
     
     def __init__(self):
+        self._upload_locks = KeyedLocks()
+        self._locks_lock = threading.Lock()
+        self._local = threading.local()
+        self._cleanup_thread = None
+        self._cleanup_pid = None
         self.cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
-        self.cache_file = os.path.join(self.cache_dir, 'file_cache.json')
+        self.db_path = os.path.join(self.cache_dir, 'file_cache.db')
         self._ensure_cache_dir()
-        self._load_cache()
+        self._init_db()
     
     def _ensure_cache_dir(self):
         """Ensure cache directory exists"""
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
     
-    def _load_cache(self):
-        """Load cache from disk"""
-        try:
-            if os.path.exists(self.cache_file):
-                with open(self.cache_file, 'r') as f:
-                    self.cache = json.load(f)
-            else:
-                self.cache = {}
-        except Exception as e:
-            logger.warning(f"Failed to load cache: {e}")
-            self.cache = {}
+    def _get_connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
     
-    def _save_cache(self):
-        """Save cache to disk"""
-        try:
-            with open(self.cache_file, 'w') as f:
-                json.dump(self.cache, f, indent=2)
-        except Exception as e:
-            logger.error(f"Failed to save cache: {e}")
+    def _init_db(self):
+        """Create the cache table if needed"""
+        conn = self._get_connection()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS file_uploads (
+                cache_key TEXT PRIMARY KEY,
+                uri TEXT NOT NULL,
+                name TEXT NOT NULL,
+                mime_type TEXT,
+                timestamp REAL NOT NULL,
+                file_path TEXT
+            )"""
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_file_uploads_timestamp ON file_uploads (timestamp)')
     
-    def _get_file_hash(self, file_path: str) -> str:
-        """Generate hash for file based on path, size, and modification time"""
-        try:
-            stat = os.stat(file_path)
-            content = f"{file_path}:{stat.st_size}:{stat.st_mtime}"
-            return hashlib.md5(content.encode()).hexdigest()
-        except Exception as e:
-            logger.error(f"Failed to generate file hash: {e}")
-            return str(time.time())
+    def _ensure_cleanup_thread(self):
+        """Start the background TTL cleanup thread for this process"""
+        if self._cleanup_pid == os.getpid() and self._cleanup_thread and self._cleanup_thread.is_alive():
+            return
+        with self._locks_lock:
+            if self._cleanup_pid == os.getpid() and self._cleanup_thread and self._cleanup_thread.is_alive():
+                return
+            self._cleanup_thread = threading.Thread(target=self._cleanup_loop, name='file-cache-cleanup', daemon=True)
+            self._cleanup_pid = os.getpid()
+            self._cleanup_thread.start()
+    
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(config.FILE_UPLOAD_CACHE_CLEANUP_INTERVAL)
+            self.cleanup_expired()
+    
+    def _get_file_hash(self, file_path: str, mime_type: Optional[str] = None) -> Optional[str]:
+        """Generate the cache key for a file from its content digest and MIME type"""
+        digest = content_digests.get_digest(file_path)
+        if digest is None:
+            return None
+        return f"{digest}:{mime_type}" if mime_type else digest
     
     def _is_cache_valid(self, cache_entry: Dict[str, Any]) -> bool:
         """Check if cache entry is still valid"""
@@ -67,32 +111,27 @@ class FileUploadCache:
         except Exception:
             return False
     
-    def get_cached_file(self, file_path: str) -> Optional[Any]:
-        """Get cached Gemini file object if available"""
+    def get_cached_file(self, file_path: str, mime_type: Optional[str] = None) -> Optional[Any]:
+        """Get a file_data reference to the cached upload if available"""
         try:
-            file_hash = self._get_file_hash(file_path)
+            self._ensure_cleanup_thread()
+            file_hash = self._get_file_hash(file_path, mime_type)
+            if file_hash is None:
+                return None
             
-            if file_hash in self.cache:
-                cache_entry = self.cache[file_hash]
+            row = self._get_connection().execute(
+                'SELECT uri, name, mime_type, timestamp FROM file_uploads WHERE cache_key = ?', (file_hash,)
+            ).fetchone()
+            
+            if row is not None:
+                cache_entry = dict(row)
                 
                 if self._is_cache_valid(cache_entry):
                     logger.info(f"Using cached file upload for: {os.path.basename(file_path)}")
-                    # Return a mock file object with the cached URI
-                    class CachedFile:
-                        def __init__(self, uri, name, mime_type):
-                            self.uri = uri
-                            self.name = name
-                            self.mime_type = mime_type
-                    
-                    return CachedFile(
-                        cache_entry['uri'],
-                        cache_entry['name'], 
-                        cache_entry['mime_type']
-                    )
+                    return file_data_part(cache_entry['uri'], cache_entry['mime_type'])
                 else:
                     # Remove expired cache entry
-                    del self.cache[file_hash]
-                    self._save_cache()
+                    self._get_connection().execute('DELETE FROM file_uploads WHERE cache_key = ?', (file_hash,))
             
             return None
         except Exception as e:
@@ -102,48 +141,54 @@ class FileUploadCache:
     def cache_file(self, file_path: str, gemini_file: Any, mime_type: str):
         """Cache a Gemini file upload"""
         try:
-            file_hash = self._get_file_hash(file_path)
-            
-            cache_entry = {
-                'uri': gemini_file.uri,
-                'name': gemini_file.name,
-                'mime_type': mime_type,
-                'timestamp': time.time(),
-                'file_path': file_path
-            }
+            file_hash = self._get_file_hash(file_path, mime_type)
+            if file_hash is None:
+                return
             
-            self.cache[file_hash] = cache_entry
-            self._save_cache()
+            self._get_connection().execute(
+                'INSERT OR REPLACE INTO file_uploads VALUES (?, ?, ?, ?, ?, ?)',
+                (file_hash, gemini_file.uri, gemini_file.name, mime_type, time.time(), file_path)
+            )
             
             logger.info(f"Cached file upload: {os.path.basename(file_path)}")
             
         except Exception as e:
             logger.error(f"Error caching file {file_path}: {e}")
     
+    def get_or_upload(self, file_path: str, mime_type: str, upload_func: Callable[[], Any]) -> Any:
+        """Get the cached upload for a file's content, or upload it once.
+        
+        Concurrent requests for the same content wait on a per-digest lock
+        instead of each uploading their own copy.
+        """
+        file_hash = self._get_file_hash(file_path, mime_type)
+        if file_hash is None:
+            return upload_func()
+        
+        with self._upload_locks.hold(file_hash):
+            cached_file = self.get_cached_file(file_path, mime_type)
+            if cached_file:
+                return cached_file
+            
+            gemini_file = upload_func()
+            self.cache_file(file_path, gemini_file, mime_type)
+            return gemini_file
+    
     def cleanup_expired(self):
         """Remove expired cache entries"""
         try:
-            current_time = time.time()
-            expired_keys = []
-            
-            for key, entry in self.cache.items():
-                if current_time - entry['timestamp'] > config.FILE_UPLOAD_CACHE_TTL:
-                    expired_keys.append(key)
-            
-            for key in expired_keys:
-                del self.cache[key]
+            cutoff = time.time() - config.FILE_UPLOAD_CACHE_TTL
+            cursor = self._get_connection().execute('DELETE FROM file_uploads WHERE timestamp < ?', (cutoff,))
             
-            if expired_keys:
-                self._save_cache()
-                logger.info(f"Cleaned up {len(expired_keys)} expired cache entries")
+            if cursor.rowcount:
+                logger.info(f"Cleaned up {cursor.rowcount} expired cache entries")
                 
         except Exception as e:
             logger.error(f"Error during cache cleanup: {e}")
     
     def clear_cache(self):
         """Clear all cache entries"""
-        self.cache = {}
-        self._save_cache()
+        self._get_connection().execute('DELETE FROM file_uploads')
         logger.info("File upload cache cleared")
 
 # Global cache instance
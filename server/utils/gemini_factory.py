@@ -1,63 +1,311 @@
 import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.generativeai.types import generation_types
+from google.ai import generativelanguage as glm
+from google.api_core import gapic_v1, grpc_helpers
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+    GenerativeServiceGrpcTransport, GenerativeServiceGrpcAsyncIOTransport
+)
 import os
 import sys
+import json
+import hashlib
+import asyncio
+import functools
+import threading
+import logging
+import grpc
 sys.path.append('..')
+from utils.resilience import gemini_resilience
+from utils.hedging import gemini_hedger
+from utils.prompts import GeminiPrompts
 from config import config
 
-class GeminiModelFactory:
-    @staticmethod
-    def create_model(model_name: str = None):
-        """Create a Gemini model with configuration"""
-        if model_name is None:
-            model_name = config.GEMINI_MODEL_NAME
-            
-        genai.configure(api_key=config.GEMINI_API_KEY)
-        return genai.GenerativeModel(
+logger = logging.getLogger(__name__)
+
+class GeminiClientPool:
+    """Process-wide pool of configured Gemini models and long-lived gRPC channels.
+    
+    genai is configured once per process (configure() drops every cached client,
+    and with it the open connection), models are cached per configuration, and
+    the generative clients run on channels with keep-alive so the connection
+    survives idle periods instead of paying TCP and TLS setup on the next call.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._configured_pid = None
+    
+    def configure(self):
+        """Configure genai for this process; a forked worker configures (and connects) afresh"""
+        if self._configured_pid == os.getpid():
+            return
+        with self._lock:
+            if self._configured_pid == os.getpid():
+                return
+            genai.configure(api_key=config.GEMINI_API_KEY)
+            self._models = {}
+            self._configured_pid = os.getpid()
+    
+    def reset(self):
+        """Drop cached models and clients, e.g. after a fork or a client failure"""
+        with self._lock:
+            self._configured_pid = None
+            self._models = {}
+        self.configure()
+    
+    def _channel_options(self):
+        keepalive_ms = int(config.GEMINI_KEEPALIVE_SECONDS * 1000)
+        return [
+            ('grpc.keepalive_time_ms', keepalive_ms),
+            ('grpc.keepalive_timeout_ms', 20000),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+        ]
+    
+    def _build_client(self, client_cls, transport_cls):
+        """Build a generative client whose channel carries the keep-alive options"""
+        def create_channel(*args, options=(), **kwargs):
+            return transport_cls.create_channel(*args, options=[*options, *self._channel_options()], **kwargs)
+        
+        return client_cls(
+            transport=functools.partial(transport_cls, channel=create_channel),
+            client_options={'api_key': config.GEMINI_API_KEY}
+        )
+    
+    def _install_client(self, name: str, client_cls, transport_cls):
+        # Models get their clients from genai's per-process client manager
+        manager = getattr(genai_client, '_client_manager', None)
+        if manager is None or manager.clients.get(name) is not None:
+            return
+        try:
+            manager.clients[name] = self._build_client(client_cls, transport_cls)
+        except Exception as e:
+            logger.warning(f"Could not create keep-alive Gemini client '{name}', using the default: {e}")
+    
+    def _ensure_clients(self):
+        self._install_client('generative', glm.GenerativeServiceClient, GenerativeServiceGrpcTransport)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        # grpc.aio channels belong to the event loop they are created on
+        self._install_client('generative_async', glm.GenerativeServiceAsyncClient, GenerativeServiceGrpcAsyncIOTransport)
+    
+    def get_model(self, model_name: str = None, generation_config: dict = None, safety_settings: list = None,
+                  system_instruction: str = None):
+        """Get the cached model for a configuration, creating it on first use"""
+        model_name = model_name or config.GEMINI_MODEL_NAME
+        generation_config = config.GENERATION_CONFIG if generation_config is None else generation_config
+        safety_settings = config.SAFETY_SETTINGS if safety_settings is None else safety_settings
+        
+        self.configure()
+        self._ensure_clients()
+        key = (
             model_name,
-            generation_config=config.GENERATION_CONFIG,
-            safety_settings=config.SAFETY_SETTINGS
+            json.dumps(generation_config, sort_keys=True, default=str),
+            json.dumps(safety_settings, sort_keys=True, default=str),
+            hashlib.sha256(system_instruction.encode()).hexdigest() if system_instruction else None
         )
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = genai.GenerativeModel(
+                        model_name,
+                        generation_config=generation_config,
+                        safety_settings=safety_settings,
+                        system_instruction=system_instruction
+                    )
+                    self._models[key] = model
+        return model
+    
+    def warm(self, timeout: float = None):
+        """Create the default model and open its connection, without sending a request"""
+        timeout = timeout or config.GEMINI_CONNECT_TIMEOUT
+        try:
+            self.get_model()
+            channel = genai_client.get_default_generative_client().transport.grpc_channel
+            grpc.channel_ready_future(channel).result(timeout=timeout)
+            logger.info("Gemini connection pre-warmed")
+        except Exception as e:
+            logger.warning(f"Could not pre-warm Gemini connection: {e!r}")
+    
+    def warm_in_background(self):
+        """Pre-warm without delaying startup"""
+        threading.Thread(target=self.warm, name='gemini-warmup', daemon=True).start()
+    
+    async def warm_async(self, timeout: float = None):
+        """Create the default async client on the running loop and open its connection"""
+        timeout = timeout or config.GEMINI_CONNECT_TIMEOUT
+        try:
+            self.get_model()
+            channel = genai_client.get_default_generative_async_client().transport.grpc_channel
+            await asyncio.wait_for(channel.channel_ready(), timeout)
+            logger.info("Gemini async connection pre-warmed")
+        except Exception as e:
+            logger.warning(f"Could not pre-warm Gemini async connection: {e!r}")
+
+# Global Gemini client pool instance
+gemini_client_pool = GeminiClientPool()
+
+class ContentStream:
+    """A streaming generation whose request is already sent; iterating it yields genai response chunks"""
+    
+    def __init__(self, call):
+        self.call = call
+    
+    def cancel(self):
+        self.call.cancel()
+    
+    def __iter__(self):
+        with generation_types.rewrite_stream_error():
+            for chunk in self.call:
+                yield generation_types.GenerateContentResponse.from_response(chunk)
+
+class GeminiModelFactory:
+    @staticmethod
+    def create_model(model_name: str = None, system_instruction: str = None):
+        """Get a Gemini model with configuration, reusing the pooled model and connection.
+        
+        The agent's system prompt is set once as the model's system instruction
+        instead of being repeated in every prompt.
+        """
+        return gemini_client_pool.get_model(model_name, system_instruction=system_instruction or GeminiPrompts.get_system_prompt())
+    
+    @staticmethod
+    def _recreate_model(model):
+        """Rebuild a model on fresh clients, keeping the context it references"""
+        from utils.context_cache import LocalCachedModel
+        if isinstance(model, LocalCachedModel):
+            # Rebuild the wrapped model but keep sending the registered prefix
+            return LocalCachedModel(GeminiModelFactory._recreate_model(model.model), model.contents)
+        cached_content = getattr(model, 'cached_content', None)
+        if cached_content:
+            # Keep referencing the registered context
+            return genai.GenerativeModel.from_cached_content(
+                cached_content,
+                generation_config=config.GENERATION_CONFIG,
+                safety_settings=config.SAFETY_SETTINGS
+            )
+        return GeminiModelFactory.create_model()
+    
+    @staticmethod
+    def _recreate_on_descriptor_error(holder: dict):
+        """on_retry hook: stale protobuf descriptors need a fresh client and model"""
+        def on_retry(error: Exception):
+            if isinstance(error, AttributeError) and 'DESCRIPTOR' in str(error):
+                gemini_client_pool.reset()
+                holder['model'] = GeminiModelFactory._recreate_model(holder['model'])
+        return on_retry
     
     @staticmethod
     def generate_content_with_retry(model, content, max_retries: int = None):
-        """Generate content with retry logic and generation config"""
-        if max_retries is None:
-            max_retries = config.MAX_RETRY_ATTEMPTS
-            
-        for attempt in range(max_retries + 1):
-            try:
-                return model.generate_content(content)
-            except AttributeError as e:
-                if 'DESCRIPTOR' in str(e) and attempt < max_retries:
-                    genai.configure(api_key=config.GEMINI_API_KEY)
-                    model = GeminiModelFactory.create_model()
-                    continue
-                else:
-                    raise
-            except Exception as e:
-                if attempt < max_retries:
-                    continue
-                raise
-        raise RuntimeError("Failed to generate content after all retries")
+        """Generate content, retrying transient failures with backoff"""
+        holder = {'model': model}
+        return gemini_resilience.call(
+            lambda: holder['model'].generate_content(content),
+            on_retry=GeminiModelFactory._recreate_on_descriptor_error(holder),
+            max_retries=max_retries
+        )
     
     @staticmethod
     def generate_content_stream_with_retry(model, content, max_retries: int = None):
-        """Generate streaming content with retry logic"""
-        if max_retries is None:
-            max_retries = config.MAX_RETRY_ATTEMPTS
-            
-        for attempt in range(max_retries + 1):
-            try:
-                return model.generate_content(content, stream=True)
-            except AttributeError as e:
-                if 'DESCRIPTOR' in str(e) and attempt < max_retries:
-                    genai.configure(api_key=config.GEMINI_API_KEY)
-                    model = GeminiModelFactory.create_model()
-                    continue
-                else:
-                    raise
-            except Exception as e:
-                if attempt < max_retries:
-                    continue
-                raise
-        raise RuntimeError("Failed to generate streaming content after all retries")
+        """Stream content chunks, restarting the stream if it fails before the first chunk"""
+        holder = {'model': model}
+        return gemini_resilience.stream(
+            lambda: holder['model'].generate_content(content, stream=True),
+            on_retry=GeminiModelFactory._recreate_on_descriptor_error(holder),
+            max_retries=max_retries
+        )
+    
+    @staticmethod
+    def start_content_stream(model, content):
+        """Send a streaming generation request without waiting for its first chunk, for hedged calls.
+        
+        genai's generate_content(stream=True), and the generated client under
+        it, read the first chunk before returning, so until then there is no
+        call to cancel. This builds the same request and sends it on the
+        client's gRPC stub directly, keeping a call that can be cancelled at any
+        point. It relies on genai internals, which is why requirements.txt pins
+        google-generativeai exactly. Models that wrap or stand in for a genai
+        model provide their own start_content_stream.
+        """
+        start = getattr(model, 'start_content_stream', None)
+        if start is not None:
+            return start(content)
+        
+        if model._client is None:
+            model._client = genai_client.get_default_generative_client()
+        transport = model._client.transport
+        if not isinstance(transport, GenerativeServiceGrpcTransport):
+            # No stub to call directly (e.g. REST); the stream just cannot be cancelled early
+            return model.generate_content(content, stream=True)
+        
+        request = model._prepare_request(contents=content, tools=None, tool_config=None)
+        if request.contents and not request.contents[-1].role:
+            request.contents[-1].role = 'user'
+        call = transport.stream_generate_content(
+            request, metadata=[gapic_v1.routing_header.to_grpc_metadata((('model', request.model),))]
+        )
+        # Maps gRPC errors to api_core exceptions (which the resilience layer classifies) as chunks are read
+        return ContentStream(grpc_helpers._StreamingResponseIterator(call, prefetch_first_result=False))
+    
+    @staticmethod
+    def generate_text_with_retry(model, content, max_retries: int = None, hedge: bool = False) -> str:
+        """Stream a response into one string; nothing reaches the client yet, so a failure at any point retries it whole.
+        
+        With hedge, a duplicate call is raced against one whose first chunk is late.
+        """
+        holder = {'model': model}
+        
+        def generate():
+            if hedge:
+                stream = gemini_hedger.stream(lambda: GeminiModelFactory.start_content_stream(holder['model'], content))
+            else:
+                stream = holder['model'].generate_content(content, stream=True)
+            return ''.join(chunk.text for chunk in stream if chunk.text)
+        
+        return gemini_resilience.call(
+            generate,
+            on_retry=GeminiModelFactory._recreate_on_descriptor_error(holder),
+            max_retries=max_retries
+        )
+    
+    @staticmethod
+    async def generate_content_async_with_retry(model, content, max_retries: int = None):
+        """Generate content on the event loop, retrying transient failures with backoff"""
+        holder = {'model': model}
+        return await gemini_resilience.call_async(
+            lambda: holder['model'].generate_content_async(content),
+            on_retry=GeminiModelFactory._recreate_on_descriptor_error(holder),
+            max_retries=max_retries
+        )
+    
+    @staticmethod
+    async def generate_content_stream_async_with_retry(model, content, max_retries: int = None):
+        """Start an async streaming generation; iterate the result with `async for`"""
+        holder = {'model': model}
+        return gemini_resilience.stream_async(
+            lambda: holder['model'].generate_content_async(content, stream=True),
+            on_retry=GeminiModelFactory._recreate_on_descriptor_error(holder),
+            max_retries=max_retries
+        )
+    
+    @staticmethod
+    async def generate_text_async_with_retry(model, content, max_retries: int = None, hedge: bool = False) -> str:
+        """Async variant of generate_text_with_retry"""
+        holder = {'model': model}
+        
+        async def generate():
+            start = lambda: holder['model'].generate_content_async(content, stream=True)
+            stream = gemini_hedger.stream_async(start) if hedge else await start()
+            return ''.join([chunk.text async for chunk in stream if chunk.text])
+        
+        return await gemini_resilience.call_async(
+            generate,
+            on_retry=GeminiModelFactory._recreate_on_descriptor_error(holder),
+            max_retries=max_retries
+        )
@@ -0,0 +1,215 @@
+# Hedged requests: race a duplicate call against a slow one to cut tail latency
+import os
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Any, Dict, Optional
+from .resilience import RetryBudget
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+class _Attempt:
+    """One of the racing calls; holds its stream so the loser can be cancelled while still waiting"""
+    
+    def __init__(self, hedge: bool):
+        self.hedge = hedge
+        self.stream = None
+        self.iterator = None
+        self.first = _END
+        self.cancelled = False
+    
+    def cancel(self):
+        """Cancel the underlying RPC (best effort)"""
+        self.cancelled = True
+        # Streams from GeminiModelFactory.start_content_stream are cancellable from any thread, even before their first chunk
+        cancel = getattr(self.stream, 'cancel', None)
+        if callable(cancel):
+            try:
+                cancel()
+            except Exception as e:
+                logger.debug(f"Could not cancel hedged call: {e}")
+
+class LatencyTracker:
+    """Rolling window of time-to-first-chunk samples"""
+    
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def percentile(self, percent: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(percent / 100 * len(samples)))]
+    
+    def __len__(self):
+        return len(self._samples)
+
+class Hedger:
+    """Starts a duplicate streaming call when the first chunk is late, keeps whichever streams first and cancels the other.
+    
+    The hedge delay is a percentile of recent time-to-first-chunk (a fixed
+    delay until enough samples are in), and a budget caps hedges at a fraction
+    of requests so a slow upstream is not hit with double the load.
+    """
+    
+    def __init__(self, percentile: float = None, min_delay: float = None, initial_delay: float = None,
+                 min_samples: int = None, max_fraction: float = None, max_workers: int = None):
+        self.percentile = percentile or config.HEDGE_PERCENTILE
+        self.min_delay = config.HEDGE_MIN_DELAY if min_delay is None else min_delay
+        self.initial_delay = initial_delay or config.HEDGE_INITIAL_DELAY
+        self.min_samples = config.HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+        self.max_workers = max_workers or config.HEDGE_WORKERS
+        self.latency = LatencyTracker()
+        self.budget = RetryBudget(ratio=config.HEDGE_MAX_FRACTION if max_fraction is None else max_fraction, min_per_second=0)
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._executor = None
+        self._executor_pid = None
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # A pool inherited from a pre-fork master has no threads behind it
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedge')
+            self._executor_pid = os.getpid()
+        return self._executor
+    
+    def delay(self) -> float:
+        """How long to wait for the first chunk before hedging"""
+        if len(self.latency) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, self.latency.percentile(self.percentile))
+    
+    def _record_win(self, winner: _Attempt, start_time: float):
+        self.latency.record(time.monotonic() - start_time)
+        if winner.hedge:
+            self.hedge_wins += 1
+    
+    @staticmethod
+    def _open(func: Callable[[], Any], attempt: _Attempt) -> _Attempt:
+        attempt.stream = func()
+        if attempt.cancelled:
+            # Lost the race before the call was even made
+            attempt.cancel()
+        attempt.iterator = iter(attempt.stream)
+        attempt.first = next(attempt.iterator, _END)
+        return attempt
+    
+    @staticmethod
+    async def _open_async(func: Callable[[], Any], attempt: _Attempt) -> _Attempt:
+        attempt.stream = await func()
+        if attempt.cancelled:
+            attempt.cancel()
+        attempt.iterator = attempt.stream.__aiter__()
+        try:
+            attempt.first = await attempt.iterator.__anext__()
+        except StopAsyncIteration:
+            attempt.first = _END
+        return attempt
+    
+    def stream(self, func: Callable[[], Any]):
+        """Iterate the stream returned by func, hedged with a second call to func if its first chunk is late.
+        
+        func should return as soon as the request is sent (not once the first
+        chunk arrives) with a stream that has cancel(), so a losing call can be
+        cancelled while it is still waiting.
+        """
+        self.budget.record_request()
+        start_time = time.monotonic()
+        executor = self._get_executor()
+        primary = _Attempt(hedge=False)
+        attempts = {executor.submit(self._open, func, primary): primary}
+        done, _ = wait(attempts, timeout=self.delay())
+        if not done and self.budget.try_acquire():
+            self.hedged += 1
+            logger.info(f"No first chunk after {time.monotonic() - start_time:.2f}s; sending a hedged request")
+            hedge = _Attempt(hedge=True)
+            attempts[executor.submit(self._open, func, hedge)] = hedge
+        
+        winner, error, pending = None, None, set(attempts)
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    attempt = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if winner is None:
+                    winner = attempt
+                else:
+                    attempt.cancel()
+        
+        for future in pending:
+            # The loser may still be waiting for its first chunk
+            attempts[future].cancel()
+            future.cancel()
+        if winner is None:
+            raise error
+        self._record_win(winner, start_time)
+        if winner.first is not _END:
+            yield winner.first
+        yield from winner.iterator
+    
+    async def stream_async(self, func: Callable[[], Any]):
+        """Async variant of stream(); func returns an awaitable of an async iterable"""
+        self.budget.record_request()
+        start_time = time.monotonic()
+        primary = _Attempt(hedge=False)
+        tasks = {asyncio.ensure_future(self._open_async(func, primary)): primary}
+        winner, error, pending = None, None, set(tasks)
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay())
+            if not done and self.budget.try_acquire():
+                self.hedged += 1
+                logger.info(f"No first chunk after {time.monotonic() - start_time:.2f}s; sending a hedged request")
+                hedge = _Attempt(hedge=True)
+                tasks[asyncio.ensure_future(self._open_async(func, hedge))] = hedge
+                pending = set(tasks)
+            
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    if winner is None:
+                        winner = task.result()
+                    else:
+                        tasks[task].cancel()
+        finally:
+            # Also reached when the caller itself is cancelled
+            for task in pending:
+                tasks[task].cancel()
+                task.cancel()
+        
+        if winner is None:
+            raise error
+        self._record_win(winner, start_time)
+        if winner.first is not _END:
+            yield winner.first
+        async for chunk in winner.iterator:
+            yield chunk
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'delay': round(self.delay(), 3),
+            'samples': len(self.latency),
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'budget_exhausted': self.budget.exhausted
+        }
+
+# Global hedger for Gemini calls
+gemini_hedger = Hedger()
@@ -0,0 +1,71 @@
+# Fast JSON serialization for API responses
+import json
+import base64
+import logging
+import dataclasses
+from datetime import datetime, date, time
+from decimal import Decimal
+from typing import Any
+import numpy as np
+import pandas as pd
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+def _default(obj: Any) -> Any:
+    """Convert objects the serializer has no native support for"""
+    # Response models expose a shallow view of themselves; nested models are converted lazily
+    if hasattr(obj, '__json__'):
+        return obj.__json__()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(obj).decode('ascii')
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, pd.DataFrame):
+        return obj.to_dict(orient='records')
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return obj.tolist()
+    if isinstance(obj, (pd.Timestamp, datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, pd.Timedelta):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class _FallbackEncoder(json.JSONEncoder):
+    """Standard-library encoder with the same conversions, used when orjson is unavailable"""
+
+    def default(self, obj):
+        return _default(obj)
+
+if orjson is not None:
+    # Dataclasses are routed through _default so their __json__ views are used
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS
+
+def dumps(obj: Any) -> bytes:
+    """Serialize an object to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+    return json.dumps(obj, cls=_FallbackEncoder, ensure_ascii=False).encode('utf-8')
+
+def dumps_str(obj: Any) -> str:
+    """Serialize an object to a JSON string (e.g. for Server-Sent Events)"""
+    return dumps(obj).decode('utf-8')
+
+def json_response(payload: Any, status: int = 200) -> Response:
+    """Build a Flask JSON response, serializing response models directly"""
+    return Response(dumps(payload), status=status, mimetype='application/json')
@@ -0,0 +1,160 @@
+# Persistent per-session execution kernels
+import sys
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable
+import numpy as np
+import pandas as pd
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Requests without a session_id share this session for plot context; it never gets a kernel
+DEFAULT_SESSION_ID = 'default'
+
+def uses_kernel(session_id: Optional[str]) -> bool:
+    """Whether a session's code runs in a persistent kernel (only sessions the client named)"""
+    return bool(config.ENABLE_KERNELS and session_id and session_id != DEFAULT_SESSION_ID)
+
+def estimate_namespace_bytes(namespace: dict, exclude_ids=None) -> int:
+    """Estimate the memory held by the values in an execution namespace"""
+    total = 0
+    seen = set(exclude_ids or ())
+    for value in list(namespace.values()):
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        try:
+            if isinstance(value, pd.DataFrame):
+                total += int(value.memory_usage(deep=True).sum())
+            elif isinstance(value, pd.Series):
+                total += int(value.memory_usage(deep=True))
+            elif isinstance(value, np.ndarray):
+                total += int(value.nbytes)
+            elif not isinstance(value, type(sys)) and not callable(value):
+                total += sys.getsizeof(value)
+        except Exception:
+            continue
+    return total
+
+class ExecutionKernel:
+    """A namespace kept alive across code blocks and chat turns for one session"""
+    
+    def __init__(self, session_id: str, namespace: dict, dataset_signature=None):
+        self.session_id = session_id
+        self.namespace = namespace
+        self.dataset_signature = dataset_signature
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.executions = 0
+        self.lock = threading.RLock()
+        # Datasets the namespace starts with are copies of shared dataset cache entries and are not charged to the kernel
+        self._base_ids = {id(value) for value in namespace.values()}
+    
+    def memory_usage(self) -> int:
+        """Estimate the memory held by values the session's code created"""
+        exclude_ids = set(self._base_ids)
+        for name in getattr(self.namespace, 'loaded_names', ()):
+            if name in self.namespace:
+                exclude_ids.add(id(self.namespace[name]))
+        return estimate_namespace_bytes(self.namespace, exclude_ids)
+
+class KernelManager:
+    """Keeps one execution kernel per session.
+    
+    Kernels idle for longer than the timeout are evicted, the least recently
+    used kernel is dropped when too many sessions are open, and a kernel whose
+    namespace grows past the memory cap is reset to a fresh one.
+    """
+    
+    def __init__(self, idle_timeout: float = None, memory_limit_mb: int = None, max_kernels: int = None):
+        self.idle_timeout = idle_timeout or config.KERNEL_IDLE_TIMEOUT
+        self.memory_limit_bytes = (config.KERNEL_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb) * 1024 * 1024
+        self.max_kernels = max_kernels or config.KERNEL_MAX_SESSIONS
+        self._kernels = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_timeout
+        expired = [session_id for session_id, kernel in self._kernels.items() if kernel.last_used < cutoff]
+        for session_id in expired:
+            del self._kernels[session_id]
+            logger.info(f"Evicted idle execution kernel for session {session_id}")
+    
+    def get_kernel(self, session_id: str, namespace_factory: Callable[[], dict], dataset_signature=None) -> ExecutionKernel:
+        """Get the session's kernel, starting a fresh one if none exists or its dataset changed.
+        
+        A turn without a dataset signature (no file attached) keeps using the
+        session's current kernel.
+        """
+        with self._lock:
+            self._evict_idle()
+            kernel = self._lookup(session_id, dataset_signature)
+            if kernel is not None:
+                return kernel
+        
+        # Build the namespace outside the lock; loading the dataset can take a while
+        new_kernel = ExecutionKernel(session_id, namespace_factory(), dataset_signature)
+        with self._lock:
+            kernel = self._lookup(session_id, dataset_signature)
+            if kernel is not None:
+                return kernel
+            self._kernels[session_id] = new_kernel
+            while len(self._kernels) > self.max_kernels:
+                evicted_id, _ = self._kernels.popitem(last=False)
+                logger.info(f"Evicted execution kernel for session {evicted_id} (kernel limit reached)")
+            logger.info(f"Started execution kernel for session {session_id}")
+            return new_kernel
+    
+    def _lookup(self, session_id: str, dataset_signature) -> Optional[ExecutionKernel]:
+        kernel = self._kernels.get(session_id)
+        if kernel is None:
+            return None
+        if dataset_signature is not None and kernel.dataset_signature != dataset_signature:
+            logger.info(f"Dataset changed for session {session_id}, resetting its execution kernel")
+            del self._kernels[session_id]
+            return None
+        self._kernels.move_to_end(session_id)
+        kernel.last_used = time.time()
+        return kernel
+    
+    def release(self, kernel: ExecutionKernel):
+        """Record a finished execution and reset the kernel if it exceeded the memory cap"""
+        kernel.executions += 1
+        kernel.last_used = time.time()
+        if not self.memory_limit_bytes:
+            return
+        
+        memory_bytes = kernel.memory_usage()
+        if memory_bytes > self.memory_limit_bytes:
+            logger.warning(
+                f"Execution kernel for session {kernel.session_id} holds {memory_bytes / 1024 / 1024:.1f}MB, "
+                f"over the {self.memory_limit_bytes / 1024 / 1024:.0f}MB cap; resetting it"
+            )
+            with self._lock:
+                if self._kernels.get(kernel.session_id) is kernel:
+                    del self._kernels[kernel.session_id]
+    
+    def reset(self, session_id: str):
+        """Discard the kernel of a session"""
+        with self._lock:
+            if self._kernels.pop(session_id, None) is not None:
+                logger.info(f"Reset execution kernel for session {session_id}")
+    
+    def has_kernel(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._kernels
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get kernel counts for monitoring"""
+        with self._lock:
+            return {
+                'active_kernels': len(self._kernels),
+                'max_kernels': self.max_kernels,
+                'idle_timeout': self.idle_timeout
+            }
+
+# Global kernel manager instance
+kernel_manager = KernelManager()
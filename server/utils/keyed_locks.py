@@ -0,0 +1,34 @@
+# Per-key locks that only exist while they are in use
+import threading
+import contextlib
+from typing import Hashable, Iterator
+
+class KeyedLocks:
+    """One lock per key, created on first use and dropped once no thread holds or waits for it.
+    
+    Unlike a dict of locks that only grows, this stays as large as the number
+    of keys currently being worked on, so it suits keys that are unbounded over
+    a worker's lifetime (content digests, file paths).
+    """
+    
+    def __init__(self):
+        self._entries = {}  # key -> [lock, threads holding or waiting]
+        self._lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def hold(self, key: Hashable) -> Iterator[None]:
+        with self._lock:
+            entry = self._entries.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._entries[key]
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
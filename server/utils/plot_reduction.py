@@ -0,0 +1,302 @@
+# Data reduction for plots of large datasets
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+import numpy as np
+import pandas as pd
+from matplotlib import colors as mcolors
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Distinct colors above which a scatter is treated as continuously colored
+MAX_DENSITY_LAYERS = 8
+
+# Plotly trace properties that may hold one value per point and must be downsampled with x and y
+PLOTLY_PER_POINT_PROPERTIES = (
+    'ids', 'customdata', 'text', 'hovertext', 'hovertemplate', 'textposition',
+    'marker.color', 'marker.size', 'marker.symbol', 'marker.opacity', 'marker.line.color', 'marker.line.width',
+    'error_x.array', 'error_x.arrayminus', 'error_y.array', 'error_y.arrayminus'
+)
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Select n_out points with Largest-Triangle-Three-Buckets; x must be sorted"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    # Bucket boundaries for the n - 2 interior points; first and last points are always kept
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    
+    # Averages of every bucket, used as the third triangle vertex
+    bucket_sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    bucket_sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    bucket_sizes = np.diff(edges)
+    avg_x = np.append(bucket_sums_x / bucket_sizes, x[-1])
+    avg_y = np.append(bucket_sums_y / bucket_sizes, y[-1])
+    
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = avg_x[bucket + 1], avg_y[bucket + 1]
+        # Twice the triangle area against the previously selected point and the next bucket's mean
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas)) if len(areas) else start
+        selected[bucket + 1] = previous
+    return selected
+
+def _as_numeric(values) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """Convert plot coordinates to float64, remembering datetimes so they can be restored"""
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'iuf':
+        return arr.astype(np.float64, copy=False), None
+    if arr.dtype.kind == 'M':
+        return arr.astype('datetime64[ns]').astype(np.int64).astype(np.float64), 'datetime'
+    if arr.dtype == object:
+        try:
+            converted = pd.to_datetime(pd.Series(arr), errors='raise')
+            return converted.to_numpy().astype('datetime64[ns]').astype(np.int64).astype(np.float64), 'datetime'
+        except (ValueError, TypeError):
+            return None, None
+    return None, None
+
+def _restore(values: np.ndarray, kind: Optional[str]):
+    return values.astype(np.int64).astype('datetime64[ns]') if kind == 'datetime' else values
+
+def downsample_lttb(x, y, n_out: int = None):
+    """Downsample a line to n_out points with LTTB, preserving its visual shape"""
+    n_out = n_out or config.PLOT_LTTB_POINTS
+    x_values, x_kind = _as_numeric(x)
+    y_values, _ = _as_numeric(y)
+    if x_values is None or y_values is None:
+        raise ValueError("downsample_lttb needs numeric or datetime coordinates")
+    order = np.argsort(x_values, kind='stable')
+    indices = order[lttb_indices(x_values[order], y_values[order], n_out)]
+    return _restore(x_values[indices], x_kind), y_values[indices]
+
+def density_grid(x: np.ndarray, y: np.ndarray, bins: int = None, extent=None):
+    """Bin points into a 2-D count grid (rows are y) and return it with its extent"""
+    bins = bins or config.PLOT_DENSITY_BINS
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    if extent is None:
+        extent = (x.min(), x.max(), y.min(), y.max()) if len(x) else (0, 1, 0, 1)
+    x_min, x_max, y_min, y_max = extent
+    counts, _, _ = np.histogram2d(
+        y, x, bins=bins,
+        range=[[y_min, y_max if y_max > y_min else y_min + 1], [x_min, x_max if x_max > x_min else x_min + 1]]
+    )
+    return counts, extent
+
+def _density_rgba(counts: np.ndarray, color) -> np.ndarray:
+    """Shade a count grid in one color, with opacity growing with log density"""
+    rgba = np.zeros(counts.shape + (4,))
+    rgba[..., :3] = mcolors.to_rgb(color)
+    occupied = counts > 0
+    if occupied.any():
+        scaled = np.log1p(counts) / np.log1p(counts.max())
+        rgba[..., 3] = np.where(occupied, 0.2 + 0.8 * scaled, 0.0)
+    return rgba
+
+def _reduce_matplotlib_line(line, threshold: int, n_out: int) -> Optional[Dict[str, Any]]:
+    xy = line.get_xydata()
+    if len(xy) <= threshold:
+        return None
+    x, y = xy[:, 0], xy[:, 1]
+    # Only lines drawn left to right are time series; other paths are left untouched
+    if not np.all(np.diff(x[np.isfinite(x)]) >= 0):
+        return None
+    indices = lttb_indices(x, y, n_out)
+    line.set_data(x[indices], y[indices])
+    return {'method': 'lttb', 'points_in': len(xy), 'points_out': len(indices)}
+
+def _reduce_matplotlib_scatter(ax, collection, threshold: int, bins: int) -> Optional[Dict[str, Any]]:
+    offsets = np.asarray(collection.get_offsets(), dtype=np.float64)
+    if len(offsets) <= threshold or ax.get_xscale() != 'linear' or ax.get_yscale() != 'linear':
+        return None
+    
+    x, y = offsets[:, 0], offsets[:, 1]
+    xlim, ylim = ax.get_xlim(), ax.get_ylim()
+    extent = (min(xlim), max(xlim), min(ylim), max(ylim))
+    facecolors = collection.get_facecolors()
+    unique_colors = np.unique(facecolors, axis=0) if len(facecolors) else np.array([[0.12, 0.47, 0.71, 1.0]])
+    
+    layers = []
+    if len(unique_colors) <= MAX_DENSITY_LAYERS:
+        for color in unique_colors:
+            mask = np.all(facecolors == color, axis=1) if len(facecolors) == len(offsets) else slice(None)
+            counts, _ = density_grid(x[mask], y[mask], bins, extent)
+            layers.append(_density_rgba(counts, color[:3]))
+    else:
+        # Continuous coloring (a colormap per point) cannot be split into layers; show plain density
+        counts, _ = density_grid(x, y, bins, extent)
+        layers.append(_density_rgba(counts, 'C0'))
+    
+    zorder = collection.get_zorder()
+    collection.remove()
+    for layer in layers:
+        ax.imshow(layer, extent=extent, origin='lower', aspect='auto', interpolation='nearest', zorder=zorder)
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    return {'method': 'histogram2d', 'points_in': len(offsets), 'points_out': int(bins * bins)}
+
+def reduce_matplotlib_figure(fig) -> List[Dict[str, Any]]:
+    """Downsample long lines and aggregate dense scatters in a figure before it is rendered"""
+    if not config.PLOT_REDUCTION_ENABLED:
+        return []
+    from matplotlib.collections import PathCollection
+    
+    reductions = []
+    for ax in fig.axes:
+        if getattr(ax, 'name', 'rectilinear') != 'rectilinear':
+            continue
+        for line in list(ax.get_lines()):
+            reduction = _reduce_matplotlib_line(line, config.PLOT_POINT_THRESHOLD, config.PLOT_LTTB_POINTS)
+            if reduction:
+                reductions.append(reduction)
+        for collection in list(ax.collections):
+            if isinstance(collection, PathCollection):
+                reduction = _reduce_matplotlib_scatter(ax, collection, config.PLOT_POINT_THRESHOLD, config.PLOT_DENSITY_BINS)
+                if reduction:
+                    reductions.append(reduction)
+    
+    for reduction in reductions:
+        logger.info(f"Reduced plot data with {reduction['method']}: {reduction['points_in']} -> {reduction['points_out']} points")
+    return reductions
+
+def _trace_color(fig, trace, index: int) -> str:
+    marker_color = getattr(getattr(trace, 'marker', None), 'color', None)
+    if isinstance(marker_color, str):
+        return marker_color
+    line_color = getattr(getattr(trace, 'line', None), 'color', None)
+    if isinstance(line_color, str):
+        return line_color
+    colorway = fig.layout.colorway or (fig.layout.template.layout.colorway if fig.layout.template else None)
+    colorway = colorway or mcolors.TABLEAU_COLORS.values()
+    colorway = list(colorway)
+    return colorway[index % len(colorway)]
+
+def _narrow_counts(counts: np.ndarray) -> np.ndarray:
+    """Store counts in the smallest unsigned type, which keeps the typed-array payload small"""
+    return counts.astype(np.uint16 if counts.max() <= np.iinfo(np.uint16).max else np.uint32)
+
+def _log_colorscale(max_count: float, rgb, stops: int = 8) -> List[list]:
+    """Build a colorscale over raw counts that looks logarithmic; empty cells are transparent"""
+    r, g, b = rgb
+    max_count = max(float(max_count), 1.0)
+    scale = [[0, f'rgba({r},{g},{b},0)']]
+    for t in np.linspace(0, 1, stops):
+        count = np.expm1(t * np.log1p(max_count))
+        fraction = min(max(count, 1.0) / max_count, 1.0)
+        scale.append([fraction, f'rgba({r},{g},{b},{0.2 + 0.8 * t:.3f})'])
+    # Colorscale positions must increase
+    deduplicated = [scale[0]]
+    for fraction, color in scale[1:]:
+        if fraction > deduplicated[-1][0]:
+            deduplicated.append([fraction, color])
+    if deduplicated[-1][0] < 1:
+        deduplicated.append([1, scale[-1][1]])
+    return deduplicated
+
+def _plotly_point_subsets(trace, indices: np.ndarray, n_points: int) -> Optional[Dict[str, Any]]:
+    """Get the trace's per-point properties reduced to `indices`, or None if one cannot be subset"""
+    subsets = {}
+    for path in PLOTLY_PER_POINT_PROPERTIES:
+        value = trace[path]
+        if value is None or isinstance(value, str) or not hasattr(value, '__len__'):
+            continue
+        if len(value) != n_points:
+            return None
+        subsets[path] = value[indices] if isinstance(value, np.ndarray) else [value[i] for i in indices]
+    
+    selected = trace.selectedpoints
+    if selected is not None:
+        selected = np.asarray(selected)
+        if selected.dtype.kind not in 'iu':
+            return None
+        # Selected point numbers refer to positions, which change once points are dropped
+        subsets['selectedpoints'] = np.flatnonzero(np.isin(indices, selected)).tolist()
+    return subsets
+
+def reduce_plotly_figure(fig) -> List[Dict[str, Any]]:
+    """Downsample long line traces and aggregate dense marker traces in a Plotly figure"""
+    if not config.PLOT_REDUCTION_ENABLED or not hasattr(fig, 'data'):
+        return []
+    import plotly.graph_objects as go
+    
+    threshold = config.PLOT_POINT_THRESHOLD
+    reductions = []
+    new_traces = []
+    for index, trace in enumerate(fig.data):
+        if trace.type not in ('scatter', 'scattergl') or trace.y is None or len(trace.y) <= threshold:
+            new_traces.append(trace)
+            continue
+        
+        x_values, x_kind = _as_numeric(trace.x if trace.x is not None else np.arange(len(trace.y)))
+        y_values, y_kind = _as_numeric(trace.y)
+        if x_values is None or y_values is None or y_kind is not None:
+            new_traces.append(trace)
+            continue
+        
+        mode = trace.mode or ('lines' if len(trace.y) > 20 else 'lines+markers')
+        if 'lines' in mode:
+            # Like matplotlib lines, only traces drawn left to right are downsampled
+            if not np.all(np.diff(x_values[np.isfinite(x_values)]) >= 0):
+                new_traces.append(trace)
+                continue
+            indices = lttb_indices(x_values, y_values, config.PLOT_LTTB_POINTS)
+            subsets = _plotly_point_subsets(trace, indices, len(x_values))
+            if subsets is None:
+                new_traces.append(trace)
+                continue
+            trace.x = _restore(x_values[indices], x_kind)
+            trace.y = y_values[indices]
+            for path, value in subsets.items():
+                trace[path] = value
+            new_traces.append(trace)
+            reductions.append({'method': 'lttb', 'points_in': len(x_values), 'points_out': len(indices)})
+            continue
+        
+        counts, extent = density_grid(x_values, y_values)
+        bins = counts.shape[0]
+        x_centers = np.linspace(extent[0], extent[1], bins + 1)
+        y_centers = np.linspace(extent[2], extent[3], bins + 1)
+        x_centers = (x_centers[:-1] + x_centers[1:]) / 2
+        y_centers = (y_centers[:-1] + y_centers[1:]) / 2
+        r, g, b = (int(channel * 255) for channel in mcolors.to_rgb(_trace_color(fig, trace, index)))
+        new_traces.append(go.Heatmap(
+            x=_restore(x_centers, x_kind), y=y_centers, z=_narrow_counts(counts),
+            colorscale=_log_colorscale(counts.max(), (r, g, b)), zmin=0, zmax=max(counts.max(), 1),
+            hovertemplate='count: %{z}<extra>' + (trace.name or '') + '</extra>',
+            showscale=False, name=trace.name, showlegend=bool(trace.name),
+            xaxis=trace.xaxis, yaxis=trace.yaxis
+        ))
+        reductions.append({'method': 'histogram2d', 'points_in': len(x_values), 'points_out': int(np.count_nonzero(counts))})
+    
+    if reductions:
+        fig.data = []
+        fig.add_traces(new_traces)
+        for reduction in reductions:
+            logger.info(f"Reduced Plotly data with {reduction['method']}: {reduction['points_in']} -> {reduction['points_out']} points")
+    return reductions
+
+def density_plot(x, y, kind: str = 'hist2d', bins: int = None, ax=None, cmap: str = 'viridis', **kwargs):
+    """Plot point density instead of individual points (kind='hist2d' or 'hexbin')"""
+    import matplotlib.pyplot as plt
+    ax = ax or plt.gca()
+    x_values, _ = _as_numeric(x)
+    y_values, _ = _as_numeric(y)
+    if x_values is None or y_values is None:
+        raise ValueError("density_plot needs numeric coordinates")
+    bins = bins or config.PLOT_DENSITY_BINS
+    if kind == 'hexbin':
+        return ax.hexbin(x_values, y_values, gridsize=max(bins // 4, 10), cmap=cmap, bins='log', mincnt=1, **kwargs)
+    counts, extent = density_grid(x_values, y_values, bins)
+    masked = np.ma.masked_equal(counts, 0)
+    return ax.imshow(masked, extent=extent, origin='lower', aspect='auto', interpolation='nearest',
+                     cmap=cmap, norm=mcolors.LogNorm(), **kwargs)
@@ -0,0 +1,102 @@
+# Single-pass Plotly figure capture with typed-array encoding
+import math
+import base64
+import logging
+from typing import Any, Dict, Optional
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+# numpy dtypes plotly.js can decode from {'dtype', 'bdata'} typed arrays
+PLOTLY_TYPED_ARRAY_DTYPES = {
+    'float64': 'f8', 'float32': 'f4',
+    'int32': 'i4', 'int16': 'i2', 'int8': 'i1',
+    'uint32': 'u4', 'uint16': 'u2', 'uint8': 'u1'
+}
+
+# Shorter arrays stay plain lists; base64 only pays off once there is some data
+TYPED_ARRAY_MIN_LENGTH = 16
+
+_fallback_encoder = PlotlyJSONEncoder()
+
+def _narrow_dtype(arr: np.ndarray) -> np.ndarray:
+    """Cast arrays plotly.js has no typed array for (64-bit ints, float16) to one it does"""
+    if arr.dtype.name in PLOTLY_TYPED_ARRAY_DTYPES:
+        return arr
+    if arr.dtype.kind in 'iu' and arr.size:
+        low, high = arr.min(), arr.max()
+        if arr.dtype.kind == 'u' and high <= np.iinfo(np.uint32).max:
+            return arr.astype(np.uint32)
+        if np.iinfo(np.int32).min <= low and high <= np.iinfo(np.int32).max:
+            return arr.astype(np.int32)
+    if arr.dtype.kind == 'f' and arr.dtype.itemsize < 4:
+        return arr.astype(np.float32)
+    return arr.astype(np.float64)
+
+def encode_typed_array(arr: np.ndarray) -> Dict[str, Any]:
+    """Encode a numeric array in the plotly.js base64 typed-array format"""
+    arr = _narrow_dtype(arr)
+    # plotly.js reads little-endian, C-ordered buffers
+    arr = np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<'))
+    encoded = {
+        'dtype': PLOTLY_TYPED_ARRAY_DTYPES[arr.dtype.name],
+        'bdata': base64.b64encode(arr.tobytes()).decode('ascii')
+    }
+    if arr.ndim > 1:
+        encoded['shape'] = ', '.join(str(dim) for dim in arr.shape)
+    return encoded
+
+def _as_matrix(rows) -> Optional[np.ndarray]:
+    """Stack a list of equal-length numeric arrays (e.g. heatmap rows) into one 2-D array"""
+    if not rows or not all(isinstance(row, (np.ndarray, pd.Series)) for row in rows):
+        return None
+    arrays = [np.asarray(row) for row in rows]
+    if any(arr.ndim != 1 or arr.dtype.kind not in 'iuf' or len(arr) != len(arrays[0]) for arr in arrays):
+        return None
+    if len(arrays) * len(arrays[0]) < TYPED_ARRAY_MIN_LENGTH:
+        return None
+    return np.stack(arrays)
+
+def _plain(value):
+    """Arrays nested in a list are written as lists; plotly.js only decodes whole attributes as typed arrays"""
+    if isinstance(value, (np.ndarray, pd.Series, pd.Index)):
+        return value.tolist()
+    return value
+
+def _encode_value(value):
+    if value is None or isinstance(value, (str, bool, int)):
+        return value
+    if isinstance(value, float):
+        return None if math.isnan(value) or math.isinf(value) else value
+    if isinstance(value, dict):
+        return {key: _encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Python lists stay JSON; a list of array rows becomes one typed array with a shape
+        matrix = _as_matrix(value)
+        if matrix is not None:
+            return encode_typed_array(matrix)
+        return [_encode_value(_plain(item)) for item in value]
+    if isinstance(value, (pd.Series, pd.Index)):
+        return _encode_value(value.to_numpy())
+    if isinstance(value, np.ndarray):
+        # 2-D and higher arrays become a single typed array with a shape
+        if value.dtype.kind in 'iuf' and value.size >= TYPED_ARRAY_MIN_LENGTH:
+            return encode_typed_array(value)
+        if value.dtype.kind == 'M':
+            return [None if text == 'NaT' else text for text in np.datetime_as_string(value).tolist()]
+        return _encode_value(value.tolist())
+    if isinstance(value, np.generic):
+        return _encode_value(value.item())
+    # Dates, decimals, PIL images, masked values and other types plotly knows how to encode
+    return _encode_value(_fallback_encoder.default(value))
+
+def encode_plotly_figure(fig) -> Dict[str, Any]:
+    """Capture a Plotly figure as a JSON-ready dict in one pass.
+
+    Numeric arrays become {'dtype', 'bdata'} typed arrays instead of lists of
+    floats; the result is serialized only once, with the rest of the response.
+    """
+    figure_json = fig.to_plotly_json() if hasattr(fig, 'to_plotly_json') else fig
+    return _encode_value(figure_json)
@@ -0,0 +1,67 @@
+# Pre-fork server support: warm shared state once in the master, reset per-process state in workers
+import os
+import gc
+import time
+import logging
+import numpy as np
+from matplotlib import pyplot as plt
+import plotly.express as px
+import plotly.graph_objects as go
+from .dataset_manager import DatasetManager, example_dataset_manager
+from .dataset_profiler import dataset_profiler
+from .gemini_factory import gemini_client_pool
+from config import config
+
+logger = logging.getLogger(__name__)
+
+def _warm_plotting():
+    """Load fonts and plotly validators, which are otherwise loaded lazily by every worker"""
+    fig, ax = plt.subplots(figsize=(2, 2))
+    ax.plot([0, 1], [0, 1])
+    ax.set_title('warm-up')
+    fig.canvas.draw()
+    plt.close(fig)
+    for figure in (px.scatter(x=[0, 1], y=[0, 1]), px.line(x=[0, 1], y=[0, 1]), px.bar(x=['a'], y=[1]),
+                   px.histogram(x=[0, 1]), go.Figure(go.Heatmap(z=[[0, 1]])), go.Figure(go.Box(y=[0, 1]))):
+        figure.to_plotly_json()
+
+def _warm_datasets() -> int:
+    """Load the example and uploaded datasets (and their profiles) into the shared caches"""
+    loaded = 0
+    for manager in (example_dataset_manager, DatasetManager(config.PREFORK_DATASETS_PATH)):
+        for filename in manager.get_available_datasets():
+            try:
+                df = manager.load_dataset(filename)
+                if df is None:
+                    continue
+                dataset_profiler.get_profile(os.path.join(manager.datasets_path, filename), df)
+                loaded += 1
+            except Exception as e:
+                logger.warning(f"Failed to preload dataset {filename}: {e}")
+    return loaded
+
+def preload():
+    """Do heavy, read-only initialization in the master so forked workers share it copy-on-write.
+    
+    Call it after the app has been imported and before the first fork. It must
+    not start threads or open network connections (e.g. Gemini calls): neither
+    survives a fork.
+    """
+    start_time = time.time()
+    _warm_plotting()
+    datasets = _warm_datasets() if config.PREFORK_PRELOAD_DATASETS else 0
+    logger.info(f"Preloaded plotting libraries and {datasets} dataset(s) in {time.time() - start_time:.2f}s")
+
+def before_fork():
+    """Move everything allocated so far out of the GC's reach, so collections in workers don't touch (and copy) those pages"""
+    gc.freeze()
+
+def after_fork():
+    """Reset per-process state in a newly forked worker"""
+    gc.enable()
+    # gRPC channels must not be shared with the master; each worker opens its own
+    gemini_client_pool.reset()
+    if config.GEMINI_PREWARM:
+        gemini_client_pool.warm_in_background()
+    # Otherwise every worker inherits the master's numpy random state
+    np.random.seed()
@@ -14,6 +14,9 @@ Dataset Access:
 - You can also reference data as 'data' or 'dataset' 
 - Multiple datasets are loaded by their filename (without extension)
 - For example: if 'titanic.csv' is uploaded, use 'titanic' variable
+- For very large files 'df' is a representative sample; use 'df_stream' (e.g. df_stream.describe(), df_stream.value_counts(col), df_stream.groupby(by, col, agg)) for exact full-data results
+- Variables you define (cleaned frames, fitted models, merged tables) persist into later code blocks and follow-up questions in the same conversation; reuse them instead of recomputing
+- Lines and scatters with very many points are automatically downsampled (LTTB) or shown as density; downsample_lttb(x, y) and density_plot(x, y, kind='hist2d'|'hexbin') are available to do this explicitly
 - NEVER include data loading, import statements, or file reading code
 
 MANDATORY Response Structure for Dataset Analysis:
@@ -120,9 +123,9 @@ show_plot()  # CRITICAL: Always call this!
 IMPORTANT: Never include import statements, data loading, or data preprocessing code."""
 
     @staticmethod
-    def get_chat_prompt(user_message, history=None):
-        """Generate a chat prompt with conversation history"""
-        system_prompt = GeminiPrompts.get_system_prompt()
+    def get_chat_prompt(user_message, history=None, include_system_prompt=True):
+        """Generate a chat prompt with conversation history; leave out the system prompt when the model carries it"""
+        system_prompt = GeminiPrompts.get_system_prompt() if include_system_prompt else ""
           # Build history context
         history_context = ""
         if history:
@@ -140,7 +143,40 @@ IMPORTANT: Never include import statements, data loading, or data preprocessing
 
 Please respond following the format guidelines above."""
     @staticmethod
-    def get_data_analysis_prompt(user_message, uploaded_file_path=None, history=None, plot_images=None):
+    def format_dataset_profile(profile):
+        """Render a precomputed dataset profile as compact prompt context"""
+        if not profile:
+            return ""
+        
+        sampled_note = ""
+        if profile.get('sampled'):
+            sampled_note = (f" (⚠️ 'df' is a random sample of {profile.get('sample_rows')} of {profile.get('rows')} rows: "
+                            "statistics come from the sample, row and null counts are exact. Tell the user that results are "
+                            "based on a sample, and use df_stream where exact full-data results matter)")
+        lines = [
+            "\n\n## 📊 Precomputed Dataset Profile" + sampled_note + ":",
+            f"- Rows: {profile.get('rows')}, Columns: {profile.get('column_count')}, "
+            f"Duplicate rows: {profile.get('duplicate_rows')}, Memory: {profile.get('memory_bytes', 0) / 1024 / 1024:.1f} MB",
+            "",
+            "| Column | Type | Nulls (%) | Unique | Min | Median | Max | Mean | Top values |",
+            "|---|---|---|---|---|---|---|---|---|"
+        ]
+        for name, column in profile.get('columns', {}).items():
+            top_values = ", ".join(f"{item['value']} ({item['count']})" for item in column.get('top_values', [])[:3])
+            median = column.get('quantiles', {}).get('0.5', '')
+            mean = column.get('mean')
+            lines.append(
+                f"| {name} | {column.get('dtype')} | {column.get('null_count')} ({column.get('null_pct')}%) "
+                f"| {column.get('cardinality')} | {column.get('min', '')} | {median} | {column.get('max', '')} "
+                f"| {'' if mean is None else f'{mean:.4g}'} | {top_values} |"
+            )
+        lines.append("")
+        lines.append("Use this profile for the Dataset Overview and Data Quality sections. "
+                     "Do NOT write code that recomputes shape, dtypes, null counts, describe() or head().")
+        return "\n".join(lines)
+
+    @staticmethod
+    def get_data_analysis_prompt(user_message, uploaded_file_path=None, history=None, plot_images=None, dataset_profile=None):
         # Build context from history and plot images
         history_context = ""
         if history:
@@ -156,7 +192,9 @@ Please respond following the format guidelines above."""
             plot_context += f"I have generated {len(plot_images)} plots in our previous conversation. "
             plot_context += "Please reference these plots in your analysis and build upon them for deeper insights.\n"
             for i, plot_info in enumerate(plot_images):
-                plot_context += f"- Plot {i+1}: {plot_info.get('description', 'Visualization')}\n"
+                # Entries may be PIL images or figure references, which carry no description
+                description = plot_info.get('description', 'Visualization') if isinstance(plot_info, dict) else 'Visualization'
+                plot_context += f"- Plot {i+1}: {description}\n"
         
         return f"""CRITICAL INSTRUCTION: You MUST provide comprehensive dataset analysis with structured visualizations.
 
@@ -167,6 +205,8 @@ Please respond following the format guidelines above."""
 
 {plot_context}
 
+{GeminiPrompts.format_dataset_profile(dataset_profile)}
+
 ## 📋 MANDATORY RESPONSE REQUIREMENTS:
 
 1. **ALWAYS** start with dataset overview and quality assessment
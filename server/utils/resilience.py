@@ -0,0 +1,348 @@
+# Resilience for upstream calls: backoff with jitter, retry budget and circuit breaker
+import re
+import time
+import random
+import asyncio
+import threading
+import logging
+from collections import deque
+from typing import Callable, Optional, Any, Dict
+import grpc
+from google.api_core import exceptions as api_exceptions
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Upstream overload, outages and transport failures; anything else (bad request, safety block, auth) is terminal
+RETRYABLE_EXCEPTIONS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.Aborted,
+    api_exceptions.Unknown,
+    ConnectionError,
+    TimeoutError,
+)
+
+RETRYABLE_GRPC_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.ABORTED,
+    grpc.StatusCode.UNKNOWN,
+}
+
+# Gemini quota errors carry the hint in the message, e.g. "Please retry in 41.95s."
+RETRY_AFTER_MESSAGE_PATTERN = re.compile(r'retry in (\d+(?:\.\d+)?)\s*s', re.IGNORECASE)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open"""
+    
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is temporarily unavailable; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed call may succeed if repeated"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, RETRYABLE_EXCEPTIONS):
+        return True
+    if isinstance(error, grpc.RpcError) and callable(getattr(error, 'code', None)):
+        return error.code() in RETRYABLE_GRPC_CODES
+    # Stale protobuf descriptors after a reconfiguration; a fresh client fixes it
+    return isinstance(error, AttributeError) and 'DESCRIPTOR' in str(error)
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Get the server's retry-after hint (RetryInfo, Retry-After header or message), in seconds"""
+    for detail in getattr(error, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is None:
+            continue
+        if hasattr(delay, 'total_seconds'):
+            return delay.total_seconds()
+        return delay.seconds + delay.nanos / 1e9
+    
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers and headers.get('Retry-After'):
+        try:
+            return float(headers['Retry-After'])
+        except ValueError:
+            pass
+    
+    match = RETRY_AFTER_MESSAGE_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+class RetryBudget:
+    """Caps retries at a fraction of recent requests, so retries cannot multiply load during an incident.
+    
+    Within the sliding window, up to `ratio` retries per request are allowed,
+    plus a floor of `min_per_second` so low-traffic processes can still retry.
+    """
+    
+    def __init__(self, ratio: float = None, min_per_second: float = None, window: float = 10.0):
+        self.ratio = config.RETRY_BUDGET_RATIO if ratio is None else ratio
+        self.min_per_second = config.RETRY_BUDGET_MIN_PER_SECOND if min_per_second is None else min_per_second
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+    
+    def _prune(self, now: float):
+        cutoff = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+    
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._requests.append(now)
+    
+    def try_acquire(self) -> bool:
+        """Take one retry from the budget, or return False if it is spent"""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._prune(time.monotonic())
+            return {'requests': len(self._requests), 'retries': len(self._retries), 'exhausted': self.exhausted}
+
+class CircuitBreaker:
+    """Stops calling an upstream after consecutive failures, then lets a single probe through after a cool-down"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or config.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = config.CIRCUIT_BREAKER_RESET_TIMEOUT if reset_timeout is None else reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """Whether a call may go to the upstream now"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_started_at = None
+            if self.state == self.HALF_OPEN:
+                # One probe at a time; a probe whose outcome never arrived is replaced after the cool-down
+                if self._probe_started_at is not None and now - self._probe_started_at < self.reset_timeout:
+                    return False
+                self._probe_started_at = now
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit breaker '{self.name}' closed")
+            self.state = self.CLOSED
+            self.failures = 0
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                logger.warning(f"Circuit breaker '{self.name}' opened after {self.failures} consecutive failures")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+    
+    def retry_after(self) -> float:
+        with self._lock:
+            since = max(self._opened_at, self._probe_started_at or 0.0)
+            return max(0.0, self.reset_timeout - (time.monotonic() - since))
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures}
+
+class Resilience:
+    """Retry policy for one upstream: exponential backoff with full jitter, honoring retry-after hints,
+    bounded by attempts, an overall deadline, a shared retry budget and a circuit breaker.
+    
+    Terminal errors are raised immediately. Streams are only retried while no
+    chunk has been handed to the caller, so output is never duplicated.
+    """
+    
+    def __init__(self, name: str, max_retries: int = None, base_delay: float = None, max_delay: float = None,
+                 deadline: float = None, budget: RetryBudget = None, breaker: CircuitBreaker = None):
+        self.name = name
+        self.max_retries = config.MAX_RETRY_ATTEMPTS if max_retries is None else max_retries
+        self.base_delay = config.RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = config.RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.deadline = config.RETRY_DEADLINE if deadline is None else deadline
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker(name)
+    
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number `attempt` (0-based)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            # Never earlier than the server asked; the jitter still spreads out the herd
+            delay = retry_after + delay / 2
+        return delay
+    
+    def _check_circuit(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.name, self.breaker.retry_after())
+    
+    def _on_success(self):
+        self.breaker.record_success()
+    
+    def _on_failure(self, error: Exception, attempt: int, start_time: float, max_retries: int) -> Optional[float]:
+        """Record a failed attempt and get the delay before retrying it, or None to give up"""
+        if not is_retryable(error):
+            # The upstream answered; the request itself is at fault
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        if attempt >= max_retries or self.breaker.state == CircuitBreaker.OPEN:
+            return None
+        delay = self.backoff(attempt, get_retry_after(error))
+        if time.monotonic() - start_time + delay > self.deadline:
+            logger.warning(f"Not retrying {self.name} call: a {delay:.1f}s wait would pass the {self.deadline:.0f}s deadline")
+            return None
+        if not self.budget.try_acquire():
+            logger.warning(f"Not retrying {self.name} call: retry budget exhausted")
+            return None
+        logger.warning(f"{self.name} call failed ({type(error).__name__}: {error}); retry {attempt + 1}/{max_retries} in {delay:.2f}s")
+        return delay
+    
+    def call(self, func: Callable[[], Any], on_retry: Callable[[Exception], None] = None, max_retries: int = None) -> Any:
+        """Call func, retrying retryable failures"""
+        max_retries = self.max_retries if max_retries is None else max_retries
+        self.budget.record_request()
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            self._check_circuit()
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._on_failure(e, attempt, start_time, max_retries)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                if on_retry:
+                    on_retry(e)
+                attempt += 1
+                continue
+            self._on_success()
+            return result
+    
+    async def call_async(self, func: Callable[[], Any], on_retry: Callable[[Exception], None] = None, max_retries: int = None) -> Any:
+        """Await func(), retrying retryable failures without blocking the event loop"""
+        max_retries = self.max_retries if max_retries is None else max_retries
+        self.budget.record_request()
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            self._check_circuit()
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._on_failure(e, attempt, start_time, max_retries)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                if on_retry:
+                    on_retry(e)
+                attempt += 1
+                continue
+            self._on_success()
+            return result
+    
+    def stream(self, func: Callable[[], Any], on_retry: Callable[[Exception], None] = None, max_retries: int = None):
+        """Iterate the stream returned by func, restarting it if it fails before its first chunk"""
+        max_retries = self.max_retries if max_retries is None else max_retries
+        self.budget.record_request()
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            self._check_circuit()
+            started = False
+            try:
+                for chunk in func():
+                    if not started:
+                        started = True
+                        self._on_success()
+                    yield chunk
+            except Exception as e:
+                if started:
+                    # Part of the output is already out; a restart would repeat it
+                    if is_retryable(e):
+                        self.breaker.record_failure()
+                    raise
+                delay = self._on_failure(e, attempt, start_time, max_retries)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                if on_retry:
+                    on_retry(e)
+                attempt += 1
+                continue
+            if not started:
+                self._on_success()
+            return
+    
+    async def stream_async(self, func: Callable[[], Any], on_retry: Callable[[Exception], None] = None, max_retries: int = None):
+        """Async variant of stream(); func returns an awaitable of an async iterable"""
+        max_retries = self.max_retries if max_retries is None else max_retries
+        self.budget.record_request()
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            self._check_circuit()
+            started = False
+            try:
+                async for chunk in await func():
+                    if not started:
+                        started = True
+                        self._on_success()
+                    yield chunk
+            except Exception as e:
+                if started:
+                    if is_retryable(e):
+                        self.breaker.record_failure()
+                    raise
+                delay = self._on_failure(e, attempt, start_time, max_retries)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                if on_retry:
+                    on_retry(e)
+                attempt += 1
+                continue
+            if not started:
+                self._on_success()
+            return
+    
+    def stats(self) -> Dict[str, Any]:
+        return {'circuit': self.breaker.stats(), 'retry_budget': self.budget.stats()}
+
+# Global resilience policy for Gemini calls
+gemini_resilience = Resilience('Gemini')
@@ -0,0 +1,189 @@
+# Deterministic cache of Gemini responses for repeated requests
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+from PIL import Image
+from config import config
+from utils.content_digest import content_digests
+
+logger = logging.getLogger(__name__)
+
+def normalize_prompt(text: str) -> str:
+    """Normalize line endings and trailing whitespace, which do not change what is asked"""
+    text = text.replace('\r\n', '\n').strip()
+    return re.sub(r'[ \t]+\n', '\n', text)
+
+def image_digest(image: Image.Image) -> str:
+    hasher = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+class ResponseCache:
+    """Caches complete Gemini responses by a hash of everything that determines them.
+    
+    The key covers the model name, generation config, safety settings, system
+    instruction, the normalized prompt text, the dataset's content digest and the digests of
+    any images. Uploaded Gemini files are represented by the dataset digest,
+    since their URIs change on every upload.
+    
+    Recent entries are kept in an in-memory LRU in front of a SQLite database
+    (WAL mode, like the file upload cache) shared by every worker process.
+    Both are bounded by RESPONSE_CACHE_MAX_ENTRIES and expire after
+    RESPONSE_CACHE_TTL.
+    """
+    
+    def __init__(self, ttl: float = None, max_entries: int = None, persist: bool = None):
+        self.ttl = ttl or config.RESPONSE_CACHE_TTL
+        self.max_entries = max_entries or config.RESPONSE_CACHE_MAX_ENTRIES
+        self.persist = config.RESPONSE_CACHE_PERSIST if persist is None else persist
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+        self.db_path = os.path.join(self.cache_dir, 'response_cache.db')
+        self._db_ready = False
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if not self._db_ready:
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS responses (
+                        cache_key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        created REAL NOT NULL,
+                        accessed REAL NOT NULL
+                    )"""
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)')
+                self._db_ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def make_key(self, content: Any, model_name: str = None, generation_config: Dict[str, Any] = None,
+                 safety_settings: List[Any] = None, dataset_path: Optional[str] = None,
+                 system_instruction: Optional[str] = None) -> Optional[str]:
+        """Hash a request's content and model settings; None if part of the content cannot be identified"""
+        parts = []
+        for part in content if isinstance(content, list) else [content]:
+            if isinstance(part, str):
+                parts.append(['text', normalize_prompt(part)])
+            elif isinstance(part, Image.Image):
+                parts.append(['image', image_digest(part)])
+            # Uploaded files are covered by the dataset digest below
+        
+        dataset_digest = None
+        if dataset_path and os.path.exists(dataset_path):
+            dataset_digest = content_digests.get_digest(dataset_path)
+            if dataset_digest is None:
+                return None
+        
+        key = {
+            'model': model_name or config.GEMINI_MODEL_NAME,
+            'generation_config': config.GENERATION_CONFIG if generation_config is None else generation_config,
+            'safety_settings': config.SAFETY_SETTINGS if safety_settings is None else safety_settings,
+            'system_instruction': hashlib.sha256(system_instruction.encode()).hexdigest() if system_instruction else None,
+            'content': parts,
+            'dataset': dataset_digest
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+    
+    def get(self, key: Optional[str]) -> Optional[str]:
+        """Get a cached response, or None on a miss"""
+        if key is None:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(key, None)
+        
+        response = self._get_persisted(key, now) if self.persist else None
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return response
+    
+    def _get_persisted(self, key: str, now: float) -> Optional[str]:
+        try:
+            conn = self._get_connection()
+            row = conn.execute('SELECT response, created FROM responses WHERE cache_key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute('DELETE FROM responses WHERE cache_key = ?', (key,))
+                return None
+            conn.execute('UPDATE responses SET accessed = ? WHERE cache_key = ?', (now, key))
+            self._remember(key, row[0], row[1])
+            return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            return None
+    
+    def _remember(self, key: str, response: str, created: float):
+        with self._lock:
+            self._entries[key] = (response, created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def put(self, key: Optional[str], response: str):
+        """Cache a complete response"""
+        if key is None or not response:
+            return
+        now = time.time()
+        self._remember(key, response, now)
+        if not self.persist:
+            return
+        try:
+            conn = self._get_connection()
+            conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)', (key, response, now, now))
+            # Expire old entries, then evict the least recently used beyond the cap
+            conn.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM responses WHERE cache_key IN (SELECT cache_key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to persist cached response: {e}")
+    
+    def replay(self, response: str, chunk_size: int = None):
+        """Split a cached response into stream-sized chunks"""
+        chunk_size = chunk_size or config.RESPONSE_CACHE_REPLAY_CHUNK
+        for start in range(0, len(response), chunk_size):
+            yield response[start:start + chunk_size]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.persist:
+            self._get_connection().execute('DELETE FROM responses')
+        logger.info("Response cache cleared")
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+# Global response cache instance
+response_cache = ResponseCache()
@@ -0,0 +1,253 @@
+# Chunked ingestion for datasets too large to load as one DataFrame
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Callable, Iterator
+import numpy as np
+import pandas as pd
+from config import config
+from .keyed_locks import KeyedLocks
+
+logger = logging.getLogger(__name__)
+
+def get_available_memory() -> Optional[int]:
+    """Get the memory available to new allocations in bytes (MemAvailable, which counts reclaimable page cache)"""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def get_streaming_threshold() -> int:
+    """Get the file size above which datasets are ingested in streaming mode.
+    
+    An explicit STREAMING_INGEST_THRESHOLD wins. Otherwise files larger than a
+    quarter of available memory (parsed frames are usually several times larger
+    than the CSV text) are streamed, but never files below
+    STREAMING_MIN_THRESHOLD: streamed datasets are only analyzed as a sample.
+    """
+    if config.STREAMING_INGEST_THRESHOLD > 0:
+        return config.STREAMING_INGEST_THRESHOLD
+    
+    available_memory = get_available_memory()
+    if not available_memory:
+        return config.STREAMING_MIN_THRESHOLD
+    return max(config.STREAMING_MIN_THRESHOLD, available_memory // 4)
+
+class StreamingDataset:
+    """Handle for a large CSV that is processed in bounded-memory chunks.
+    
+    A single ingest pass builds per-column aggregates and a uniform reservoir
+    sample; `chunks()` and the helpers below make further full-data passes.
+    """
+    
+    def __init__(self, filepath: str, chunk_rows: int = None, sample_rows: int = None, seed: int = 0):
+        self.filepath = filepath
+        self.chunk_rows = chunk_rows or config.STREAMING_CHUNK_ROWS
+        self.sample_rows = sample_rows or config.STREAMING_SAMPLE_ROWS
+        self.seed = seed
+        self.row_count = 0
+        self.columns = []
+        self.sample = None
+        self._null_counts = None
+        self._numeric_stats = {}
+    
+    def chunks(self, columns: Optional[List[str]] = None, **read_csv_kwargs) -> Iterator[pd.DataFrame]:
+        """Iterate over the full dataset in chunks"""
+        return pd.read_csv(self.filepath, chunksize=self.chunk_rows, usecols=columns, **read_csv_kwargs)
+    
+    def ingest(self) -> 'StreamingDataset':
+        """Make one pass over the file to build aggregates and the representative sample"""
+        rng = np.random.default_rng(self.seed)
+        sample = None
+        sample_keys = np.empty(0)
+        
+        for chunk in self.chunks():
+            if not self.columns:
+                self.columns = chunk.columns.tolist()
+                self._null_counts = pd.Series(0, index=chunk.columns, dtype='int64')
+            
+            self.row_count += len(chunk)
+            self._null_counts = self._null_counts.add(chunk.isna().sum(), fill_value=0).astype('int64')
+            self._update_numeric_stats(chunk)
+            
+            # Reservoir sampling with random priorities: keep the rows with the smallest keys
+            chunk_keys = rng.random(len(chunk))
+            candidates = chunk if sample is None else pd.concat([sample, chunk], ignore_index=True)
+            keys = np.concatenate([sample_keys, chunk_keys])
+            if len(candidates) > self.sample_rows:
+                keep = np.sort(np.argpartition(keys, self.sample_rows)[:self.sample_rows])
+                candidates = candidates.iloc[keep].reset_index(drop=True)
+                keys = keys[keep]
+            sample, sample_keys = candidates, keys
+        
+        self.sample = sample if sample is not None else pd.DataFrame()
+        self.sample.attrs['datagent_sampled'] = True
+        self.sample.attrs['datagent_total_rows'] = self.row_count
+        logger.info(f"Streamed {self.row_count} rows from {self.filepath} (sample of {len(self.sample)} rows)")
+        return self
+    
+    def _update_numeric_stats(self, chunk: pd.DataFrame):
+        """Merge per-chunk moments into the running totals (Chan et al. parallel variance)"""
+        numeric = chunk.select_dtypes(include='number')
+        counts = numeric.count()
+        means = numeric.mean()
+        m2 = numeric.var(ddof=0) * counts
+        mins = numeric.min()
+        maxs = numeric.max()
+        
+        for column in numeric.columns:
+            n_b = int(counts[column])
+            if n_b == 0:
+                continue
+            stats = self._numeric_stats.get(column)
+            if stats is None:
+                self._numeric_stats[column] = {
+                    'count': n_b, 'mean': float(means[column]), 'm2': float(m2[column]),
+                    'min': float(mins[column]), 'max': float(maxs[column])
+                }
+                continue
+            n_a = stats['count']
+            delta = float(means[column]) - stats['mean']
+            total = n_a + n_b
+            stats['mean'] += delta * n_b / total
+            stats['m2'] += float(m2[column]) + delta ** 2 * n_a * n_b / total
+            stats['count'] = total
+            stats['min'] = min(stats['min'], float(mins[column]))
+            stats['max'] = max(stats['max'], float(maxs[column]))
+    
+    @property
+    def shape(self):
+        return (self.row_count, len(self.columns))
+    
+    def null_counts(self) -> pd.Series:
+        """Get exact null counts per column over the full dataset"""
+        return self._null_counts.copy() if self._null_counts is not None else pd.Series(dtype='int64')
+    
+    def describe(self) -> pd.DataFrame:
+        """Get exact summary statistics for numeric columns over the full dataset"""
+        rows = {}
+        for column, stats in self._numeric_stats.items():
+            count = stats['count']
+            rows[column] = {
+                'count': count,
+                'mean': stats['mean'],
+                'std': np.sqrt(stats['m2'] / (count - 1)) if count > 1 else np.nan,
+                'min': stats['min'],
+                'max': stats['max']
+            }
+        return pd.DataFrame(rows)
+    
+    def map_reduce(self, map_func: Callable[[pd.DataFrame], Any], reduce_func: Callable[[Any, Any], Any],
+                   columns: Optional[List[str]] = None):
+        """Apply map_func to every chunk and fold the partial results with reduce_func"""
+        result = None
+        for chunk in self.chunks(columns=columns):
+            partial = map_func(chunk)
+            result = partial if result is None else reduce_func(result, partial)
+        return result
+    
+    def value_counts(self, column: str) -> pd.Series:
+        """Get exact value counts for a column over the full dataset"""
+        counts = self.map_reduce(
+            lambda chunk: chunk[column].value_counts(),
+            lambda a, b: a.add(b, fill_value=0),
+            columns=[column]
+        )
+        return counts.astype('int64').sort_values(ascending=False) if counts is not None else pd.Series(dtype='int64')
+    
+    def groupby(self, by: str, column: str, agg: str = 'mean') -> pd.Series:
+        """Aggregate a column by group over the full dataset (sum, count, mean, min or max)"""
+        if agg not in ('sum', 'count', 'mean', 'min', 'max'):
+            raise ValueError(f"Unsupported streaming aggregation: {agg}")
+        
+        partial_aggs = ['sum', 'count'] if agg == 'mean' else [agg]
+        reduce_ops = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+        
+        def reduce_func(a, b):
+            combined = pd.concat([a, b])
+            return combined.groupby(level=0).agg({name: reduce_ops[name] for name in partial_aggs})
+        
+        result = self.map_reduce(
+            lambda chunk: chunk.groupby(by)[column].agg(partial_aggs),
+            reduce_func,
+            columns=[by, column]
+        )
+        if result is None:
+            return pd.Series(dtype='float64')
+        if agg == 'mean':
+            return result['sum'] / result['count']
+        return result[agg]
+    
+    def info(self) -> Dict[str, Any]:
+        """Get a summary of the streamed dataset"""
+        return {
+            'filepath': self.filepath,
+            'rows': self.row_count,
+            'columns': self.columns,
+            'sample_rows': len(self.sample) if self.sample is not None else 0,
+            'chunk_rows': self.chunk_rows
+        }
+    
+    def __repr__(self):
+        return f"StreamingDataset(rows={self.row_count}, columns={len(self.columns)}, sample_rows={self.info()['sample_rows']})"
+
+class StreamingDatasetRegistry:
+    """Keeps one ingested StreamingDataset per file, rebuilt when the file changes.
+    
+    Each entry holds a sample of up to STREAMING_SAMPLE_ROWS rows, so only the
+    most recently used files are kept.
+    """
+    
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or config.STREAMING_REGISTRY_MAX_ENTRIES
+        self._datasets = OrderedDict()
+        self._lock = threading.Lock()
+        self._path_locks = KeyedLocks()
+    
+    def _get_signature(self, filepath: str):
+        stat = os.stat(filepath)
+        return (stat.st_size, stat.st_mtime_ns)
+    
+    def _lookup(self, filepath: str):
+        with self._lock:
+            entry = self._datasets.get(filepath)
+            if entry is not None:
+                self._datasets.move_to_end(filepath)
+            return entry
+    
+    def get(self, filepath: str) -> StreamingDataset:
+        """Get the ingested dataset for a file, ingesting it on first use"""
+        filepath = os.path.abspath(filepath)
+        # Per-path lock so concurrent requests don't each stream the same file
+        with self._path_locks.hold(filepath):
+            signature = self._get_signature(filepath)
+            entry = self._lookup(filepath)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+            
+            dataset = StreamingDataset(filepath).ingest()
+            with self._lock:
+                self._datasets[filepath] = (signature, dataset)
+                self._datasets.move_to_end(filepath)
+                while len(self._datasets) > self.max_entries:
+                    evicted, _ = self._datasets.popitem(last=False)
+                    logger.info(f"Dropped ingested dataset {os.path.basename(evicted)} (registry limit reached)")
+            return dataset
+    
+    def peek(self, filepath: str) -> Optional[StreamingDataset]:
+        """Get an already ingested dataset without triggering ingestion"""
+        entry = self._lookup(os.path.abspath(filepath))
+        return entry[1] if entry is not None else None
+    
+    def invalidate(self, filepath: str):
+        """Forget the ingested dataset for a file"""
+        with self._lock:
+            self._datasets.pop(os.path.abspath(filepath), None)
+
+# Global registry instance
+streaming_registry = StreamingDatasetRegistry()
@@ -0,0 +1,4 @@
+# WSGI entry point for production servers: gunicorn -c gunicorn.conf.py
+import sys
+sys.path.append('.')
+from app import app